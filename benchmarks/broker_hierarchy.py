@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the time-step throughput of a flat broker with that of a broker tree.
+
+Runs the same federation through `helics-cli run` once with every federate on the root broker and once per group
+size with a tree of sub-brokers. Each federate publishes a value every step and subscribes to that of the next
+federate, so every step routes a message per federate through the brokers. Reports the time steps per second the
+federation reached and the wall time of the whole run, including startup.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+FEDERATE = """
+import sys
+import time
+
+import helics as h
+
+name, index, count, steps = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+fedinfo = h.helicsCreateFederateInfo()
+fedinfo.core_type = "zmq"
+fedinfo.core_init = "--federates=1"
+fedinfo.property[h.HELICS_PROPERTY_TIME_DELTA] = 1.0
+federate = h.helicsCreateValueFederate(name, fedinfo)
+pub = federate.register_global_publication(f"value{index}", h.HELICS_DATA_TYPE_DOUBLE)
+sub = federate.register_subscription(f"value{(index + 1) % count}")
+federate.enter_executing_mode()
+start = time.perf_counter()
+for t in range(1, steps + 1):
+    pub.publish(float(t))
+    federate.request_time(t)
+    sub.double
+elapsed = time.perf_counter() - start
+federate.disconnect()
+if index == 0:
+    with open("elapsed.txt", "w") as f:
+        f.write(str(elapsed))
+"""
+
+
+def write_federation(directory, federates, steps, group_size):
+    with open(os.path.join(directory, "federate.py"), "w") as f:
+        f.write(FEDERATE)
+    config = {
+        "name": "BrokerHierarchy",
+        "broker": {"group_size": group_size} if group_size else True,
+        "federates": [
+            {
+                "name": "federate{{ i }}",
+                "exec": f"{sys.executable} federate.py federate{{{{ i }}}} {{{{ i }}}} {federates} {steps}",
+                "count": federates,
+            }
+        ],
+    }
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump(config, f)
+
+
+def run_federation(federates, steps, group_size, timeout):
+    with tempfile.TemporaryDirectory() as directory:
+        write_federation(directory, federates, steps, group_size)
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "helics_cli.cli", "run", "--path", os.path.join(directory, "config.json"), "--silent", "--no-log-files"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            timeout=timeout,
+        )
+        wall = time.perf_counter() - start
+        with open(os.path.join(directory, "elapsed.txt")) as f:
+            elapsed = float(f.read())
+    return steps / elapsed, wall
+
+
+@click.command()
+@click.option("--federates", type=click.INT, default=64, help="Federates in the federation")
+@click.option("--steps", type=click.INT, default=200, help="Time steps each federate takes")
+@click.option("--group-size", "group_sizes", type=click.INT, multiple=True, default=[8], help="Federates per sub-broker, repeat for several trees")
+@click.option("--repeat", type=click.INT, default=3, help="Runs per layout")
+@click.option("--timeout", type=click.FLOAT, default=600.0, help="Seconds a run may take")
+def main(federates, steps, group_sizes, repeat, timeout):
+    layouts = [("flat", None)] + [(f"tree of {size}", size) for size in group_sizes]
+    for label, group_size in layouts:
+        results = [run_federation(federates, steps, group_size, timeout) for _ in range(repeat)]
+        rate = statistics.median(rate for rate, _ in results)
+        wall = statistics.median(wall for _, wall in results)
+        click.echo(f"{label:>16}: {rate:9.1f} steps/s, {wall:6.2f} s wall time with {federates} federates")
+
+
+if __name__ == "__main__":
+    main()
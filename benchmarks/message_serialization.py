@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Compare round-trip throughput of server/observer messages.
+
+The legacy path pickles message objects holding hand-formatted JSON through a `multiprocessing.Queue`, as helics-cli
+did before messages were binary encoded. The binary path uses `MessageHandler`. Formatting the result for the HTTP
+response is the same for both paths and is left out.
+"""
+import json
+import time
+from multiprocessing import Process, Queue
+
+import click
+
+from helics_cli.utils.message_handler import MessageHandler, SimpleMessage
+
+
+class LegacyMessage:
+    def __init__(self, message_type: str, message: str):
+        self.Type = message_type
+        self.Message = message
+
+    def __str__(self):
+        return f'{{"type": "{self.Type}", "message": "{self.Message}"}}'
+
+
+def make_result(size):
+    return {f"federate{i % 100}/value{i}": i * 0.5 for i in range(size)}
+
+
+def legacy_observer(to_helics, from_helics, size):
+    result = make_result(size)
+    while True:
+        message = to_helics.get(True)
+        if message is None:
+            return
+        json.loads(message.Message)
+        from_helics.put(LegacyMessage("QUERY_RESPONSE", result), True)
+
+
+def binary_observer(message_handler, size):
+    result = make_result(size)
+    while True:
+        message = message_handler.get_server()
+        if message.Type == "SIGNAL":
+            return
+        response = SimpleMessage("QUERY_RESPONSE", result, message.RequestId)
+        message_handler.send_server(response)
+
+
+def run_legacy(size, count):
+    to_helics, from_helics = Queue(), Queue()
+    process = Process(target=legacy_observer, args=(to_helics, from_helics, size))
+    process.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        to_helics.put(LegacyMessage("QUERY", '{"target":"' + "federate1" + '", "query": "values"}'), True)
+        from_helics.get(True)
+    elapsed = time.perf_counter() - start
+    to_helics.put(None)
+    process.join()
+    return elapsed
+
+
+def run_binary(size, count):
+    message_handler = MessageHandler(Queue(), Queue(), True)
+    process = Process(target=binary_observer, args=(message_handler, size))
+    process.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        message_handler.call(SimpleMessage("QUERY", {"target": "federate1", "query": "values"}))
+    elapsed = time.perf_counter() - start
+    message_handler.send_helics(SimpleMessage("SIGNAL", {"operation": "STOP"}))
+    process.join()
+    return elapsed
+
+
+@click.command()
+@click.option("--count", type=click.INT, default=2000, help="Round trips per payload size")
+def main(count):
+    for size in (1, 100, 10000, 100000, 1000000):
+        n = max(count * 10 // max(size, 10), 20) if size > 100 else count
+        legacy = run_legacy(size, n)
+        binary = run_binary(size, n)
+        click.echo(
+            f"{size:>7} values: legacy {n / legacy:9.1f} msg/s, binary {n / binary:9.1f} msg/s ({legacy / binary:.2f}x), {n} round trips"
+        )
+
+
+if __name__ == "__main__":
+    main()
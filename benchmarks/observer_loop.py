@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Measure observer CPU usage and time-grant latency.
+
+Runs the observer in a child process with federates stepping at a fixed pace in threads of this process,
+then reports the observer CPU time and the grant latency it recorded in the database. The grant latency runs from
+request_time returning the grant in the observer's grant thread to the loop handling it. A slow observer also shows in
+the federates' request_time, since their next grant waits for the observer's next request.
+"""
+import json
+import os
+import resource
+import sqlite3
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+
+import click
+import helics as h
+
+from helics_cli import observer
+from helics_cli.utils.message_handler import MessageHandler, SimpleMessage
+
+
+def run_federate(name, steps, pace, step_times):
+    fedinfo = h.helicsCreateFederateInfo()
+    fedinfo.core_type = "zmq"
+    fedinfo.core_init = "--federates=1"
+    fedinfo.property[h.HELICS_PROPERTY_TIME_DELTA] = 1.0
+    federate = h.helicsCreateValueFederate(name, fedinfo)
+    pub = federate.register_global_publication(f"{name}/value", h.HELICS_DATA_TYPE_DOUBLE)
+    federate.enter_executing_mode()
+    for t in range(steps):
+        time.sleep(pace)
+        pub.publish(float(t))
+        start = time.perf_counter()
+        federate.request_time(t + 1)
+        step_times.append(time.perf_counter() - start)
+    federate.finalize()
+
+
+def run_observer(n_federates, config_path, message_handler):
+    os.chdir(os.path.dirname(config_path))
+    observer.run(n_federates, config_path, "warning", message_handler)
+
+
+@click.command()
+@click.option("--federates", "n_federates", type=click.INT, default=4, help="Number of federates")
+@click.option("--steps", type=click.INT, default=200, help="Time steps per federate")
+@click.option("--pace", type=click.FLOAT, default=0.01, help="Seconds each federate spends computing per step")
+def main(n_federates, steps, pace):
+    directory = tempfile.mkdtemp(prefix="helics-cli-bench-")
+    config_path = os.path.join(directory, "config.json")
+    config = {
+        "name": "ObserverBenchmark",
+        "broker": {"observer": {}},
+        "federates": [{"name": f"federate{i}", "host": "localhost", "exec": "", "directory": "."} for i in range(n_federates)],
+    }
+    with open(config_path, "w") as f:
+        f.write(json.dumps(config))
+
+    message_handler = MessageHandler(Queue(), Queue(), True)
+    process = Process(target=run_observer, args=(n_federates, config_path, message_handler))
+    process.start()
+
+    step_times = []
+    threads = [threading.Thread(target=run_federate, args=(f"federate{i}", steps, pace, step_times)) for i in range(n_federates)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    message_handler.call(SimpleMessage("SIGNAL", {"operation": "RUNTO", "target_time": steps + 1}))
+    for t in threads:
+        t.join()
+    message_handler.call(SimpleMessage("SIGNAL", {"operation": "FASTFORWARD"}))
+    process.join()
+    wall = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = usage.ru_utime + usage.ru_stime
+    db = sqlite3.connect(os.path.join(directory, "helics-cli.db"))
+    metadata = dict(db.execute("SELECT name, value FROM MetaData"))
+
+    click.echo(f"federates: {n_federates}, steps: {steps}, pace: {pace * 1e3:.1f} ms")
+    click.echo(f"wall time: {wall:.3f} s, observer cpu: {cpu:.3f} s ({cpu / wall * 100:.1f}% of one core)")
+    click.echo(f"federate request_time: {sum(step_times) / len(step_times) * 1e3:.3f} ms mean, {max(step_times) * 1e3:.3f} ms max")
+    if "grant_latency_mean" in metadata:
+        click.echo(
+            f"observer grant latency: {float(metadata['grant_latency_mean']) * 1e6:.1f} us mean, "
+            f"{float(metadata['grant_latency_max']) * 1e6:.1f} us max"
+        )
+    if "write_steps" in metadata:
+        click.echo(f"observer database writes: {float(metadata['write_time_total']) / float(metadata['write_steps']) * 1e3:.3f} ms mean")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Measure how long helics-cli takes to start.
+
+Runs trivial commands in fresh interpreters and reports the median wall time of each, next to that of an empty
+interpreter. Exits with an error when a command takes longer than the budget, so slow imports at module level are
+caught. `--importtime` lists the modules that take longest to import.
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+COMMANDS = (["--help"], ["validate", "--help"], ["profile-analyze", "--help"], ["run", "--help"])
+
+
+def wall_time(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def slowest_imports(count):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import helics_cli.cli"], check=True, capture_output=True, text=True)
+    modules = []
+    # Lines are "import time: <self us> | <cumulative us> | <module>" after a header line
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+@click.command()
+@click.option("--repeat", type=click.INT, default=7, help="Runs per command")
+@click.option("--budget", type=click.FLOAT, default=150.0, help="Milliseconds a trivial command may take")
+@click.option("--importtime", is_flag=True, default=False, help="List the slowest imports of helics_cli.cli")
+def main(repeat, budget, importtime):
+    baseline = wall_time(["-c", "pass"], repeat)
+    click.echo(f"{'python -c pass':>40}: {baseline * 1e3:7.1f} ms")
+    slow = []
+    for command in COMMANDS:
+        elapsed = wall_time(["-m", "helics_cli.cli", *command], repeat)
+        click.echo(f"{'helics-cli ' + ' '.join(command):>40}: {elapsed * 1e3:7.1f} ms ({(elapsed - baseline) * 1e3:.1f} ms over python)")
+        if elapsed * 1e3 > budget:
+            slow.append(" ".join(command))
+    if importtime:
+        for cumulative, name in slowest_imports(15):
+            click.echo(f"{cumulative / 1e3:9.1f} ms  {name}")
+    if slow:
+        raise click.ClickException(f"Slower than {budget:.0f} ms: {', '.join(slow)}")
+
+
+if __name__ == "__main__":
+    main()
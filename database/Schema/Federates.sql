@@ -1,6 +1,28 @@
-CREATE TABLE Federates
+CREATE TABLE IF NOT EXISTS FederateNames
 (
-    name      VARCHAR,
-    granted   DECIMAL,
-    requested DECIMAL
-)
\ No newline at end of file
+    id   INTEGER PRIMARY KEY,
+    name VARCHAR UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS FederateTimes
+(
+    name_id   INTEGER NOT NULL REFERENCES FederateNames (id),
+    granted   REAL,
+    requested REAL
+);
+
+CREATE INDEX IF NOT EXISTS FederateTimes_name_granted ON FederateTimes (name_id, granted);
+
+CREATE VIEW IF NOT EXISTS Federates AS
+SELECT FederateNames.name, FederateTimes.granted, FederateTimes.requested
+FROM FederateTimes
+         JOIN FederateNames ON FederateNames.id = FederateTimes.name_id;
+
+CREATE TRIGGER IF NOT EXISTS Federates_insert
+    INSTEAD OF INSERT
+    ON Federates
+BEGIN
+    INSERT OR IGNORE INTO FederateNames(name) VALUES (NEW.name);
+    INSERT INTO FederateTimes(name_id, granted, requested)
+    VALUES ((SELECT id FROM FederateNames WHERE name = NEW.name), NEW.granted, NEW.requested);
+END;
@@ -1,9 +1,11 @@
-CREATE TABLE Messages
+CREATE TABLE IF NOT EXISTS Messages
 (
     sender       VARCHAR,
     destination  VARCHAR,
-    send_time    DECIMAL,
-    receive_time DECIMAL,
+    send_time    REAL,
+    receive_time REAL,
     value        TEXT,
     new_value    BOOLEAN DEFAULT FALSE
-)
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS Messages_sender_time ON Messages (sender, send_time);
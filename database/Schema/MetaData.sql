@@ -1,5 +1,5 @@
-CREATE TABLE MetaData
+CREATE TABLE IF NOT EXISTS MetaData
 (
     name  text,
     value text
-)
+);
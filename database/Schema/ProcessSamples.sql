@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS ProcessSamples
+(
+    name_id     INTEGER NOT NULL REFERENCES FederateNames (id),
+    sample_time REAL,
+    pid         INTEGER,
+    cpu_percent REAL,
+    rss         INTEGER,
+    read_bytes  INTEGER,
+    write_bytes INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS ProcessSamples_name_time ON ProcessSamples (name_id, sample_time);
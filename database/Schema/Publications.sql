@@ -1,8 +1,38 @@
-CREATE TABLE Publications
+CREATE TABLE IF NOT EXISTS PublicationKeys
 (
-    key       VARCHAR,
-    sender    VARCHAR,
-    pub_time  DECIMAL,
-    pub_value DECIMAL,
-    new_value BOOLEAN DEFAULT FALSE
-)
\ No newline at end of file
+    id        INTEGER PRIMARY KEY,
+    key       VARCHAR UNIQUE NOT NULL,
+    sender_id INTEGER REFERENCES FederateNames (id)
+);
+
+CREATE TABLE IF NOT EXISTS PublicationValues
+(
+    key_id    INTEGER NOT NULL REFERENCES PublicationKeys (id),
+    pub_time  REAL,
+    pub_value NUMERIC,
+    step      INTEGER DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS PublicationValues_key_time ON PublicationValues (key_id, pub_time);
+CREATE INDEX IF NOT EXISTS PublicationValues_step ON PublicationValues (step);
+
+CREATE VIEW IF NOT EXISTS Publications AS
+SELECT PublicationKeys.key,
+       FederateNames.name         AS sender,
+       PublicationValues.pub_time,
+       PublicationValues.pub_value,
+       PublicationValues.step     AS new_value
+FROM PublicationValues
+         JOIN PublicationKeys ON PublicationKeys.id = PublicationValues.key_id
+         LEFT JOIN FederateNames ON FederateNames.id = PublicationKeys.sender_id;
+
+CREATE TRIGGER IF NOT EXISTS Publications_insert
+    INSTEAD OF INSERT
+    ON Publications
+BEGIN
+    INSERT OR IGNORE INTO FederateNames(name) VALUES (NEW.sender);
+    INSERT OR IGNORE INTO PublicationKeys(key, sender_id)
+    VALUES (NEW.key, (SELECT id FROM FederateNames WHERE name = NEW.sender));
+    INSERT INTO PublicationValues(key_id, pub_time, pub_value, step)
+    VALUES ((SELECT id FROM PublicationKeys WHERE key = NEW.key), NEW.pub_time, NEW.pub_value, NEW.new_value);
+END;
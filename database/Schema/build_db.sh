@@ -4,3 +4,5 @@ sqlite3 ../helics-cli.db ".read Messages.sql"
 sqlite3 ../helics-cli.db ".read Federates.sql"
 sqlite3 ../helics-cli.db ".read MetaData.sql"
 sqlite3 ../helics-cli.db ".read Publications.sql"
+sqlite3 ../helics-cli.db ".read ProcessSamples.sql"
+sqlite3 ../helics-cli.db "PRAGMA user_version = 2; PRAGMA journal_mode = WAL;"
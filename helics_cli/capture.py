@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Capture the output of federation processes into timestamped, rotated log files
+"""
+import concurrent.futures
+import gzip
+import logging
+import os
+import queue
+import re
+import selectors
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a pipe at once
+READ_SIZE = 1024 * 1024
+# Bytes of each pipe's kernel buffer, so a burst of output fits while the reader is busy with other pipes
+PIPE_SIZE = 1024 * 1024
+# Bytes of output held in memory for the writer, beyond this output is dropped instead of blocking the processes
+MAX_PENDING = 256 * 1024 * 1024
+# Bytes of an unfinished line held back for its newline, output without newlines such as a progress bar or binary
+# data is written as lines of this length
+MAX_LINE = 1024 * 1024
+WRITE_BUFFER = 1024 * 1024
+MERGED_LOG = "federation.log"
+
+
+def _timestamp(now):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)) + f".{int(now % 1 * 1000):03d}"
+
+
+class RotatingLog:
+    """A buffered log file that is rotated by size and age.
+
+    On rotation the file is renamed right away and the older files are shifted to `<name>.1`, `<name>.2`, ... and
+    optionally gzip compressed by `archiver`, one rotation at a time, so writing continues while they are compressed.
+    At most `backups` old files are kept.
+    """
+
+    def __init__(self, filename, archiver, max_bytes=0, max_age=0, backups=5, compress=False):
+        self.filename = filename
+        self.archiver = archiver
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.compress = compress
+        self._rotations = 0
+        self._open()
+
+    def _open(self):
+        self.file = open(self.filename, "wb", buffering=WRITE_BUFFER)
+        self.size = 0
+        self.opened = time.monotonic()
+
+    def write(self, data):
+        if (self.max_bytes and self.size and self.size + len(data) > self.max_bytes) or (self.max_age and time.monotonic() - self.opened >= self.max_age):
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        self._rotations += 1
+        rotated = f"{self.filename}.rotating-{self._rotations}"
+        os.replace(self.filename, rotated)
+        self._open()
+        self.archiver.submit(self._archive, rotated)
+
+    def _archive(self, rotated):
+        suffix = ".gz" if self.compress else ""
+        if self.backups < 1:
+            os.remove(rotated)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.filename}.{i}{suffix}"):
+                os.replace(f"{self.filename}.{i}{suffix}", f"{self.filename}.{i + 1}{suffix}")
+        if self.compress:
+            with open(rotated, "rb") as f, gzip.open(f"{rotated}.gz", "wb", compresslevel=6) as out:
+                shutil.copyfileobj(f, out, WRITE_BUFFER)
+            os.remove(rotated)
+            rotated += ".gz"
+        os.replace(rotated, f"{self.filename}.1{suffix}")
+
+    def close(self):
+        self.file.close()
+
+
+class LogCapture:
+    """Read the output of processes from their pipes and write it to log files with a timestamp and name per line.
+
+    One reader thread waits on all pipes (one thread per pipe where pipes cannot be selected) and hands what it
+    reads to a writer thread, so a process never waits for the disk. When more than `MAX_PENDING` bytes are waiting
+    to be written, further output is dropped and the number of dropped bytes noted in the log and logged as a warning.
+    Unfinished lines are held back for their newline up to `MAX_LINE` bytes. With `merged` all lines also go to
+    `federation.log` in `directory`, in the order they were read.
+    """
+
+    def __init__(self, directory, max_bytes=0, max_age=0, backups=5, compress=False, merged=False):
+        self.options = {"max_bytes": max_bytes, "max_age": max_age, "backups": backups, "compress": compress}
+        self._archiver = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="log-archiver")
+        self._pending = queue.SimpleQueue()
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._dropped = {}
+        self._watches = {}
+        self._selector = selectors.DefaultSelector() if os.name == "posix" else None
+        self._reader = None
+        self._wakeup = None
+        self._closing = False
+        self.merged = RotatingLog(os.path.join(directory, MERGED_LOG), self._archiver, **self.options) if merged else None
+        self._writer = threading.Thread(target=self._write, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def watch(self, name, pattern):
+        """Return an Event that is set once a line of `name`'s output matches the regex `pattern`.
+
+        Lines are matched as the process wrote them, before their timestamp and name are added. Watch before `add`
+        to see the first lines.
+        """
+        event = threading.Event()
+        with self._lock:
+            self._watches.setdefault(name, []).append((re.compile(pattern, re.M), event))
+        return event
+
+    def add(self, name, pipe, filename, rotate=True):
+        """Capture `pipe`, the stdout of process `name`, into `filename`, which is never rotated without `rotate`"""
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+            except OSError:
+                # Limited by /proc/sys/fs/pipe-max-size
+                pass
+        options = self.options if rotate else {**self.options, "max_bytes": 0, "max_age": 0}
+        self._pending.put((name, None, RotatingLog(filename, self._archiver, **options)))
+        if self._selector is None:
+            threading.Thread(target=self._read_blocking, args=(name, pipe), name=f"log-{name}", daemon=True).start()
+            return
+        os.set_blocking(pipe.fileno(), False)
+        with self._lock:
+            self._selector.register(pipe, selectors.EVENT_READ, name)
+            if self._reader is None:
+                self._wakeup = os.pipe()
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+                self._reader = threading.Thread(target=self._read, name="log-reader", daemon=True)
+                self._reader.start()
+        # Wake the reader so it selects on the new pipe as well
+        os.write(self._wakeup[1], b"\0")
+
+    def _read(self):
+        while True:
+            with self._lock:
+                if len(self._selector.get_map()) <= 1 and self._closing:
+                    self._selector.close()
+                    os.close(self._wakeup[0])
+                    os.close(self._wakeup[1])
+                    return
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    os.read(key.fd, 4096)
+                    continue
+                try:
+                    data = os.read(key.fd, READ_SIZE)
+                except BlockingIOError:
+                    continue
+                self._received(key.data, data)
+                if not data:
+                    with self._lock:
+                        self._selector.unregister(key.fileobj)
+                    key.fileobj.close()
+
+    def _read_blocking(self, name, pipe):
+        while True:
+            data = pipe.read1(READ_SIZE) if hasattr(pipe, "read1") else pipe.read(READ_SIZE)
+            self._received(name, data)
+            if not data:
+                pipe.close()
+                return
+
+    def _received(self, name, data):
+        with self._lock:
+            if data and self._pending_bytes + len(data) > MAX_PENDING:
+                self._dropped[name] = self._dropped.get(name, 0) + len(data)
+                return
+            self._pending_bytes += len(data)
+        self._pending.put((name, time.time(), data))
+
+    def _write(self):
+        logs = {}
+        partial = {}
+        while True:
+            item = self._pending.get()
+            while True:
+                if item is None:
+                    for name, log in logs.items():
+                        self._report_dropped(log, name, time.time())
+                        if partial.get(name):
+                            self._write_lines(log, name, time.time(), partial.pop(name) + b"\n")
+                        log.close()
+                    if self.merged is not None:
+                        self.merged.close()
+                    return
+                name, now, data = item
+                if now is None:
+                    logs[name] = data
+                elif not data:
+                    # The process closed its output
+                    self._report_dropped(logs[name], name, now)
+                    if partial.get(name):
+                        self._write_lines(logs[name], name, now, partial.pop(name) + b"\n")
+                    logs.pop(name).close()
+                else:
+                    with self._lock:
+                        self._pending_bytes -= len(data)
+                    self._report_dropped(logs[name], name, now)
+                    data = partial.pop(name, b"") + data
+                    cut = data.rfind(b"\n") + 1
+                    if cut:
+                        self._write_lines(logs[name], name, now, data[:cut])
+                    if len(data) - cut > MAX_LINE:
+                        for start in range(cut, len(data) - MAX_LINE + 1, MAX_LINE):
+                            self._write_lines(logs[name], name, now, data[start : start + MAX_LINE] + b"\n")
+                        cut = len(data) - (len(data) - cut) % MAX_LINE
+                    if cut < len(data):
+                        partial[name] = data[cut:]
+                try:
+                    item = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            # Flush whenever the writer caught up, so logs are current without writing every line on its own
+            for log in logs.values():
+                log.flush()
+            if self.merged is not None:
+                self.merged.flush()
+
+    def _report_dropped(self, log, name, now):
+        with self._lock:
+            dropped = self._dropped.pop(name, 0)
+        if dropped:
+            logger.warning(f"Dropped {dropped} bytes of output of {name} while the disk fell behind")
+            self._write_lines(log, name, now, f"[helics-cli dropped {dropped} bytes of output while the disk fell behind]\n".encode(), output=False)
+
+    def _match(self, name, data):
+        with self._lock:
+            watches = self._watches.get(name)
+            if not watches:
+                return
+            text = data.decode(errors="replace")
+            remaining = []
+            for pattern, event in watches:
+                if pattern.search(text):
+                    event.set()
+                else:
+                    remaining.append((pattern, event))
+            self._watches[name] = remaining
+
+    def _write_lines(self, log, name, now, data, output=True):
+        if output:
+            self._match(name, data)
+        prefix = f"[{_timestamp(now)}] [{name}] ".encode()
+        lines = prefix + data[:-1].replace(b"\n", b"\n" + prefix) + b"\n"
+        log.write(lines)
+        if self.merged is not None:
+            self.merged.write(lines)
+
+    def close(self, timeout=5.0):
+        """Write what was read so far and close the log files, waiting up to `timeout` seconds for open pipes"""
+        if self._reader is not None:
+            with self._lock:
+                self._closing = True
+            os.write(self._wakeup[1], b"\0")
+            self._reader.join(timeout)
+        self._pending.put(None)
+        self._writer.join()
+        self._archiver.shutdown(wait=True)
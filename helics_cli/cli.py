@@ -8,26 +8,32 @@ import logging
 import os
 import shlex
 import shutil
+import socket
 import subprocess
+import threading
+import time
 from multiprocessing import Queue
 
 import click
 
 from .utils.message_handler import MessageHandler
 from .utils.process import ProcessHandler
-from . import observer
 from ._version import __version__
 from .exceptions import HELICSRuntimeError
-from .server import startup
-from .status_checker import CheckStatusThread
 from .utils import extra
 from .utils.extra import echo
-from . import profile as p
+from . import config as helics_config
+
+# Modules that import helics, flask, matplotlib or numpy are imported by the commands that use them, so that the
+# other commands start quickly
 
 logger = logging.getLogger(__name__)
 
+# Seconds between live summaries of the resource monitor
+RESOURCE_REPORT_INTERVAL = 10.0
+
 process_handler = ProcessHandler(
-    process_list=[], output_list=[], has_web=False, message_handler=MessageHandler(Queue(), Queue(), False), use_broker_process=False
+    process_list=[], output_list=[], has_web=False, message_handler=MessageHandler(Queue(), Queue(), False, Queue(maxsize=64)), use_broker_process=False
 )
 
 
@@ -65,11 +71,15 @@ def _get_version():
     ).strip()
 
 
-VERSION = _get_version()
+def _print_version(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    click.echo(_get_version())
+    ctx.exit()
 
 
 @click.group()
-@click.version_option(VERSION, "--version")
+@click.option("--version", is_flag=True, expose_value=False, is_eager=True, callback=_print_version, help="Show the version and exit.")
 @click.option("--verbose", "-v", count=True)
 @click.pass_context
 def cli(ctx, verbose):
@@ -142,8 +152,144 @@ def setup(name, path, purge):
     help="Invert plot",
 )
 @click.option("--save", prompt=True, prompt_required=False, type=click.Path(), default=None, help="Path to save the plot")
-def profile_plot(path, save, invert):
-    p.plot(p.profile(path, invert), save=save, kind="realtime")
+@click.option("--start", type=click.FLOAT, default=None, help="Start of the plotted window in seconds from the first interval")
+@click.option("--end", type=click.FLOAT, default=None, help="End of the plotted window in seconds from the first interval")
+@click.option("--html", type=click.Path(file_okay=False), default=None, help="Write an interactive zoomable timeline to this directory")
+@click.option("--cache/--no-cache", default=True, help="Reuse and update the parsed profile cache stored next to profile.txt")
+def profile_plot(path, save, start, end, html, invert, cache):
+    from . import profile as p
+
+    intervals = p.intervals(p.load(path, cache), invert)
+    if html is not None:
+        echo(f"Wrote {p.write_html(intervals, html, kind='realtime', start=start, end=end)}")
+    if html is None or save is not None:
+        p.plot_intervals(intervals, save=save, kind="realtime", start=start, end=end)
+
+
+@cli.command()
+@click.option(
+    "--path",
+    required=True,
+    type=click.Path(file_okay=True, exists=True),
+    help="Path to profile.txt that describes profiling results of a federation",
+)
+@click.option("--format", "output_format", type=click.Choice(["table", "json"]), default="table", help="Output format")
+@click.option("--steps", is_flag=True, default=False, help="Include the critical path federate of every time step in JSON output")
+@click.option("--cache/--no-cache", default=True, help="Reuse and update the parsed profile cache stored next to profile.txt")
+def profile_analyze(path, output_format, steps, cache):
+    """
+    Summarize time spent inside and outside HELICS, grant latency and critical path per federate
+    """
+    from . import profile as p
+
+    analysis = p.analyze(p.load(path, cache))
+    if output_format == "json":
+        click.echo(json.dumps(p.analysis_json(analysis, steps), indent=4))
+    else:
+        click.echo(p.analysis_table(analysis))
+
+
+@cli.command()
+@click.option(
+    "--path",
+    "paths",
+    required=True,
+    multiple=True,
+    type=click.Path(file_okay=True, exists=True),
+    help="Path to a profile.txt, give two or more; the first one is the baseline",
+)
+@click.option("--threshold", type=click.FLOAT, default=10.0, help="Percent increase of any metric that counts as a regression")
+@click.option("--format", "output_format", type=click.Choice(["table", "json"]), default="table", help="Output format")
+@click.option("--cache/--no-cache", default=True, help="Reuse and update the parsed profile cache stored next to profile.txt")
+def profile_diff(paths, threshold, output_format, cache):
+    """
+    Compare profiles against the first one and exit with an error if any regressed by more than the threshold
+    """
+    from . import profile as p
+
+    if len(paths) < 2:
+        raise click.BadParameter("at least two profiles are required", param_hint="--path")
+    baseline = p.analyze(p.load(paths[0], cache))
+    comparisons = {path: p.compare(baseline, p.analyze(p.load(path, cache)), threshold) for path in paths[1:]}
+
+    if output_format == "json":
+        click.echo(json.dumps({"baseline": paths[0], "threshold": threshold, "comparisons": comparisons}, indent=4))
+    else:
+        for path, comparison in comparisons.items():
+            click.echo(f"{paths[0]} -> {path}")
+            click.echo(p.comparison_table(comparison))
+            click.echo()
+
+    regressions = [f"{path}: {regression}" for path, comparison in comparisons.items() for regression in comparison["regressions"]]
+    if regressions:
+        raise click.ClickException(f"Performance regression above {threshold}%:\n" + "\n".join(regressions))
+
+
+# Numbers of the HELICS log level names, the broker logs a record if the level is at least that of the record
+HELICS_LOG_LEVELS = {
+    "none": -4,
+    "no_print": -4,
+    "noprint": -4,
+    "error": 0,
+    "profiling": 2,
+    "warning": 3,
+    "summary": 6,
+    "connections": 9,
+    "interfaces": 12,
+    "timing": 15,
+    "data": 18,
+    "debug": 21,
+    "trace": 24,
+}
+
+
+def _log_level_number(level: str):
+    """The number of a HELICS log level given by name or number, None if it is neither"""
+    level = level.strip().lower()
+    if level in HELICS_LOG_LEVELS:
+        return HELICS_LOG_LEVELS[level]
+    try:
+        return int(level)
+    except ValueError:
+        return None
+
+
+def _report_profile(profiler_txt: str, interval: float, finished: threading.Event):
+    """Print running statistics of the profile HELICS writes during a run every `interval` seconds"""
+    from . import profile as p
+
+    tail = p.ProfileTail(profiler_txt)
+    while not finished.wait(interval):
+        while tail.poll() > 0:
+            pass
+        if tail.federates:
+            click.echo(p.live_table(tail.summary()))
+
+
+def _report_resources(monitor, interval: float, finished: threading.Event):
+    """Print the resource use of the federation's processes over the last sample every `interval` seconds"""
+    from . import monitor as resources
+
+    while not finished.wait(interval):
+        summary = monitor.summary
+        if summary:
+            click.echo(resources.summary_table(summary, monitor.limiting({name: s["cpu_percent"] for name, s in summary.items()})))
+
+
+def _default_concurrency():
+    from .launcher import DEFAULT_CONCURRENCY
+
+    return DEFAULT_CONCURRENCY
+
+
+def _save_profile(profile_log: str, profiler_txt: str):
+    """Write the profiling records logged by the broker to profile.txt for profile-plot and profile-analyze"""
+    from . import profile as p
+
+    try:
+        p.extract_profile(profile_log, profiler_txt)
+    except OSError as e:
+        echo(f"Unable to write {profiler_txt}: {e}", status="warning")
 
 
 @cli.command()
@@ -170,11 +316,61 @@ def profile_plot(path, save, invert):
     default=False,
     help="Profile flag",
 )
+@click.option(
+    "--profile-interval",
+    type=click.FLOAT,
+    default=10.0,
+    help="Seconds between live profiling summaries on the console with --profile, 0 to disable",
+)
+@click.option(
+    "--max-parallel",
+    type=click.IntRange(min=1),
+    default=_default_concurrency,
+    help="Number of processes started at the same time",
+)
+@click.option(
+    "--monitor-interval",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    help="Seconds between samples of the CPU, memory and I/O use of every process, 0 to disable",
+)
+@click.option(
+    "--monitor-output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="CSV file, or helics-cli database ending in .db, to record resource samples to",
+)
+@click.option("--log-max-size", type=click.FloatRange(min=0), default=0.0, help="Rotate a log file once it reaches this many MB, 0 to disable")
+@click.option("--log-rotate-interval", type=click.FloatRange(min=0), default=0.0, help="Rotate log files every this many seconds, 0 to disable")
+@click.option("--log-backups", type=click.IntRange(min=0), default=5, help="Number of rotated files kept per log")
+@click.option("--compress-logs", is_flag=True, default=False, help="Compress rotated log files with gzip")
+@click.option("--merged-log", is_flag=True, default=False, help="Also write the output of all processes to federation.log")
 @click.option("--web", "-w", is_flag=True, default=False, help="Run the web interface on startup")
-def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, profile):
+def run(
+    path,
+    silent,
+    no_log_files,
+    broker_loglevel,
+    web,
+    no_kill_on_error,
+    profile,
+    profile_interval,
+    max_parallel,
+    monitor_interval,
+    monitor_output,
+    log_max_size,
+    log_rotate_interval,
+    log_backups,
+    compress_logs,
+    merged_log,
+):
     """
     Run HELICS federation
     """
+    from . import capture, hierarchy, launcher, placement, transport
+    from . import monitor as resources
+    from .status_checker import ProcessSupervisor
+
     log = not no_log_files
     kill_on_error = not no_kill_on_error
     path_to_config = os.path.abspath(path)
@@ -187,30 +383,70 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
         )
         return None
 
-    with open(path_to_config) as f:
-        config = json.loads(f.read())
+    try:
+        config = helics_config.load(path_to_config)
+    except HELICSRuntimeError as e:
+        raise click.ClickException(str(e))
 
     logger.debug("Read config: %s", config)
 
     if not silent:
         echo("Running federation: {name}".format(name=config["name"]), status="info")
 
-    if web and "broker" in config.keys() and "observer" in config["broker"].keys():
+    run_finished = threading.Event()
+    profile_log = None
+    specs = []
+    broker_ready = None
+    log_capture = None
+    if log:
+        log_capture = capture.LogCapture(
+            path, max_bytes=int(log_max_size * 2**20), max_age=log_rotate_interval, backups=log_backups, compress=compress_logs, merged=merged_log
+        )
+
+    try:
+        federate_hosts = {f["name"]: f["host"] for f in config["federates"]}
+        transports = {f["host"]: transport.for_host(f["host"], config.get("hosts", {})) for f in config["federates"]}
+        placements = {f["name"]: placement.resources(f) for f in config["federates"]}
+        broker = config.get("broker", False)
+        if broker is True or (isinstance(broker, dict) and "observer" not in broker):
+            placements["broker"] = placement.resources(broker)
+        if config.get("pinning"):
+            # Only the cpus of this machine are known
+            local = {name: options for name, options in placements.items() if name == "broker" or transports[federate_hosts[name]] is None}
+            placement.auto_pin(local, config["pinning"], reserve=("broker",))
+    except HELICSRuntimeError as e:
+        raise click.ClickException(str(e))
+
+    if web and isinstance(config["broker"], dict) and "observer" in config["broker"]:
         process_handler.message_handler.set_enable(True)
 
+    spawns_broker = config["broker"] is not False and not (isinstance(config["broker"], dict) and "observer" in config["broker"])
+    if profile and spawns_broker and (web or (profile_interval > 0 and not silent)):
+        # The broker only writes a profiler file when it exits, logged profiling records are written as they happen
+        profile_log = os.path.join(path, "broker.log")
+
     if web:
+        from .server import startup
+
         process_handler.run_web(
             target=startup,
             args=(
                 False,
                 path_to_config,
                 process_handler.message_handler,
+                profile_log,
             ),
             daemon=True,
         )
 
+    remote_hosts = [host for host, t in transports.items() if t is not None]
+    # The broker listens beyond this machine only for hosts reached over the network
+    over_network = any(isinstance(transports[host], transport.SshTransport) for host in remote_hosts)
+
     if "broker" in config.keys() and config["broker"] is not False:
         if config["broker"] is not True and "observer" in config["broker"].keys():
+            from . import observer
+
             process_handler.run_broker(
                 target=observer.run,
                 args=(
@@ -218,6 +454,7 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
                     path_to_config,
                     broker_loglevel,
                     process_handler.message_handler,
+                    config,
                 ),
                 daemon=True,
             )
@@ -228,18 +465,33 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
                 profiler_txt = os.path.join(os.path.abspath(os.path.expanduser(path)), "profile.txt")
                 if os.path.exists(profiler_txt):
                     os.remove(profiler_txt)
-                cmd += " --profiler=profile.txt"
-            broker_o = open(os.path.join(path, "broker.log"), "w")
+                if profile_log is not None:
+                    cmd += " --profiler=log"
+                    number = _log_level_number(broker_loglevel)
+                    if number is not None and number < HELICS_LOG_LEVELS["profiling"]:
+                        if click.get_current_context().get_parameter_source("broker_loglevel") is not click.core.ParameterSource.DEFAULT:
+                            echo(f"Raising the broker log level from {broker_loglevel} to profiling to log profiling records", status="warning")
+                        broker_loglevel = "profiling"
+                    if profile_interval > 0 and not silent:
+                        threading.Thread(target=_report_profile, args=(profile_log, profile_interval, run_finished), name="profile-tail", daemon=True).start()
+                else:
+                    cmd += " --profiler=profile.txt"
+            if over_network:
+                cmd += " --ipv4"
             cmd = cmd.format(num_fed=len(config["federates"]), log_level=broker_loglevel)
-            broker_subprocess = subprocess.Popen(
-                shlex.split(cmd),
-                cwd=os.path.abspath(os.path.expanduser(path)),
-                stdout=broker_o,
-                stderr=broker_o,
+            broker_ready = config["broker"].get("ready") if isinstance(config["broker"], dict) else None
+            specs.append(
+                launcher.process_spec(
+                    "broker",
+                    cmd,
+                    os.path.abspath(os.path.expanduser(path)),
+                    log=os.path.join(path, "broker.log"),
+                    ready=broker_ready,
+                    placement=placements["broker"],
+                    # The live profile follows broker.log and profile.txt is extracted from it at the end
+                    rotate_log=profile_log is None,
+                )
             )
-            broker_subprocess.name = "broker"
-            process_handler.process_list.append(broker_subprocess)
-            process_handler.output_list.append(broker_o)
     else:
         broker_o = open(os.path.join(path, "broker.log"), "w")
         _ = subprocess.Popen(
@@ -249,49 +501,107 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
             stderr=broker_o,
         )
 
+    # Federates reach the broker through a tree of sub-brokers, at least one on each other host unless turned off
+    host_env = {}
+    broker_options = config["broker"] if isinstance(config["broker"], dict) else {}
+    if config["broker"] is not False and (remote_hosts or "group_size" in broker_options):
+        address = broker_options.get("address", socket.getfqdn() if over_network else "127.0.0.1")
+        if broker_options.get("subbrokers", True) or "group_size" in broker_options:
+            subbrokers, host_env = hierarchy.broker_tree(federate_hosts, remote_hosts, broker_options.get("group_size"), address)
+        else:
+            subbrokers = []
+            host_env = {f["name"]: {"HELICS_BROKER_ADDRESS": address} for f in config["federates"] if f["host"] in remote_hosts}
+        for subbroker in subbrokers:
+            cmd = "helics_broker -f {num_fed} --loglevel={log_level} --broker_address=tcp://{parent} --port={port}".format(
+                num_fed=subbroker["federates"], log_level=broker_loglevel, parent=subbroker["parent"], port=subbroker["port"]
+            )
+            if over_network:
+                cmd += " --ipv4"
+            host_transport = transports[subbroker["host"]]
+            specs.append(
+                launcher.process_spec(
+                    subbroker["name"],
+                    cmd,
+                    os.path.abspath(os.path.expanduser(path)) if host_transport is None else host_transport.directory(path, "."),
+                    log=os.path.join(path, f"{subbroker['name']}.log") if log is True else None,
+                    depends_on=["broker"] if broker_ready is not None else [],
+                    transport=host_transport,
+                )
+            )
+        if not silent and subbrokers:
+            echo(f"Running {len(subbrokers)} sub-brokers", status="info")
+
     for f in config["federates"]:
+        federate_transport = transports[f["host"]]
         if not silent:
             echo(
-                "Running federate {name} as a background process".format(name=f["name"]),
+                "Running federate {name} as a background process{on}".format(name=f["name"], on="" if federate_transport is None else f" on {f['host']}"),
                 status="info",
             )
-
-        if log is True:
-            o = open(os.path.join(path, "{}.log".format(f["name"])), "w")
-        else:
-            o = None
-        try:
-            directory = os.path.join(path, f["directory"])
-
-            env = dict(os.environ)
-            if "env" in f:
-                for k, v in f["env"].items():
-                    env[k] = v
-            p = subprocess.Popen(
-                shlex.split(f["exec"]),
-                cwd=os.path.abspath(os.path.expanduser(directory)),
-                stdout=o,
-                stderr=o,
-                env=env,
+        depends_on = list(f.get("depends_on", []))
+        if broker_ready is not None and "broker" not in depends_on:
+            # Federates only start once the broker passed its readiness check
+            depends_on.append("broker")
+        specs.append(
+            launcher.process_spec(
+                f["name"],
+                f["exec"],
+                os.path.abspath(os.path.expanduser(os.path.join(path, f["directory"])))
+                if federate_transport is None
+                else federate_transport.directory(path, f["directory"]),
+                log=os.path.join(path, "{}.log".format(f["name"])) if log is True else None,
+                env={**host_env.get(f["name"], {}), **f.get("env", {})} or None,
+                depends_on=depends_on,
+                ready=f.get("ready"),
+                placement=placements[f["name"]],
+                stage=f.get("stage", 0),
+                transport=federate_transport,
             )
+        )
 
-            p.name = f["name"]
-        except FileNotFoundError as e:
+    try:
+        timing = launcher.launch(specs, process_handler.process_list, process_handler.output_list, max_parallel, log_capture)
+    except (FileNotFoundError, HELICSRuntimeError) as e:
+        for p in process_handler.process_list:
+            p.kill()
+        for o in process_handler.output_list:
+            o.close()
+        if log_capture is not None:
+            log_capture.close()
+        if isinstance(e, FileNotFoundError):
             raise click.ClickException("FileNotFoundError: {}".format(e))
-        process_handler.process_list.append(p)
-        if o is not None:
-            process_handler.output_list.append(o)
+        raise click.ClickException(str(e))
+    if not silent and timing:
+        echo(f"Started {len(timing)} processes in {max(t['ready'] for t in timing.values()):.3f} s", status="info")
 
-    t = CheckStatusThread(process_handler.process_list, kill_on_error)
+    supervisor = ProcessSupervisor(process_handler.process_list, kill_on_error)
+    monitor = None
+    if monitor_interval > 0:
+        try:
+            monitor = resources.ResourceMonitor(
+                # Processes on other hosts are not visible in /proc here
+                [p for p in process_handler.process_list if p.host == "localhost"],
+                monitor_interval,
+                run_finished,
+                output=monitor_output,
+                cpus={name: options.get("cpus") for name, options in placements.items()},
+            )
+        except HELICSRuntimeError as e:
+            echo(str(e), status="warning")
+    if monitor is not None:
+        monitor.start()
+        if not silent:
+            threading.Thread(
+                target=_report_resources, args=(monitor, max(monitor_interval, RESOURCE_REPORT_INTERVAL), run_finished), name="resource-report", daemon=True
+            ).start()
 
     try:
-        t.start()
+        supervisor.start()
         echo(
             "Waiting for {} processes to finish ...".format(len(process_handler.process_list)),
             status="info",
         )
-        for p in process_handler.process_list:
-            p.wait()
+        supervisor.wait()
     except KeyboardInterrupt:
         echo("Warning: User interrupted processes. Terminating safely ...", status="info")
         process_handler.shutdown()
@@ -312,12 +622,37 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
             for p in process_handler.process_list:
                 p.kill()
     finally:
+        run_finished.set()
+        if log_capture is not None:
+            log_capture.close()
+        if profile_log is not None:
+            _save_profile(profile_log, os.path.join(path, "profile.txt"))
+        hosts = {p.name: p.host for p in process_handler.process_list}
         for p in process_handler.process_list:
             if p.returncode != 0 and p.returncode is not None:
                 echo(
-                    "Process {} exited with return code {}".format(p.name, p.returncode),
+                    "Process {} exited with return code {}{}".format(p.name, p.returncode, "" if p.host == "localhost" else f" on {p.host}"),
                     status="error",
                 )
+        if monitor is not None:
+            monitor.join()
+        for name, status in supervisor.status.items():
+            if status["max_rss"] is None and monitor is not None and name in monitor.totals and monitor.totals[name]["max_rss"]:
+                # The peak sampled from /proc is the process's own, unlike the one wait4 reports
+                status["max_rss"] = monitor.totals[name]["max_rss"]
+            if status["runtime"] is not None and not silent:
+                if hosts.get(name, "localhost") != "localhost":
+                    # wait4 measured the local ssh or shell process
+                    echo(f"Process {name} on {hosts[name]}: return code {status['returncode']}, runtime {status['runtime']:.3f} s", status="info")
+                    continue
+                max_rss = "not above helics-cli's" if status["max_rss"] is None else f"{status['max_rss'] / 2**20:.1f} MB"
+                echo(f"Process {name}: return code {status['returncode']}, runtime {status['runtime']:.3f} s, peak RSS {max_rss}", status="info")
+        if monitor is not None and not silent:
+            runtimes = {name: status["runtime"] for name, status in supervisor.status.items()}
+            limiting = monitor.limiting({name: 100 * t["cpu"] / runtimes[name] for name, t in monitor.totals.items() if runtimes.get(name)})
+            click.echo(resources.totals_table(monitor.totals, runtimes, limiting))
+            if limiting is not None:
+                echo(f"Federate {limiting} kept its cpus busiest and limits the federation's throughput", status="info")
     echo(
         "Done.",
         status="info",
@@ -332,27 +667,33 @@ def run(path, silent, no_log_files, broker_loglevel, web, no_kill_on_error, prof
     default="./",
     help="Path to config.json file that describes how to run a federation",
 )
-def validate(path):
+@click.option("--expand", is_flag=True, default=False, help="Print the config with federate templates expanded")
+def validate(path, expand):
     """
     Validate config.json
     """
     path = os.path.abspath(path)
 
-    with open(path) as f:
-        config = json.loads(f.read())
-
-    if set(list(config.keys())) == {"name", "broker", "federates"}:
-        echo("Missing or additional keys found in config.json", status="warning")
-
-    echo(" - Valid keys in config.json", status="info")
+    try:
+        with open(path) as f:
+            config, warnings = helics_config.validate(json.load(f))
+    except json.JSONDecodeError as e:
+        raise click.ClickException(f"{path} is not valid JSON: {e}")
+    except helics_config.ConfigError as e:
+        raise click.ClickException(str(e).replace("config.json", path, 1))
+
+    for location, message in warnings:
+        echo(f"{location}: {message}", status="warning")
+    from .transport import LOCAL_HOSTS
+
+    hosts = config.get("hosts", {})
+    for f in config["federates"]:
+        if f["host"] not in hosts and f["host"] not in LOCAL_HOSTS:
+            echo(f"Federate {f['name']} runs on {f['host']}, which is not in hosts and is reached through ssh", status="warning")
 
-    for i, f in enumerate(config["federates"]):
-        assert "name" in f.keys(), "Missing name in federate number {i}".format(i=i)
-        assert set(list(f.keys())) == {"name", "host", "exec", "directory"}, "Missing or additional keys found in federates {} in config.json".format(
-            f["name"]
-        )
-        echo("     - Valid keys in federate {}".format(f["name"]), status="info")
-        assert f["host"] == "localhost", "Multi machine support is currently not available. Please contact the developer."
+    echo(f" - Valid config.json with {len(config['federates'])} federates", status="info")
+    if expand:
+        click.echo(json.dumps(config, indent=4))
 
     return None
 
@@ -367,6 +708,8 @@ def validate(path):
 @click.option("--path", type=click.Path(exists=True), default="./", help="Internal path to config file used for filtering output")
 @click.option("--broker_loglevel", "--loglevel", "-l", type=click.INT, default=2, help="Log level for HELICS broker")
 def observe(n_federates: int, path: str, log_level) -> int:
+    from . import observer
+
     return observer.run(n_federates, path, log_level)
 
 
@@ -379,6 +722,8 @@ def observe(n_federates: int, path: str, log_level) -> int:
 )
 @click.option("--path", type=click.Path(exists=True), default="./", help="Path for database file")
 def server(browser: bool, path: str):
+    from .server import startup
+
     startup(browser, path)
 
 
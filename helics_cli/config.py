@@ -1,4 +1,294 @@
 # -*- coding: utf-8 -*-
 """
 HELICS config
+
+The schema of config.json is compiled once into nested checking functions, so validating a config with thousands of
+federates takes milliseconds. `load` caches parsed configs by modification time, and child processes such as the
+observer are handed the parsed config instead of reading the file again.
 """
+import json
+import logging
+import os
+
+from .exceptions import HELICSRuntimeError
+from . import template, transport
+from .placement import parse_cpus, parse_memory
+
+logger = logging.getLogger(__name__)
+
+TYPE_NAMES = {bool: "boolean", int: "integer", float: "number", str: "string", list: "list", dict: "object"}
+# Errors listed in the message of a ConfigError, a template can repeat one mistake for thousands of federates
+MAX_REPORTED_ERRORS = 20
+
+
+class ConfigError(HELICSRuntimeError):
+    """A config that does not match the schema, `errors` holds (location, message) pairs such as ("federates[2].exec", "is required")"""
+
+    def __init__(self, filename, errors):
+        self.filename = filename
+        self.errors = errors
+        lines = [f"  {location}: {message}" for location, message in errors[:MAX_REPORTED_ERRORS]]
+        if len(errors) > MAX_REPORTED_ERRORS:
+            lines.append(f"  ... and {len(errors) - MAX_REPORTED_ERRORS} more")
+        super().__init__("Invalid config {}:\n{}".format(filename, "\n".join(lines)))
+
+
+def _check_memory(value):
+    if value.__class__ is not int:
+        parse_memory(value)
+
+
+def _check_cpus(value):
+    if value.__class__ is not int:
+        parse_cpus(value)
+
+
+READY = {
+    "type": dict,
+    "keys": {
+        "port": {"type": int, "min": 1},
+        "host": {"type": str},
+        "file": {"type": str},
+        "log": {"type": str},
+        "delay": {"type": (int, float), "min": 0},
+        "timeout": {"type": (int, float), "min": 0},
+    },
+    "one_of": ("port", "file", "log", "delay"),
+}
+
+RESOURCES = {
+    "cpus": {"type": (int, str, list), "check": _check_cpus},
+    "nice": {"type": int},
+    "memory_limit": {"type": (int, str), "check": _check_memory},
+    "threads": {"type": int, "min": 1},
+}
+
+OBSERVER = {
+    "type": dict,
+    "keys": {
+        "name": {"type": str},
+        "host": {"type": str},
+        "directory": {"type": str},
+        "include": {"type": list, "items": {"type": str}},
+        "exclude": {"type": list, "items": {"type": str}},
+    },
+}
+
+BROKER = {
+    "type": (bool, dict),
+    "default": False,
+    "keys": {
+        "federates": {"type": int, "min": 0},
+        "host": {"type": str},
+        # The address other hosts reach the broker at, whether each of them gets a sub-broker and the federates
+        # per sub-broker of a broker tree
+        "address": {"type": str},
+        "subbrokers": {"type": bool},
+        "group_size": {"type": int, "min": 2},
+        "observer": OBSERVER,
+        "ready": READY,
+        **RESOURCES,
+    },
+}
+
+HOST = {
+    "type": dict,
+    "keys": {
+        "transport": {"type": str, "choices": transport.TRANSPORTS},
+        "address": {"type": str},
+        "user": {"type": str},
+        "port": {"type": int, "min": 1},
+        "ssh_options": {"type": list, "items": {"type": str}},
+        "directory": {"type": str},
+    },
+}
+
+FEDERATE = {
+    "type": dict,
+    "keys": {
+        "name": {"type": str, "required": True},
+        "exec": {"type": str, "required": True},
+        "directory": {"type": str, "default": "."},
+        "host": {"type": str, "default": "localhost"},
+        "env": {"type": dict, "values": {"type": (str, int, float)}},
+        "depends_on": {"type": list, "items": {"type": str}},
+        "stage": {"type": int, "min": 0},
+        "ready": READY,
+        **RESOURCES,
+    },
+}
+
+SCHEMA = {
+    "type": dict,
+    "keys": {
+        "name": {"type": str, "required": True},
+        "broker": BROKER,
+        "hosts": {"type": dict, "values": HOST},
+        # Federates are checked after templates are expanded, see `validate`
+        "federates": {"type": list, "required": True, "items": {"type": dict}},
+        "pinning": {"type": str, "choices": ("spread",)},
+    },
+}
+
+
+def _type_name(types):
+    return " or ".join(TYPE_NAMES.get(t, t.__name__) for t in types)
+
+
+def _location(location):
+    """Format a location, kept as nested (parent, key) pairs until an error needs it"""
+    parts = []
+    while location is not None:
+        location, key = location
+        parts.append(f"[{key}]" if isinstance(key, int) else f".{key}" if location is not None else key)
+    return "".join(reversed(parts))
+
+
+def _leaf_types(node):
+    """The exact classes a node accepts if it has no checks besides its type, else None"""
+    if set(node) - {"type", "required", "default"}:
+        return None
+    return frozenset(node["type"] if isinstance(node["type"], tuple) else (node["type"],))
+
+
+def compile_schema(node):
+    """Turn a schema node into `check(value, location, errors, warnings)`, which returns the value with defaults filled in"""
+    types = node["type"] if isinstance(node["type"], tuple) else (node["type"],)
+    # JSON booleans are Python ints, they only match where booleans are allowed
+    exclude_bool = bool not in types and int in types
+    expected = _type_name(types)
+    minimum = node.get("min")
+    choices = node.get("choices")
+    extra_check = node.get("check")
+    items = compile_schema(node["items"]) if "items" in node else None
+    values = compile_schema(node["values"]) if "values" in node else None
+    keys = {key: compile_schema(child) for key, child in node.get("keys", {}).items()}
+    # Keys that only need a type check are checked in place, which saves a call per key
+    leaf_types = {key: _leaf_types(child) for key, child in node.get("keys", {}).items() if _leaf_types(child) is not None}
+    required = [key for key, child in node.get("keys", {}).items() if child.get("required")]
+    defaults = {key: child["default"] for key, child in node.get("keys", {}).items() if "default" in child}
+    one_of = node.get("one_of")
+    simple = minimum is None and choices is None and extra_check is None and items is None and values is None and not keys
+
+    def check(value, location, errors, warnings):
+        if not isinstance(value, types) or (exclude_bool and value.__class__ is bool):
+            errors.append((location, f"expected {expected}, got {TYPE_NAMES.get(type(value), type(value).__name__)}"))
+            return value
+        if simple:
+            return value
+        if minimum is not None and value.__class__ in (int, float) and value < minimum:
+            errors.append((location, f"must be at least {minimum}"))
+        if choices is not None and value not in choices:
+            errors.append((location, f"must be one of {', '.join(map(str, choices))}"))
+        if extra_check is not None:
+            try:
+                extra_check(value)
+            except (ValueError, HELICSRuntimeError) as e:
+                errors.append((location, str(e)))
+        if items is not None and value.__class__ is list:
+            value = [items(item, (location, i), errors, warnings) for i, item in enumerate(value)]
+        elif value.__class__ is dict:
+            if values is not None:
+                value = {key: values(item, (location, key), errors, warnings) for key, item in value.items()}
+            if keys:
+                result = dict(defaults)
+                for key, item in value.items():
+                    types_ = leaf_types.get(key)
+                    if types_ is not None and item.__class__ in types_:
+                        result[key] = item
+                        continue
+                    child = keys.get(key)
+                    if child is not None:
+                        result[key] = child(item, (location, key), errors, warnings)
+                    else:
+                        warnings.append(((location, key), "unknown key, ignored"))
+                        result[key] = item
+                for key in required:
+                    if key not in value:
+                        errors.append(((location, key), "is required"))
+                if one_of is not None and sum(key in value for key in one_of) != 1:
+                    errors.append((location, f"needs exactly one of {', '.join(one_of)}"))
+                value = result
+        return value
+
+    return check
+
+
+_check_config = compile_schema(SCHEMA)
+_check_federate = compile_schema(FEDERATE)
+
+
+def _expand_federates(entries, location, errors, warnings):
+    """Expand templates and check each federate, yields (location, federate)"""
+    for i, entry in enumerate(entries):
+        entry_location = (location, i)
+        if not template.is_template(entry):
+            yield entry_location, _check_federate(entry, entry_location, errors, warnings)
+            continue
+        try:
+            for k, federate in enumerate(template.expand(entry)):
+                # An expanded federate is located by its entry and its position in the expansion, like federates[2][5]
+                yield (entry_location, k), _check_federate(federate, (entry_location, k), errors, warnings)
+        except template.TemplateError as e:
+            errors.append((entry_location, str(e)))
+
+
+def validate(raw):
+    """Check a parsed config.json, returns the config with templates expanded, defaults filled in and a list of warnings.
+
+    Errors and warnings are (location, message) pairs. Raises ConfigError with every error found.
+    """
+    errors = []
+    warnings = []
+    root = (None, "config")
+    config = _check_config(raw, root, errors, warnings)
+    if not errors:
+        locations = []
+        federates = []
+        for location, federate in _expand_federates(config["federates"], (root, "federates"), errors, warnings):
+            locations.append(location)
+            federates.append(federate)
+        config["federates"] = federates
+    if not errors:
+        names = set()
+        for location, federate in zip(locations, federates):
+            if federate["name"] in names:
+                errors.append(((location, "name"), f"duplicate federate name {federate['name']}"))
+            names.add(federate["name"])
+        names.add("broker")
+        for location, federate in zip(locations, federates):
+            for dependency in federate.get("depends_on", ()):
+                if dependency not in names:
+                    errors.append(((location, "depends_on"), f"unknown process {dependency}"))
+    if errors:
+        raise ConfigError("config.json", [(_location(location), message) for location, message in errors])
+    return config, [(_location(location), message) for location, message in warnings]
+
+
+_cache = {}
+
+
+def load(filename):
+    """Read and validate a config.json, reusing the result while the file is unchanged.
+
+    The returned config is shared between callers and must not be modified. Raises ConfigError.
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(filename)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(filename, "rb") as f:
+        try:
+            raw = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(filename, [(f"line {e.lineno} column {e.colno}", e.msg)])
+    try:
+        config, warnings = validate(raw)
+    except ConfigError as e:
+        raise ConfigError(filename, e.errors)
+    for location, message in warnings:
+        logger.warning(f"{filename}: {location}: {message}")
+    _cache[filename] = (key, config)
+    return config
@@ -4,30 +4,180 @@ import os
 import glob
 import pathlib
 import logging
+import threading
 
 DATABASE_DIRECTORY = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent / "database"
 
+# Stored in `PRAGMA user_version`. Version 0 is the original layout of plain Federates and Publications tables,
+# version 2 added ProcessSamples.
+SCHEMA_VERSION = 2
+
+# Prepared statements kept per connection, enough for every query variant the web server builds
+CACHED_STATEMENTS = 256
+
+
+def connect(filename: str, read_only: bool = False, check_thread: bool = True):
+    if read_only:
+        db = sqlite3.connect(
+            pathlib.Path(os.path.abspath(filename)).as_uri() + "?mode=ro", uri=True, check_same_thread=check_thread, cached_statements=CACHED_STATEMENTS
+        )
+        db.execute("PRAGMA query_only=ON;")
+    else:
+        db = sqlite3.connect(str(filename), check_same_thread=check_thread, cached_statements=CACHED_STATEMENTS)
+        # WAL lets the web server read while the observer writes; NORMAL only syncs at checkpoints in WAL mode
+        db.execute("PRAGMA journal_mode=WAL;")
+        db.execute("PRAGMA synchronous=NORMAL;")
+    return db
+
 
 def initialize_database(filename: str, logger: logging.Logger = logging.getLogger(__name__), do_init: bool = False, check_thread: bool = True):
 
     logger.info(filename)
     logger.info(DATABASE_DIRECTORY)
-    db = sqlite3.connect(str(filename), check_same_thread=check_thread)
+    db = connect(filename, check_thread=check_thread)
     if do_init:
-        for filename in glob.glob(str(DATABASE_DIRECTORY / "Schema/*.sql")):
-            filename = filename
-            with open(filename) as f:
-                sql_file = f.read()
-            logger.info(f"read file {filename} to SQL")
-            logger.info(f"SQL: {sql_file}")
+        version = db.execute("PRAGMA user_version;").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            logger.info(f"Upgrading database schema from version {version} to {SCHEMA_VERSION}")
+            # A failed upgrade rolls back and leaves user_version as it was, so it is tried again next time
             try:
-                db.execute(sql_file)
-            except sqlite3.OperationalError as e:
-                logger.error(e)
+                with db:
+                    db.execute("BEGIN;")
+                    legacy_tables = _rename_legacy_tables(db, logger) if version == 0 else []
+                    create_schema(db, logger)
+                    _copy_legacy_tables(db, legacy_tables, logger)
+                    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+            except sqlite3.Error:
+                db.close()
+                raise
 
     return db
 
 
+def create_schema(db, logger: logging.Logger = logging.getLogger(__name__)):
+    """Run the schema files, an error propagates so that the caller's transaction rolls back"""
+    for filename in sorted(glob.glob(str(DATABASE_DIRECTORY / "Schema/*.sql"))):
+        with open(filename) as f:
+            sql_file = f.read()
+        logger.info(f"read file {filename} to SQL")
+        logger.debug(f"SQL: {sql_file}")
+        try:
+            # executescript commits first, so run the statements one at a time to stay inside the caller's transaction
+            for statement in _split_statements(sql_file):
+                db.execute(statement)
+        except sqlite3.OperationalError as e:
+            logger.error(f"{os.path.basename(filename)}: {e}")
+            raise
+
+
+def _split_statements(sql: str):
+    statement = ""
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+    if statement.strip():
+        yield statement
+
+
+def _rename_legacy_tables(db, logger: logging.Logger):
+    """Move version 0 tables out of the way so the views replacing them can be created"""
+    legacy_tables = []
+    for table in ("Federates", "Publications"):
+        row = db.execute("SELECT type FROM sqlite_master WHERE name = ?;", (table,)).fetchone()
+        if row is not None and row[0] == "table":
+            logger.info(f"Migrating legacy table {table}")
+            db.execute(f"ALTER TABLE {table} RENAME TO {table}_v0;")
+            legacy_tables.append(table)
+    return legacy_tables
+
+
+def _copy_legacy_tables(db, legacy_tables, logger: logging.Logger):
+    for table in legacy_tables:
+        # The views accept inserts in the old column layout and intern the names
+        columns = ", ".join(column for _, column, *_ in db.execute(f"PRAGMA table_info({table}_v0);"))
+        db.execute(f"INSERT INTO {table}({columns}) SELECT {columns} FROM {table}_v0 ORDER BY rowid;")
+        db.execute(f"DROP TABLE {table}_v0;")
+        logger.info(f"Copied legacy table {table}")
+
+
+class ConnectionPool:
+    """Read-only connections shared by the web server's worker threads.
+
+    A connection is held by one thread at a time between `acquire` and `release`, so the number of open connections
+    is bounded by the number of concurrent requests.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connections = []
+        self.idle = []
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                self.hits += 1
+                return self.idle.pop()
+            self.misses += 1
+        db = connect(self.filename, read_only=True, check_thread=False)
+        with self.lock:
+            self.connections.append(db)
+        return db
+
+    def release(self, db):
+        with self.lock:
+            if db in self.connections:
+                self.idle.append(db)
+
+    def close(self):
+        with self.lock:
+            for db in self.connections:
+                db.close()
+            self.connections.clear()
+            self.idle.clear()
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "connections": len(self.connections),
+                "idle": len(self.idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
+
+
+class InternedNames:
+    """Map names to the integer ids of a lookup table such as FederateNames, inserting them on first use"""
+
+    def __init__(self, db, table: str, column: str):
+        self.db = db
+        self.table = table
+        self.column = column
+        self.ids = {}
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get(self, name, **columns):
+        try:
+            return self.ids[name]
+        except KeyError:
+            pass
+        names = [self.column] + list(columns.keys())
+        self.db.execute(
+            f"INSERT OR IGNORE INTO {self.table}({', '.join(names)}) VALUES ({', '.join('?' * len(names))});",
+            (name, *columns.values()),
+        )
+        self.ids[name] = self.db.execute(f"SELECT id FROM {self.table} WHERE {self.column} = ?;", (name,)).fetchone()[0]
+        return self.ids[name]
+
+
 class MetaData:
     def __init__(self, db):
         self.db = db
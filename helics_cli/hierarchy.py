@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Broker trees for large federations
+
+With hundreds of federates on one broker, routing their messages becomes the bottleneck. A tree of sub-brokers
+keeps the traffic between federates of one group within their sub-broker. The federates of each host are split into
+groups of `group_size`, each with a sub-broker on that host, and as long as a host has more than `group_size`
+sub-brokers they are grouped under further sub-brokers the same way. The top sub-broker of each host connects to the
+root broker. Without a `group_size` each other host gets one sub-broker and federates on this machine connect to the
+root directly.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Port of the root broker, the default of HELICS's zmq core
+ROOT_PORT = 23404
+# Port of the first sub-broker, the next ones use the following ports in steps so that sub-brokers on one machine do
+# not collide
+SUBBROKER_PORT = 23500
+SUBBROKER_PORT_STEP = 10
+LOCAL_ADDRESS = "127.0.0.1"
+
+
+def _chunks(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def _node(host, federates):
+    return {"name": None, "host": host, "federates": federates, "port": None, "parent": None}
+
+
+def broker_tree(federate_hosts, remote_hosts, group_size=None, root_address=LOCAL_ADDRESS):
+    """Plan the sub-brokers of a federation.
+
+    `federate_hosts` maps federate names to their hosts in order, `remote_hosts` are the hosts other than this
+    machine and `root_address` is where they reach the root broker. Returns the sub-brokers, dicts with `name`,
+    `host`, `federates` (the number below it, its `-f`), `port` and `parent` (the address of its parent broker),
+    parents before children, and the broker environment of each federate below a sub-broker.
+    """
+    by_host = {}
+    for name, host in federate_hosts.items():
+        by_host.setdefault(host, []).append(name)
+    brokers = []
+    env = {}
+    for host, names in by_host.items():
+        if group_size is None and host not in remote_hosts:
+            continue
+        size = group_size or len(names)
+        leaves = [(_node(host, len(group)), group) for group in _chunks(names, size)]
+        for node, group in leaves:
+            for name in group:
+                env[name] = node
+        host_brokers = [node for node, _ in leaves]
+        level = host_brokers
+        while len(level) > size:
+            parents = []
+            next_level = []
+            for children in _chunks(level, size):
+                if len(children) == 1:
+                    # A broker left over moves up a level instead of getting a parent of its own
+                    next_level += children
+                    continue
+                parent = _node(host, sum(child["federates"] for child in children))
+                for child in children:
+                    child["parent"] = parent
+                parents.append(parent)
+                next_level.append(parent)
+            host_brokers = parents + host_brokers
+            level = next_level
+        # Brokers higher in the tree come first and take the lower ports
+        for i, node in enumerate(host_brokers):
+            node["name"] = f"broker-{host}" if len(host_brokers) == 1 else f"broker-{host}-{i}"
+            node["port"] = SUBBROKER_PORT + (len(brokers) + i) * SUBBROKER_PORT_STEP
+        root = f"{root_address if host in remote_hosts else LOCAL_ADDRESS}:{ROOT_PORT}"
+        for node in host_brokers:
+            node["parent"] = root if node["parent"] is None else f"{LOCAL_ADDRESS}:{node['parent']['port']}"
+        brokers += host_brokers
+        logger.debug(f"{len(host_brokers)} sub-brokers for {len(names)} federates on {host}")
+    return brokers, {name: {"HELICS_BROKER_ADDRESS": LOCAL_ADDRESS, "HELICS_BROKER_PORT": node["port"]} for name, node in env.items()}
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent, staged startup of federation processes
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import os
+import re
+import shlex
+import subprocess
+import time
+
+from . import placement as placements
+from .exceptions import HELICSRuntimeError
+
+logger = logging.getLogger(__name__)
+
+# Processes being spawned at the same time
+DEFAULT_CONCURRENCY = 16
+# Seconds a readiness check may take before startup fails
+READY_TIMEOUT = 60.0
+# Seconds between attempts of a readiness check
+READY_INTERVAL = 0.05
+
+
+def process_spec(name, cmd, cwd, log=None, env=None, depends_on=(), ready=None, placement=None, rotate_log=True, stage=0, transport=None):
+    """Describe a process for `launch`.
+
+    `cmd` is a shell-like command line, `log` the file that receives its output, `env` variables added to the
+    environment of helics-cli and `depends_on` the names of processes that have to be ready before it starts. `ready`
+    is a readiness check, one of `{"port": 23404, "host": "127.0.0.1"}` (accepts connections), `{"file": "path"}`
+    (exists), `{"log": "regex"}` (the log matches) or `{"delay": seconds}`, with an optional `timeout`. `placement`
+    holds the cpus, nice level, memory limit and threads of the process, see `placement.resources`. `rotate_log`
+    allows a LogCapture passed to `launch` to rotate the log. A process starts once all processes of lower `stage`s
+    are ready. With a `transport` the process runs on the transport's host, in the directory `cwd` there.
+    """
+    return {
+        "name": name,
+        "cmd": cmd,
+        "cwd": cwd,
+        "log": log,
+        "env": env,
+        "depends_on": list(depends_on),
+        "ready": ready,
+        "placement": placement or {},
+        "rotate_log": rotate_log,
+        "stage": stage,
+        "transport": transport,
+    }
+
+
+def check_dependencies(specs):
+    """Raise HELICSRuntimeError for unknown dependencies, dependencies on later stages or dependency cycles"""
+    names = {spec["name"]: spec for spec in specs}
+    for spec in specs:
+        for dependency in spec["depends_on"]:
+            if dependency not in names:
+                raise HELICSRuntimeError(f"{spec['name']} depends on unknown process {dependency}")
+            if names[dependency]["stage"] > spec["stage"]:
+                raise HELICSRuntimeError(f"{spec['name']} in stage {spec['stage']} depends on {dependency} in later stage {names[dependency]['stage']}")
+
+    done = set()
+    for spec in specs:
+        stack = [(spec["name"], iter(spec["depends_on"]))]
+        while stack:
+            name, dependencies = stack[-1]
+            dependency = next(dependencies, None)
+            if dependency is None:
+                done.add(name)
+                stack.pop()
+            elif any(dependency == entry[0] for entry in stack):
+                raise HELICSRuntimeError(f"Dependency cycle: {' -> '.join([entry[0] for entry in stack] + [dependency])}")
+            elif dependency not in done:
+                stack.append((dependency, iter(names[dependency]["depends_on"])))
+
+
+def launch(specs, process_list, output_list, max_parallel=DEFAULT_CONCURRENCY, capture=None):
+    """Start processes concurrently, each once its dependencies are ready.
+
+    Started processes are appended to `process_list` and their log files to `output_list` as they start, so the
+    caller can stop them if startup fails. With a LogCapture as `capture` the output of processes with a log is
+    read through a pipe and written by `capture` instead. Returns the seconds from the call until each process was started and
+    until it was ready. Raises HELICSRuntimeError (or the error of Popen) if a process fails to start or to
+    become ready, after the processes that were starting have finished starting.
+    """
+    check_dependencies(specs)
+    return asyncio.run(_launch(specs, process_list, output_list, max_parallel, capture))
+
+
+async def _launch(specs, process_list, output_list, max_parallel, capture):
+    loop = asyncio.get_running_loop()
+    begin = time.monotonic()
+    ready = {spec["name"]: loop.create_future() for spec in specs}
+    # A stage is ready once all of its processes are, each stage waits for the one before it
+    stages = sorted({spec["stage"] for spec in specs})
+    previous_stage = dict(zip(stages[1:], stages))
+    stage_ready = {stage: loop.create_future() for stage in stages}
+    stage_pending = collections.Counter(spec["stage"] for spec in specs)
+    timing = {}
+    failed = []
+    base_env = None
+
+    def spawn(spec):
+        nonlocal base_env
+        if spec["log"] is None:
+            output = None
+        elif capture is not None:
+            output = subprocess.PIPE
+        else:
+            output = open(spec["log"], "w")
+        env = None
+        changes = {**placements.environment(spec["placement"]), **{key: str(value) for key, value in (spec["env"] or {}).items()}}
+        if changes and spec["transport"] is None:
+            # The environment is copied only for processes that change it
+            base_env = dict(os.environ) if base_env is None else base_env
+            env = {**base_env, **changes}
+        try:
+            if spec["transport"] is None:
+                process = subprocess.Popen(
+                    shlex.split(spec["cmd"]),
+                    cwd=spec["cwd"],
+                    stdout=output,
+                    stderr=subprocess.STDOUT if output is not None else None,
+                    env=env,
+                )
+                try:
+                    placements.apply(process.pid, spec["placement"])
+                except ProcessLookupError:
+                    # Already exited, the supervisor reports its return code
+                    pass
+                except OSError as e:
+                    if process.stdout is not None:
+                        process.stdout.close()
+                    process.kill()
+                    process.wait()
+                    raise HELICSRuntimeError(f"Cannot apply the placement of {spec['name']}: {e}")
+            else:
+                process = spec["transport"].start(spec, changes, output)
+        except Exception:
+            if output is not None and output is not subprocess.PIPE:
+                output.close()
+            raise
+        if output is subprocess.PIPE:
+            capture.add(spec["name"], process.stdout, spec["log"], rotate=spec["rotate_log"])
+            output = None
+        process.name = spec["name"]
+        process.host = "localhost" if spec["transport"] is None else spec["transport"].host
+        process.start_time = time.monotonic()
+        return process, output
+
+    async def start(spec, executor):
+        try:
+            if spec["stage"] in previous_stage:
+                await asyncio.shield(stage_ready[previous_stage[spec["stage"]]])
+            for dependency in spec["depends_on"]:
+                await asyncio.shield(ready[dependency])
+            if failed:
+                raise HELICSRuntimeError(f"Not starting {spec['name']} after {failed[0]} failed")
+            watch = None
+            if spec["ready"] and "log" in spec["ready"] and spec["log"] is not None and capture is not None:
+                # Captured logs get a prefix on every line and may rotate, so the output is matched as it is read
+                watch = capture.watch(spec["name"], spec["ready"]["log"])
+            process, output = await loop.run_in_executor(executor, spawn, spec)
+            process_list.append(process)
+            if output is not None:
+                output_list.append(output)
+            timing[spec["name"]] = {"started": process.start_time - begin}
+            logger.debug(f"Started {spec['name']} with pid {process.pid}")
+            if spec["ready"]:
+                await _wait_ready(process, spec, watch)
+            timing[spec["name"]]["ready"] = time.monotonic() - begin
+            ready[spec["name"]].set_result(True)
+            stage_pending[spec["stage"]] -= 1
+            if stage_pending[spec["stage"]] == 0:
+                stage_ready[spec["stage"]].set_result(True)
+        except BaseException as e:
+            failed.append(spec["name"])
+            error = e if isinstance(e, Exception) else HELICSRuntimeError(f"{spec['name']} was cancelled")
+            ready[spec["name"]].set_exception(error)
+            if not stage_ready[spec["stage"]].done():
+                stage_ready[spec["stage"]].set_exception(error)
+            raise
+
+    with concurrent.futures.ThreadPoolExecutor(max_parallel, thread_name_prefix="launcher") as executor:
+        results = await asyncio.gather(*(start(spec, executor) for spec in specs), return_exceptions=True)
+    for future in [*ready.values(), *stage_ready.values()]:
+        # Errors of dependencies are reported once, by the process that failed
+        if future.done() and not future.cancelled():
+            future.exception()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    return timing
+
+
+async def _wait_ready(process, spec, watch=None):
+    check = spec["ready"]
+    timeout = check.get("timeout", READY_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    log_offset = 0
+    log_text = ""
+    while True:
+        if "delay" in check:
+            await asyncio.sleep(check["delay"])
+            return
+        if "port" in check:
+            try:
+                default_host = "127.0.0.1" if spec["transport"] is None else spec["transport"].address
+                _, writer = await asyncio.open_connection(check.get("host", default_host), check["port"])
+                writer.close()
+                return
+            except OSError:
+                pass
+        elif "file" in check:
+            if os.path.exists(os.path.join(spec["cwd"], check["file"])):
+                return
+        elif "log" in check:
+            if watch is not None:
+                if watch.is_set():
+                    return
+            elif spec["log"] is not None and os.path.exists(spec["log"]):
+                if os.path.getsize(spec["log"]) < log_offset:
+                    log_offset = 0
+                with open(spec["log"], errors="replace") as f:
+                    f.seek(log_offset)
+                    log_text = log_text[-4096:] + f.read()
+                    log_offset = f.tell()
+                if re.search(check["log"], log_text, re.M):
+                    return
+        else:
+            raise HELICSRuntimeError(f"Unknown readiness check for {spec['name']}: {check}")
+
+        if process.poll() is not None:
+            raise HELICSRuntimeError(f"Process {spec['name']} exited with return code {process.returncode} before it was ready")
+        if time.monotonic() > deadline:
+            raise HELICSRuntimeError(f"Process {spec['name']} was not ready after {timeout} s")
+        await asyncio.sleep(READY_INTERVAL)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Sample CPU, memory and I/O of federation processes from /proc while they run
+"""
+import csv
+import logging
+import os
+import threading
+import time
+
+from .exceptions import HELICSRuntimeError
+from .utils.table import format_table
+
+logger = logging.getLogger(__name__)
+
+PROC = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+CSV_COLUMNS = ("time", "name", "pid", "cpu_percent", "rss", "read_bytes", "write_bytes")
+# Share of its cpus a federate has to keep busy to be reported as the one limiting the federation
+LIMITING_CPU_SHARE = 0.8
+
+
+def supported():
+    return os.path.isdir(os.path.join(PROC, "self"))
+
+
+def read_process(pid):
+    """CPU seconds, RSS and peak RSS in bytes, and bytes read and written of a process, None once it has exited.
+
+    I/O counts all reads and writes including sockets and pipes, so it covers the traffic between federates. It is
+    None where /proc/<pid>/io cannot be read.
+    """
+    try:
+        with open(os.path.join(PROC, str(pid), "stat"), "rb") as f:
+            stat = f.read()
+        with open(os.path.join(PROC, str(pid), "status"), "rb") as f:
+            status = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    # The command name may contain spaces and parentheses, the fields after it do not
+    fields = stat[stat.rindex(b")") + 2 :].split()
+    if fields[0] == b"Z":
+        return None
+    sample = {"cpu": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, "rss": 0, "max_rss": 0, "read_bytes": None, "write_bytes": None}
+    for line in status.splitlines():
+        if line.startswith(b"VmRSS:"):
+            sample["rss"] = int(line.split()[1]) * 1024
+        elif line.startswith(b"VmHWM:"):
+            sample["max_rss"] = int(line.split()[1]) * 1024
+    try:
+        with open(os.path.join(PROC, str(pid), "io"), "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key == b"rchar":
+                    sample["read_bytes"] = int(value)
+                elif key == b"wchar":
+                    sample["write_bytes"] = int(value)
+    except OSError:
+        pass
+    return sample
+
+
+class ResourceMonitor(threading.Thread):
+    """Sample the processes of a federation every `interval` seconds until `finished` is set or all have exited.
+
+    Samples are written to `output`, a CSV file or, for a `.db` file, the ProcessSamples table of a helics-cli
+    database. `totals` holds per process name the CPU time, peak RSS and bytes read and written so far, and
+    `summary` what a process used over the last interval.
+    """
+
+    def __init__(self, process_list, interval, finished, output=None, cpus=None):
+        threading.Thread.__init__(self, name="resource-monitor", daemon=True)
+        if not supported():
+            raise HELICSRuntimeError("Resource monitoring needs /proc, which this platform does not have")
+        self.interval = interval
+        self.finished = finished
+        self.output = output
+        self._process_list = list(process_list)
+        # Cpus each process may use, to tell a busy single-threaded federate from a busy parallel one
+        self._cpus = cpus or {}
+        self._created = time.monotonic()
+        self._last = {}
+        self.summary = {}
+        self.totals = {p.name: {"pid": p.pid, "cpu": 0.0, "max_rss": 0, "read_bytes": None, "write_bytes": None} for p in self._process_list}
+        self._lock = threading.Lock()
+
+    def run(self):
+        with self._open_output() as write:
+            while True:
+                rows = self.sample()
+                if rows:
+                    write(rows)
+                if not self.summary or self.finished.wait(self.interval):
+                    break
+        logger.info("Resource monitor stopped")
+
+    def sample(self):
+        """Sample every running process once, returns the rows written to the output"""
+        now = time.monotonic()
+        rows = []
+        summary = {}
+        for p in self._process_list:
+            sample = read_process(p.pid)
+            if sample is None:
+                continue
+            last_time, last = self._last.get(p.name, (getattr(p, "start_time", self._created), None))
+            elapsed = max(now - last_time, 1e-9)
+            cpu_percent = 100 * (sample["cpu"] - (last["cpu"] if last else 0)) / elapsed
+            io_rates = {key: None if sample[key] is None else (sample[key] - ((last[key] or 0) if last else 0)) / elapsed for key in ("read_bytes", "write_bytes")}
+            summary[p.name] = {"pid": p.pid, "cpu_percent": cpu_percent, "rss": sample["rss"], **io_rates}
+            self._last[p.name] = (now, sample)
+            rows.append((now - self._created, p.name, p.pid, cpu_percent, sample["rss"], sample["read_bytes"], sample["write_bytes"]))
+        with self._lock:
+            for name, (_, sample) in self._last.items():
+                totals = self.totals[name]
+                totals.update(
+                    cpu=sample["cpu"],
+                    max_rss=max(totals["max_rss"], sample["max_rss"]),
+                    read_bytes=sample["read_bytes"],
+                    write_bytes=sample["write_bytes"],
+                )
+            self.summary = summary
+        return rows
+
+    def limiting(self, cpu_percent):
+        """Name of the federate keeping its cpus busiest, the one the others wait for, None if none of them is busy.
+
+        `cpu_percent` maps process names to their CPU use, over the last interval or the whole run. The broker and
+        sub-brokers are not federates and are left out.
+        """
+        share = {
+            name: percent / 100 / len(self._cpus.get(name) or [None])
+            for name, percent in cpu_percent.items()
+            if name != "broker" and not name.startswith("broker-")
+        }
+        if not share:
+            return None
+        name = max(share, key=share.get)
+        return name if share[name] >= LIMITING_CPU_SHARE else None
+
+    def _open_output(self):
+        if self.output is None:
+            return _NullOutput()
+        if self.output.endswith(".db"):
+            return _DatabaseOutput(self.output)
+        return _CsvOutput(self.output)
+
+
+class _NullOutput:
+    def __enter__(self):
+        return lambda rows: None
+
+    def __exit__(self, *args):
+        return False
+
+
+class _CsvOutput:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __enter__(self):
+        self.file = open(self.filename, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(CSV_COLUMNS)
+        return self.write
+
+    def write(self, rows):
+        self.writer.writerows((f"{t:.3f}", name, pid, f"{cpu:.1f}", *rest) for t, name, pid, cpu, *rest in rows)
+        self.file.flush()
+
+    def __exit__(self, *args):
+        self.file.close()
+        return False
+
+
+class _DatabaseOutput:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __enter__(self):
+        from .database import initialize_database, InternedNames
+
+        self.db = initialize_database(self.filename, logger, do_init=True, check_thread=False)
+        self.names = InternedNames(self.db, "FederateNames", "name")
+        return self.write
+
+    def write(self, rows):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO ProcessSamples(name_id, sample_time, pid, cpu_percent, rss, read_bytes, write_bytes) VALUES (?,?,?,?,?,?,?);",
+                [(self.names[name], t, pid, cpu, rss, read, write) for t, name, pid, cpu, rss, read, write in rows],
+            )
+
+    def __exit__(self, *args):
+        self.db.close()
+        return False
+
+
+def _bytes(value):
+    if value is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(value) < 1024 or unit == "GB":
+            return f"{value:.1f} {unit}" if unit != "B" else f"{value:.0f} B"
+        value /= 1024
+
+
+def summary_table(summary, limiting=None):
+    """Format the last interval of a ResourceMonitor as a text table"""
+    header = ("process", "pid", "cpu %", "rss", "read/s", "write/s", "")
+    rows = [
+        (
+            name,
+            str(s["pid"]),
+            f"{s['cpu_percent']:.1f}",
+            _bytes(s["rss"]),
+            _bytes(s["read_bytes"]),
+            _bytes(s["write_bytes"]),
+            "<- limiting" if name == limiting else "",
+        )
+        for name, s in sorted(summary.items())
+    ]
+    return format_table(header, rows, left=(0, 6))
+
+
+def totals_table(totals, runtimes, limiting=None):
+    """Format the totals of a ResourceMonitor with the runtime of each process as a text table"""
+    header = ("process", "cpu (s)", "cpu %", "peak rss", "read", "written", "")
+    rows = []
+    for name, t in sorted(totals.items()):
+        runtime = runtimes.get(name)
+        rows.append(
+            (
+                name,
+                f"{t['cpu']:.3f}",
+                "-" if not runtime else f"{100 * t['cpu'] / runtime:.1f}",
+                _bytes(t["max_rss"] or None),
+                _bytes(t["read_bytes"]),
+                _bytes(t["write_bytes"]),
+                "<- limiting" if name == limiting else "",
+            )
+        )
+    return format_table(header, rows, left=(0, 6))
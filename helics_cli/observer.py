@@ -1,21 +1,36 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import json
+import concurrent.futures
 import logging
+import math
 import os
+import threading
 import time
 
 import helics as h
 
-from .utils.message_handler import MessageHandler, SimpleMessage
-from .database import initialize_database, MetaData
+from .utils.message_handler import MessageHandler, SimpleMessage, merge_telemetry
+from .config import load as load_config
+from .database import initialize_database, InternedNames, MetaData
 
 logger = logging.getLogger(__name__)
 
 OBSERVER_BROKER: h.HelicsBroker = None
 OBSERVER_FEDERATE: h.HelicsCombinationFederate = None
 SERVER_MESSAGE_HANDLER: MessageHandler = None
-time_control = {"nonstop": True, "requested_time": 0.0, "exited": False}
+# Server queries are answered off the event loop, several at once. Federates are made for calls from several threads
+# unless created with HELICS_FLAG_SINGLE_THREAD_FEDERATE, and queries go through the thread safe core, so they run
+# next to each other and next to the grant thread blocking in request_time.
+QUERY_WORKERS = 4
+time_control = {"nonstop": True, "requested_time": 0.0, "exited": False, "stopped": False}
+# Set when the loop ends, the grant thread makes no further time requests
+grants_stopped = threading.Event()
+write_timing = {"steps": 0, "total": 0.0, "last": 0.0, "max": 0.0}
+grant_timing = {"grants": 0, "total": 0.0, "max": 0.0}
+query_mode = {"snapshot": True}
+publication_cache = {}
+interned_names = {}
+pending_telemetry = {}
 
 
 def init_combination_federate(
@@ -47,15 +62,80 @@ def init_combination_federate(
     OBSERVER_FEDERATE = h.helicsCreateCombinationFederate(core_name, fedinfo)
 
 
-def write_database_data(db, federate: h.HelicsFederate, subscriptions=[], current_time=0.0):
-    logger.debug("Making query ...")
+def index_subscriptions(subscriptions):
+    """Map each subscription target to its subscription, used to look up publication values per step"""
+    index = {}
+    for sub in subscriptions:
+        if sub.target in index:
+            logger.info(f"ERROR: multiple subscriptions to same publication {sub.target}.")
+            continue
+        index[sub.target] = sub
+    return index
+
+
+def subscription_value(sub: h.HelicsInput):
+    publication_type = sub.publication_type
+    if publication_type == "double":
+        return sub.double
+    elif publication_type == "integer":
+        return sub.integer
+    else:
+        return sub.string
+
+
+def record_write_timing(elapsed: float):
+    write_timing["steps"] += 1
+    write_timing["total"] += elapsed
+    write_timing["last"] = elapsed
+    write_timing["max"] = max(write_timing["max"], elapsed)
+
+
+def _walk_federates(node):
+    """Yield the federate entries of a root query response, descending through brokers and cores"""
+    if not isinstance(node, dict):
+        return
+    for fed in node.get("federates", []):
+        yield fed
+    for child in node.get("brokers", []) + node.get("cores", []):
+        yield from _walk_federates(child)
+
+
+def _is_query_error(response) -> bool:
+    return not isinstance(response, dict) or "error" in response
 
-    federates = [name for name in federate.query("root", "federates") if name != "__observer__"]
 
+def query_snapshot(federate: h.HelicsFederate):
+    """Query state and time of the whole federation with two root queries.
+
+    Returns a dict mapping federate names to their `state`, `granted_time` and `requested_time`, or None when the
+    HELICS build does not support the aggregate `global_state` and `global_time` queries.
+    """
+    states = federate.query("root", "global_state")
+    times = federate.query("root", "global_time")
+    if _is_query_error(states) or _is_query_error(times):
+        return None
+
+    snapshot = {}
+    for fed in _walk_federates(states):
+        snapshot[fed["attributes"]["name"]] = {"state": fed.get("state"), "granted_time": float("NaN"), "requested_time": float("NaN")}
+    for fed in _walk_federates(times):
+        data = snapshot.setdefault(fed["attributes"]["name"], {"state": None})
+        data["granted_time"] = fed.get("granted_time", float("NaN"))
+        # global_time reports the next time a federate may send rather than its requested time on some builds
+        data["requested_time"] = fed.get("requested_time", fed.get("send_time", float("NaN")))
+    snapshot.pop("__observer__", None)
+    return snapshot
+
+
+def query_federates(federate: h.HelicsFederate, current_time=0.0):
+    """Query state and time of each federate individually, for HELICS builds without aggregate queries"""
+    federates = [name for name in federate.query("root", "federates") if name != "__observer__"]
+    snapshot = {}
     for name in federates:
         logger.debug(f"Query for exists: {name}")
-
-        if federate.query(name, "state") == "disconnected":
+        state = federate.query(name, "state")
+        if state == "disconnected":
+            snapshot[name] = {"state": state}
             continue
 
         logger.debug(f"Query for current_time: {name}")
@@ -70,51 +150,115 @@ def write_database_data(db, federate: h.HelicsFederate, subscriptions=[], curren
             logger.warning(f"current time query threw {ex}")
             granted_time = current_time
             requested_time = float("NaN")
+        snapshot[name] = {"state": state, "granted_time": granted_time, "requested_time": requested_time}
+    return snapshot
+
+
+def query_federation(federate: h.HelicsFederate, current_time=0.0):
+    """Return the state and time of every federate, using a root snapshot when the broker supports it"""
+    if query_mode["snapshot"]:
+        snapshot = query_snapshot(federate)
+        if snapshot is not None:
+            return snapshot
+        logger.info("Aggregate root queries are not supported, falling back to per-federate queries")
+        query_mode["snapshot"] = False
+    return query_federates(federate, current_time)
+
+
+def cache_publications(federate: h.HelicsFederate, federates):
+    """Look up the publications of each federate once, since they do not change after initialization"""
+    publication_cache.clear()
+    graph = federate.query("root", "data_flow_graph") if query_mode["snapshot"] else None
+    if not _is_query_error(graph):
+        for fed in _walk_federates(graph):
+            publication_cache[fed["attributes"]["name"]] = [pub["key"] for pub in fed.get("publications", [])]
+    for name in federates:
+        if name not in publication_cache:
+            logger.debug(f"Query for publications: {name}")
+            publication_cache[name] = federate.query(name, "publications")
+        logger.debug(f"{name} publishes: {publication_cache[name]}")
+    return publication_cache
+
+
+def federation_disconnected(snapshot: dict) -> bool:
+    """Whether every federate of a `query_federation` snapshot has disconnected"""
+    return all(data["state"] == "disconnected" for data in snapshot.values())
+
+
+def interned_ids(db):
+    """Return the federate and publication id lookups for `db`, created on first use"""
+    if interned_names.get("db") is not db:
+        interned_names["db"] = db
+        interned_names["federates"] = InternedNames(db, "FederateNames", "name")
+        interned_names["publications"] = InternedNames(db, "PublicationKeys", "key")
+    return interned_names["federates"], interned_names["publications"]
+
 
-        db.execute("INSERT INTO Federates(name, granted, requested) VALUES (?,?,?);", (name, granted_time, requested_time))
+def write_database_data(db, federate: h.HelicsFederate, subscriptions={}, current_time=0.0, step=0):
+    """Record granted times and changed publication values for one time step.
 
-        if federate.query(name, "state") == "disconnected":
+    `subscriptions` maps publication keys to subscriptions (see `index_subscriptions`) and `step` is stored in
+    `PublicationValues.step`, so the most recent values are the rows with the highest step number. Returns the step's
+    granted times and publication values for `send_telemetry`, and the `query_federation` snapshot it recorded, so
+    the caller can check the federation's state without querying it again.
+    """
+    start = time.perf_counter()
+    logger.debug("Making query ...")
+    federate_ids, publication_ids = interned_ids(db)
+
+    federate_rows = []
+    publication_rows = []
+    federate_times = {}
+    publication_values = {}
+    snapshot = query_federation(federate, current_time)
+    for name, data in snapshot.items():
+        if data["state"] == "disconnected":
             continue
-        logger.debug(f"Query for publications: {name}")
-        publications = federate.query(name, "publications")  # .replace("[", "").replace("]", "").split(";")
-        logger.debug(f"{name} publishes: {publications}")
-
-        for pub_str in publications:
-            logger.debug(f"pub_str: {pub_str}")
-            subs = [s for s in subscriptions if s.target == pub_str]
-            logger.debug(f"subs info: {subs}")
-            if len(subs) > 1:
-                logger.info("ERROR: multiple subscriptions to same publication.")
-            elif len(pub_str) > 0 and len(subs) == 1:
-                db.execute("UPDATE Publications SET new_value=0;")
-                publication_type = subs[0].publication_type
-                if publication_type == "double":
-                    value = subs[0].double
-                elif publication_type == "integer":
-                    value = subs[0].integer
-                else:
-                    value = subs[0].string
-
-                logger.info(f"Publication value is {value} of type {type}")
-                db.execute(
-                    "INSERT INTO Publications(key, sender, pub_time, pub_value, new_value) VALUES (?,?,?,?,?);",
-                    (pub_str, name, granted_time, value, 1),
-                )
+        granted_time = data["granted_time"]
+        requested_time = data["requested_time"]
+        federate_rows.append((federate_ids[name], granted_time, requested_time))
+        federate_times[name] = [granted_time, None if math.isnan(requested_time) else requested_time]
+
+        if name not in publication_cache:
+            publication_cache[name] = federate.query(name, "publications")
+        for pub_str in publication_cache[name]:
+            sub = subscriptions.get(pub_str)
+            if sub is None or not sub.is_updated():
+                continue
+            value = subscription_value(sub)
+            logger.debug(f"Publication {pub_str} value is {value}")
+            publication_rows.append((publication_ids.get(pub_str, sender_id=federate_ids[name]), granted_time, value, step))
+            publication_values[pub_str] = [name, granted_time, value]
 
+    db.executemany("INSERT INTO FederateTimes(name_id, granted, requested) VALUES (?,?,?);", federate_rows)
+    db.executemany("INSERT INTO PublicationValues(key_id, pub_time, pub_value, step) VALUES (?,?,?,?);", publication_rows)
     db.commit()
 
+    record_write_timing(time.perf_counter() - start)
+    logger.debug(f"Step {step} wrote {len(federate_rows)} federates and {len(publication_rows)} publications in {write_timing['last']:.6f} s")
+    return {"time": current_time, "step": step, "federates": federate_times, "publications": publication_values}, snapshot
+
+
+def send_telemetry(update: dict):
+    """Push a step update to the web server, merging it with earlier updates while the telemetry queue is full"""
+    if not SERVER_MESSAGE_HANDLER.Enabled or SERVER_MESSAGE_HANDLER.Telemetry is None:
+        return
+    merge_telemetry(pending_telemetry, update)
+    if SERVER_MESSAGE_HANDLER.send_telemetry(SimpleMessage("TELEMETRY", pending_telemetry)):
+        pending_telemetry.clear()
+
 
 def process_message(message: SimpleMessage):
     logger.info(f"processing message {message}")
     if message.Type == "QUERY":
         logger.debug("Processing query")
-        query_target = json.loads(message.Message)
+        query_target = message.Message
         logger.debug(f"Query target was: {query_target}")
         query_response = OBSERVER_FEDERATE.query(query_target["target"], query_target["query"])
         logger.debug(f"Query response was: {query_response}")
         return SimpleMessage("QUERY_RESPONSE", query_response)
     elif message.Type == "SIGNAL":
-        signal_data = json.loads(message.Message)
+        signal_data = message.Message
         logger.info("Processing signal")
         if signal_data["operation"] == "FASTFORWARD":
             logger.info("got FF")
@@ -122,23 +266,35 @@ def process_message(message: SimpleMessage):
             time_control["nonstop"] = True
             time_control["exited"] = True
             h.helicsBrokerClearTimeBarrier(OBSERVER_BROKER)
-            return SimpleMessage("SIGNAL_RESPONSE", "{}")
+            return SimpleMessage("SIGNAL_RESPONSE")
         if signal_data["operation"] == "STOP":
             logger.info("got STOP")
             time_control["exited"] = True
+            time_control["stopped"] = True
             OBSERVER_FEDERATE.finalize()  # TODO: see if this is the right way to exit.
             h.helicsBrokerDisconnect(OBSERVER_BROKER)
             # h.helicsBrokerClearTimeBarrier(OBSERVER_BROKER)
-            return SimpleMessage("SIGNAL_RESPONSE", "{}")
+            return SimpleMessage("SIGNAL_RESPONSE")
         if signal_data["operation"] == "RUNTO":
             time_control["requested_time"] = signal_data["target_time"]
             # h.helicsBrokerClearTimeBarrier(OBSERVER_BROKER)
             h.helicsBrokerSetTimeBarrier(OBSERVER_BROKER, signal_data["target_time"])
             logger.info("got RUNTO")
-        return SimpleMessage("SIGNAL_RESPONSE", "{}")
+        return SimpleMessage("SIGNAL_RESPONSE")
     else:
         logger.info("Unknown message type received")
-        return SimpleMessage("ERROR_RESPONSE", "{}")
+        return SimpleMessage("ERROR_RESPONSE")
+
+
+def respond(message: SimpleMessage):
+    """Process a server message and send the response tagged with the message's request id"""
+    try:
+        response = process_message(message)
+    except h.HelicsException as ex:
+        logger.warning(f"Processing message {message} threw {ex}")
+        response = SimpleMessage("ERROR_RESPONSE", {"error": str(ex)})
+    response.RequestId = message.RequestId
+    SERVER_MESSAGE_HANDLER.send_server(response)
 
 
 def check_first_message():
@@ -147,23 +303,47 @@ def check_first_message():
         while True:
             message = SERVER_MESSAGE_HANDLER.get_server()
             logger.debug(f"Received message {message}")
-            response = process_message(message)
-            SERVER_MESSAGE_HANDLER.send_server(response)
+            respond(message)
             if SERVER_MESSAGE_HANDLER.ToHelics.empty() and time_control["requested_time"] > 0.0 or time_control["nonstop"]:
                 break
 
 
-def ingest_messages():
-    if SERVER_MESSAGE_HANDLER.Enabled:
-        logger.info("Processing messages from server")
-        while not SERVER_MESSAGE_HANDLER.ToHelics.empty():  # action event was new message
+def start_message_reader(loop: asyncio.AbstractEventLoop, inbox: asyncio.Queue):
+    """Forward server messages to the event loop from a thread that blocks on the message queue"""
+
+    def read():
+        while True:
             message = SERVER_MESSAGE_HANDLER.get_server()
-            logger.debug(f"Received message {message}")
-            response = process_message(message)
-            SERVER_MESSAGE_HANDLER.send_server(response)
+            try:
+                loop.call_soon_threadsafe(inbox.put_nowait, message)
+            except RuntimeError:
+                logger.debug("Event loop closed, stopping message reader")
+                return
 
+    thread = threading.Thread(target=read, name="observer-messages", daemon=True)
+    thread.start()
+    return thread
 
-def run(n_federates: int, config_path: str, log_level: int, message_handler: MessageHandler = None):
+
+def wait_for_grant():
+    """Request the next time and block until it is granted, returns the granted time and when it was granted.
+
+    Returns None without a request once `grants_stopped` is set.
+    """
+    if grants_stopped.is_set():
+        return None
+    granted_time = OBSERVER_FEDERATE.request_time(0.0)
+    return granted_time, time.perf_counter()
+
+
+def record_grant_latency(granted_at: float):
+    latency = time.perf_counter() - granted_at
+    grant_timing["grants"] += 1
+    grant_timing["total"] += latency
+    grant_timing["max"] = max(grant_timing["max"], latency)
+
+
+def run(n_federates: int, config_path: str, log_level: int, message_handler: MessageHandler = None, config: dict = None):
 
     file_out = logging.FileHandler("observer.log", mode="w")
     file_out.setLevel(logging.DEBUG)
@@ -178,7 +358,7 @@ def run(n_federates: int, config_path: str, log_level: int, message_handler: Mes
         time_control["nonstop"] = False
 
     try:
-        asyncio.run(_run(n_federates, config_path, log_level))
+        asyncio.run(_run(n_federates, config_path, log_level, config))
     except KeyboardInterrupt:
         logger.info("User canceled operation")
     except h.HelicsException:
@@ -191,13 +371,14 @@ def run(n_federates: int, config_path: str, log_level: int, message_handler: Mes
     return 0
 
 
-async def _run(n_federates: int, config_path: str, log_level: int = 2):
+async def _run(n_federates: int, config_path: str, log_level: int = 2, config: dict = None):
     path_to_config = os.path.abspath(config_path)
     path = os.path.dirname(path_to_config)
 
-    with open(path_to_config) as f:
-        config = json.loads(f.read())
-    logger.info("Read config: %s", config["broker"]["observer"])
+    if config is None:
+        config = load_config(path_to_config)
+    observer_config = config["broker"]["observer"]
+    logger.info("Read config: %s", observer_config)
 
     logger.info("Loading HELICS Library")
 
@@ -245,12 +426,18 @@ async def _run(n_federates: int, config_path: str, log_level: int = 2):
     subscriptions = []
     # TODO: improve subscription filtering to be a bit more friendly
     for pub in publications:
-        if "include" in config["broker"]["observer"].keys() and pub not in config["broker"]["observer"]["include"]:
+        if "include" in observer_config and pub not in observer_config["include"]:
+            continue
+        elif pub in observer_config.get("exclude", []):
             continue
         else:
             subscriptions.append(OBSERVER_FEDERATE.register_subscription(pub))
     # TODO: message clones
 
+    subscriptions = index_subscriptions(subscriptions)
+    cache_publications(OBSERVER_FEDERATE, federates)
+    step = db.execute("SELECT COALESCE(MAX(step), 0) FROM PublicationValues;").fetchone()[0]
+
     h.helicsBrokerSetTimeBarrier(OBSERVER_BROKER, 0.0)
 
     try:
@@ -265,37 +452,70 @@ async def _run(n_federates: int, config_path: str, log_level: int = 2):
         brokers = OBSERVER_FEDERATE.query("root", "brokers")
         logger.info(brokers)
 
-        current_time = 0.0
-        get_next_step = True
-        while True:
-            if get_next_step:
-                OBSERVER_FEDERATE.request_time_async(0.0)
-                get_next_step = False
-
-            if OBSERVER_FEDERATE.is_async_operation_completed() or not SERVER_MESSAGE_HANDLER.ToHelics.empty():
-                if not SERVER_MESSAGE_HANDLER.ToHelics.empty():
-                    ingest_messages()
-                elif OBSERVER_FEDERATE.is_async_operation_completed():
-                    current_time = OBSERVER_FEDERATE.request_time_complete()
+        # The grant and the server messages each wake the loop: a worker thread blocks in request_time and a reader
+        # thread forwards messages from the queue, so the loop sleeps until one of them is ready.
+        loop = asyncio.get_running_loop()
+        grant_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="observer-grant")
+        query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="observer-query")
+        inbox = asyncio.Queue()
+        if SERVER_MESSAGE_HANDLER.Enabled:
+            start_message_reader(loop, inbox)
+
+        grants_stopped.clear()
+        grant = loop.run_in_executor(grant_executor, wait_for_grant)
+        next_message = asyncio.ensure_future(inbox.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait({grant, next_message}, return_when=asyncio.FIRST_COMPLETED)
+
+                if next_message in done:
+                    message = next_message.result()
+                    logger.debug(f"Received message {message}")
+                    if message.Type == "QUERY":
+                        # Queries do not change time control, so they run while the loop keeps going
+                        loop.run_in_executor(query_executor, respond, message)
+                    else:
+                        respond(message)
+                    if time_control["stopped"]:
+                        break
+                    next_message = asyncio.ensure_future(inbox.get())
+
+                if grant in done:
+                    current_time, granted_at = grant.result()
+                    record_grant_latency(granted_at)
                     logger.debug(f"Granted time {current_time}, calling DB Write")
-                    write_database_data(db, OBSERVER_FEDERATE, subscriptions, current_time)
-                    get_next_step = True
-                    continue
-            else:
-                await asyncio.sleep(0.001)  # There's probably a better way to do this, but this is the solution for now.
-                # time.sleep(1)  # There's probably a better way to do this, but this is the solution for now.
-            # if not time_control["exited"]:
-            #     ingest_messages(current_time)
-
-            if not time_control["nonstop"] or current_time >= 9223372036.3:
-                continue
-            if (
-                all(OBSERVER_FEDERATE.query(name, "state") == "disconnected" for name in federates if name != "__observer__")
-                or current_time >= 9223372036.3
-            ):
-                break
+                    step += 1
+                    update, snapshot = write_database_data(db, OBSERVER_FEDERATE, subscriptions, current_time, step)
+                    send_telemetry(update)
+
+                    if current_time >= 9223372036.3 or (time_control["nonstop"] and federation_disconnected(snapshot)):
+                        break
+                    grant = loop.run_in_executor(grant_executor, wait_for_grant)
+        finally:
+            next_message.cancel()
+            grants_stopped.set()
+            if not grant.done():
+                # A pending request_time only returns once the federate leaves the federation
+                OBSERVER_FEDERATE.finalize()
+            await asyncio.wait({grant})
+            if not grant.cancelled() and grant.exception() is not None:
+                logger.debug(f"Pending time request ended with {grant.exception()}")
+            grant_executor.shutdown()
+            query_executor.shutdown(cancel_futures=True)
 
         logger.info("Finished observe.")
+        if write_timing["steps"] > 0:
+            logger.info(
+                f"Database writes: {write_timing['steps']} steps, {write_timing['total']:.3f} s total, "
+                f"{write_timing['total'] / write_timing['steps'] * 1e3:.3f} ms mean, {write_timing['max'] * 1e3:.3f} ms max"
+            )
+            metadata["write_steps"] = write_timing["steps"]
+            metadata["write_time_total"] = write_timing["total"]
+            metadata["write_time_max"] = write_timing["max"]
+        if grant_timing["grants"] > 0:
+            logger.info(f"Grant latency: {grant_timing['total'] / grant_timing['grants'] * 1e6:.1f} us mean, {grant_timing['max'] * 1e6:.1f} us max")
+            metadata["grant_latency_mean"] = grant_timing["total"] / grant_timing["grants"]
+            metadata["grant_latency_max"] = grant_timing["max"]
         logger.info("finalizing monitoring task")
         # message_handler.cancel()
         # try:
@@ -312,6 +532,8 @@ async def _run(n_federates: int, config_path: str, log_level: int = 2):
         logger.debug("Observer finalizing")
         logger.info("Finalizing federate ...")
         OBSERVER_FEDERATE.finalize()
+        if SERVER_MESSAGE_HANDLER is not None:
+            SERVER_MESSAGE_HANDLER.close()
         logger.info("Deleting federate ...")
 
         logger.info("Broker disconnect ...")
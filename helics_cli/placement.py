@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+CPU affinity, priority and resource limits of federation processes
+"""
+import glob
+import logging
+import os
+import re
+
+from .exceptions import HELICSRuntimeError
+
+logger = logging.getLogger(__name__)
+
+# Keys of a federate or broker config that control its placement
+RESOURCE_KEYS = ("cpus", "nice", "memory_limit", "threads")
+# Variables read by the common threading runtimes, set to the `threads` of a federate
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+PINNING_POLICIES = ("spread",)
+
+
+def parse_cpus(cpus):
+    """Turn a list of cpu numbers or a cpu list string such as `"0-3,8"` into a sorted list"""
+    if isinstance(cpus, int):
+        return [cpus]
+    if isinstance(cpus, (list, tuple)):
+        return sorted({int(cpu) for cpu in cpus})
+    result = set()
+    for part in str(cpus).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        result.update(range(int(first), int(last or first) + 1))
+    return sorted(result)
+
+
+def parse_memory(memory):
+    """Turn a byte count or a size such as `"512M"` or `"2G"` into bytes"""
+    if isinstance(memory, int):
+        return memory
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(memory), re.I)
+    if match is None:
+        raise HELICSRuntimeError(f"Invalid memory_limit {memory}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+
+def available_cpus():
+    """CPUs helics-cli may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus=None):
+    """Group `cpus` (by default the available ones) by NUMA node, a single node where the topology is unknown"""
+    cpus = available_cpus() if cpus is None else cpus
+    nodes = []
+    for cpulist in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"), key=lambda f: int(re.search(r"node(\d+)", f).group(1))):
+        with open(cpulist) as f:
+            node = [cpu for cpu in parse_cpus(f.read()) if cpu in cpus]
+        if node:
+            nodes.append(node)
+    return nodes or [list(cpus)]
+
+
+def resources(config):
+    """The placement keys of a federate or broker config, checked and normalized"""
+    if not isinstance(config, dict):
+        return {}
+    result = {key: config[key] for key in RESOURCE_KEYS if config.get(key) is not None}
+    if "cpus" in result:
+        result["cpus"] = parse_cpus(result["cpus"])
+        unknown = set(result["cpus"]) - set(available_cpus())
+        if unknown:
+            raise HELICSRuntimeError(f"{config.get('name', 'broker')} uses unavailable cpus {sorted(unknown)}")
+    if "nice" in result:
+        result["nice"] = int(result["nice"])
+    if "memory_limit" in result:
+        result["memory_limit"] = parse_memory(result["memory_limit"])
+    if "threads" in result:
+        result["threads"] = int(result["threads"])
+        if result["threads"] < 1:
+            raise HELICSRuntimeError(f"{config.get('name', 'broker')} needs at least one thread")
+    return result
+
+
+def auto_pin(placements, policy="spread", reserve=()):
+    """Assign cpus to every process in `placements` (name to resources) that has none.
+
+    With the `spread` policy each process gets as many cpus as it has `threads` (one by default), taken from the NUMA
+    node with the most unused cpus, so processes are spread over nodes and cores and never straddle a node. Cpus
+    given explicitly and those of the processes in `reserve` are used first. When all cpus are used up they are
+    shared, starting over from an even spread.
+    """
+    if policy not in PINNING_POLICIES:
+        raise HELICSRuntimeError(f"Unknown pinning policy {policy}, expected one of {', '.join(PINNING_POLICIES)}")
+    nodes = numa_nodes()
+    taken = {cpu for placement in placements.values() for cpu in placement.get("cpus", [])}
+    free = [[cpu for cpu in node if cpu not in taken] for node in nodes]
+    order = [name for name in reserve if name in placements] + [name for name in placements if name not in reserve]
+    for name in order:
+        placement = placements[name]
+        if "cpus" in placement:
+            continue
+        count = min(placement.get("threads", 1), max(len(node) for node in nodes))
+        if max(len(node) for node in free) < count:
+            free = [list(node) for node in nodes]
+        node = max(free, key=len)
+        placement["cpus"], node[:] = node[:count], node[count:]
+        logger.debug(f"Pinned {name} to cpus {placement['cpus']}")
+    return placements
+
+
+def environment(placement):
+    """Environment variables for a placement, limiting threading runtimes to its `threads`"""
+    if "threads" not in placement:
+        return {}
+    return {variable: str(placement["threads"]) for variable in THREAD_VARIABLES}
+
+
+def apply(pid, placement):
+    """Apply the cpus, nice level and memory limit of a placement to the running process `pid`.
+
+    Processes are started from several threads, where code run in the child between fork and exec can deadlock, so
+    the placement is applied from helics-cli right after the start. `nice` is relative to the priority of helics-cli.
+    """
+    if not placement.keys() & {"cpus", "nice", "memory_limit"}:
+        return
+    if os.name != "posix":
+        logger.warning("Process placement is not supported on this platform, ignoring cpus, nice and memory_limit")
+        return
+    if "cpus" in placement:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(pid, placement["cpus"])
+        else:
+            logger.warning("CPU affinity is not supported on this platform, ignoring cpus")
+    if "nice" in placement:
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + placement["nice"])
+    if "memory_limit" in placement:
+        try:
+            import resource
+
+            prlimit = resource.prlimit
+        except (ImportError, AttributeError):
+            logger.warning("Resource limits of other processes are not supported on this platform, ignoring memory_limit")
+        else:
+            prlimit(pid, resource.RLIMIT_AS, (placement["memory_limit"], placement["memory_limit"]))
+
+
+def shell_prefix(placement):
+    """Apply a placement in a POSIX shell instead, for processes started on other hosts.
+
+    Returns the shell lines to run before the command and the words to put in front of it, which use `ulimit`,
+    `nice` and `taskset` on the host.
+    """
+    lines = []
+    words = []
+    if "memory_limit" in placement:
+        lines.append(f"ulimit -v {placement['memory_limit'] // 1024}")
+    if "nice" in placement:
+        words += ["nice", "-n", str(placement["nice"])]
+    if "cpus" in placement:
+        words += ["taskset", "-c", ",".join(map(str, placement["cpus"]))]
+    return lines, words
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
 import os
 import re
+import shutil
+import threading
+import time
 
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 import numpy as np
 
+from .utils.table import format_table
+
+logger = logging.getLogger(__name__)
+
 CURRENT_DIR = os.path.realpath(os.path.basename(__file__))
 
 # <PROFILING>SenderFederate2[131074](initializing)HELICS CODE ENTRY<4570827706580384>[t=-1000000]</PROFILING>
@@ -24,111 +33,728 @@ PATTERN = re.compile(
 )
 
 
-def profile(filename, invert=True):
-    with open(filename) as f:
-        data = f.read()
-    data = data.replace(r"<PROFILING>", "").replace(r"</PROFILING>", "")
-    names = []
-    states = []
-    messages = []
-    simtimes = []
-    realtimes = []
-    time_marker = {}
-    for line in data.splitlines():
-        m = PATTERN.match(line)
-        name = m.group("name")
-        state = m.group("state")
-        message = m.group("message")
-        simtime = float(m.group("simtime"))
+# Same fields as PATTERN, matched against whole lines of raw bytes so a chunk can be parsed with one findall call.
+# Lines may carry a prefix before <PROFILING>, as in a broker log written with `--profiler=log`.
+LINE_PATTERN = re.compile(
+    rb"""
+            ^(?:[^<\n]*<PROFILING>)?
+            (\w+)                                   # name
+            \[-?\d+\]                               # handle
+            \((\w+)\)                               # state
+            ((?:\w|\ )+)                            # message
+            <(\d+)(?:\|(\d+))?>                     # realtime and optional marker
+            \[t=(-?\d*\.?\d+)\]                     # simtime
+            (?:</PROFILING>)?\r?$
+            """,
+    re.X | re.M,
+)
+BLANK_LINE = re.compile(rb"^[ \t\r]*$", re.M)
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Event kinds stored in the `kind` column
+EXIT = 0
+ENTRY = 1
+OTHER = 2
+
+COLUMNS = {"name_id": np.int32, "state_id": np.int32, "kind": np.int8, "realtime": np.int64, "simtime": np.float64}
+
+# Parsed columns are cached in a directory next to the profile, one .npy file per column so they can be memory mapped
+CACHE_SUFFIX = ".cache"
+CACHE_VERSION = 1
+# Bytes read from each end of the profile for the cache key, hashing a whole multi-GB file would cost as much as parsing it
+CACHE_HASH_BYTES = 1024 * 1024
+
+
+def parse(filename, chunk_size=CHUNK_SIZE, workers=None):
+    """Parse a HELICS profiler output file into columns of NumPy arrays.
+
+    The file is split into chunks at line boundaries and each chunk is parsed on its own, in `workers` processes
+    (default: one per CPU), so memory use is bounded by the chunk size plus the parsed columns. Lines that do not
+    match the profiler format are skipped and counted.
+
+    Returns a dict with the interned `names` and `states`, one entry per event in `name_id`, `state_id`, `kind`
+    (ENTRY, EXIT or OTHER), `realtime` (int64 nanoseconds) and `simtime` (float64), the last time `markers` per
+    federate and the number of `malformed` lines.
+    """
+    chunks = _chunk_offsets(filename, chunk_size)
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            results = executor.map(_parse_chunk, *zip(*((filename, start, end) for start, end in chunks)))
+            return _merge_chunks(results)
+    return _merge_chunks(_parse_chunk(filename, start, end) for start, end in chunks)
+
+
+def _chunk_offsets(filename, chunk_size):
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, "rb") as f:
+        while offsets[-1] + chunk_size < size:
+            f.seek(offsets[-1] + chunk_size)
+            f.readline()
+            offsets.append(f.tell())
+    if offsets[-1] < size:
+        offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def _parse_chunk(filename, start, end):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _parse_lines(data)
+
+
+def _parse_lines(data):
+    matches = LINE_PATTERN.findall(data)
+    malformed = data.count(b"\n") + (0 if data.endswith(b"\n") else 1) - len(matches)
+    if malformed > 0:
+        malformed -= len(BLANK_LINE.findall(data)) - (1 if data.endswith(b"\n") else 0)
+    if not matches:
+        return [], [], {}, {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}, malformed
+
+    fields = np.array(matches)
+    names, name_id = np.unique(fields[:, 0], return_inverse=True)
+    states, state_id = np.unique(fields[:, 1], return_inverse=True)
+    kind = np.full(len(fields), OTHER, dtype=np.int8)
+    kind[np.char.endswith(fields[:, 2], b"ENTRY")] = ENTRY
+    kind[np.char.endswith(fields[:, 2], b"EXIT")] = EXIT
+    columns = {
+        "name_id": name_id.astype(np.int32),
+        "state_id": state_id.astype(np.int32),
+        "kind": kind,
+        "realtime": fields[:, 3].astype(np.int64),
+        "simtime": fields[:, 5].astype(np.float64),
+    }
+    markers = {}
+    for i in np.flatnonzero(fields[:, 4] != b""):
+        markers[fields[i, 0].decode()] = float(fields[i, 4])
+    return [name.decode() for name in names], [state.decode() for state in states], markers, columns, malformed
+
+
+def _merge_chunks(results):
+    """Concatenate chunk columns, mapping each chunk's local name and state ids to ids shared by the whole file"""
+    names = {}
+    states = {}
+    markers = {}
+    columns = {column: [] for column in COLUMNS}
+    malformed = 0
+    for chunk_names, chunk_states, chunk_markers, chunk_columns, chunk_malformed in results:
+        name_ids = np.array([names.setdefault(name, len(names)) for name in chunk_names], dtype=np.int32)
+        state_ids = np.array([states.setdefault(state, len(states)) for state in chunk_states], dtype=np.int32)
+        if len(chunk_columns["kind"]) > 0:
+            chunk_columns["name_id"] = name_ids[chunk_columns["name_id"]]
+            chunk_columns["state_id"] = state_ids[chunk_columns["state_id"]]
+        for column in COLUMNS:
+            columns[column].append(chunk_columns[column])
+        markers.update(chunk_markers)
+        malformed += chunk_malformed
+
+    events = {column: np.concatenate(values) if values else np.empty(0, dtype=COLUMNS[column]) for column, values in columns.items()}
+    events["names"] = list(names)
+    events["states"] = list(states)
+    events["markers"] = markers
+    events["malformed"] = malformed
+    return events
+
+
+def cache_key(filename):
+    """Identify the contents of a profile by size, modification time and a hash of its first and last megabyte"""
+    stat = os.stat(filename)
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        digest.update(f.read(CACHE_HASH_BYTES))
+        if stat.st_size > CACHE_HASH_BYTES:
+            f.seek(max(stat.st_size - CACHE_HASH_BYTES, CACHE_HASH_BYTES))
+            digest.update(f.read())
+    return {"version": CACHE_VERSION, "size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+def load(filename, cache=True):
+    """Return the parsed columns of a profile, from its cache if it matches the file and otherwise by parsing it.
+
+    Cached columns are memory mapped read-only. A fresh parse is written to the cache unless `cache` is False.
+    """
+    cache_directory = os.fspath(filename) + CACHE_SUFFIX
+    key = cache_key(filename)
+    if cache:
+        events = _read_cache(cache_directory, key)
+        if events is not None:
+            logger.debug(f"Loaded {len(events['kind'])} profile events from {cache_directory}")
+            return events
+
+    events = parse(filename)
+    if cache:
         try:
-            realtime = float(m.group("realtime"))
-        except:
-            realtime, markertime = m.group("realtime").split("|")
-            time_marker[name] = float(markertime)
-            realtime = float(realtime)
-        names.append(name)
-        states.append(state)
-        messages.append(message)
-        simtimes.append(simtime)
-        realtimes.append(realtime)
-
-    profile = {}
-    for name in set(names):
-        profile[name] = []
-
-    if invert:
-        for name in set(names):
-            profile[name].append({})
-
-    for (name, state, message, simtime, realtime) in zip(names, states, messages, simtimes, realtimes):
-        if state == "created":
-            continue
-        if "ENTRY" in message and not invert:
-            profile[name].append({"s_enter": simtime, "r_enter": realtime})
-        elif "EXIT" in message and not invert:
-            profile[name][-1]["s_end"] = simtime
-            profile[name][-1]["r_end"] = realtime
-        elif "EXIT" in message and invert:
-            profile[name].append({"s_enter": simtime, "r_enter": realtime})
-        elif "ENTRY" in message and invert:
-            profile[name][-1]["s_end"] = simtime
-            profile[name][-1]["r_end"] = realtime
+            _write_cache(cache_directory, key, events)
+        except OSError as e:
+            logger.warning(f"Unable to write profile cache {cache_directory}: {e}")
+    return events
+
+
+def _read_cache(cache_directory, key):
+    try:
+        with open(os.path.join(cache_directory, "index.json")) as f:
+            index = json.load(f)
+        if index["key"] != key:
+            return None
+        events = {column: np.load(os.path.join(cache_directory, f"{column}.npy"), mmap_mode="r") for column in COLUMNS}
+    except (OSError, ValueError, KeyError):
+        return None
+    events.update(names=index["names"], states=index["states"], markers=index["markers"], malformed=index["malformed"])
+    return events
+
+
+def _write_cache(cache_directory, key, events):
+    # Write to a temporary directory and rename it, so readers never see a partial cache
+    partial = f"{cache_directory}.{os.getpid()}.tmp"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    try:
+        for column in COLUMNS:
+            np.save(os.path.join(partial, f"{column}.npy"), events[column])
+        index = {k: events[k] for k in ("names", "states", "markers", "malformed")}
+        with open(os.path.join(partial, "index.json"), "w") as f:
+            json.dump({"key": key, **index}, f)
+        shutil.rmtree(cache_directory, ignore_errors=True)
+        os.replace(partial, cache_directory)
+    finally:
+        shutil.rmtree(partial, ignore_errors=True)
+
+
+def extract_profile(log_filename, filename, chunk_size=CHUNK_SIZE):
+    """Copy the profiling records of a broker log written with `--profiler=log` to a profile file"""
+    record = re.compile(rb"<PROFILING>[^\n]*</PROFILING>")
+    with open(log_filename, "rb") as log, open(filename, "wb") as f:
+        tail = b""
+        while True:
+            chunk = log.read(chunk_size)
+            data = tail + chunk
+            cut = data.rfind(b"\n") + 1 if chunk else len(data)
+            data, tail = data[:cut], data[cut:]
+            records = record.findall(data)
+            if records:
+                f.write(b"\n".join(records) + b"\n")
+            if not chunk:
+                break
+
+
+# Recent grant latencies kept per federate by ProfileTail for its percentiles
+TAIL_WINDOW = 1024
+# Bytes ProfileTail reads at most per poll, a backlog is worked off over several polls
+TAIL_READ_SIZE = 16 * 1024 * 1024
+
+
+class ProfileTail:
+    """Follow a profile file while HELICS writes it and keep running statistics per federate.
+
+    Each `poll` parses only the complete lines added since the previous one. Totals are kept as running sums and
+    grant latencies in a window of the last TAIL_WINDOW grants, so memory does not grow with the length of the run.
+    """
+
+    def __init__(self, filename, window=TAIL_WINDOW):
+        self.filename = filename
+        self.window = window
+        self.lock = threading.Lock()
+        self.offset = 0
+        self.malformed = 0
+        self.federates = {}
+
+    def _federate(self, name):
+        if name not in self.federates:
+            self.federates[name] = {
+                "events": 0,
+                "simtime": None,
+                "inside": 0.0,
+                "outside": 0.0,
+                "grants": 0,
+                "grant_latency": collections.deque(maxlen=self.window),
+                # Kind, realtime and simtime of the last ENTRY or EXIT, to pair it with the first event of the next poll
+                "last": None,
+                "seen": None,
+            }
+        return self.federates[name]
+
+    def poll(self):
+        """Parse new lines of the profile, returns the number of events read"""
+        with self.lock:
+            try:
+                size = os.path.getsize(self.filename)
+            except OSError:
+                return 0
+            if size < self.offset:
+                # The file was replaced by a new run
+                self.offset = 0
+                self.malformed = 0
+                self.federates = {}
+            with open(self.filename, "rb") as f:
+                f.seek(self.offset)
+                data = f.read(min(size - self.offset, TAIL_READ_SIZE))
+            data = data[: data.rfind(b"\n") + 1]
+            if not data:
+                return 0
+            self.offset += len(data)
+
+            names, states, _, columns, malformed = _parse_lines(data)
+            self.malformed += malformed
+            seen = time.monotonic()
+            keep = columns["kind"] != OTHER
+            if "created" in states:
+                keep &= columns["state_id"] != states.index("created")
+            for name_id, name in enumerate(names):
+                federate = self._federate(name)
+                own = columns["name_id"] == name_id
+                federate["events"] += int(np.count_nonzero(own))
+                federate["simtime"] = float(columns["simtime"][own][-1])
+                federate["seen"] = seen
+                self._update(federate, columns["kind"][own & keep], columns["realtime"][own & keep], columns["simtime"][own & keep])
+            return len(columns["kind"])
+
+    def _update(self, federate, kind, realtime, simtime):
+        if federate["last"] is not None:
+            kind = np.concatenate(([federate["last"][0]], kind))
+            realtime = np.concatenate(([federate["last"][1]], realtime))
+            simtime = np.concatenate(([federate["last"][2]], simtime))
+        if len(kind) == 0:
+            return
+        duration = np.diff(realtime) / 1e9
+        inside = (kind[:-1] == ENTRY) & (kind[1:] == EXIT)
+        outside = (kind[:-1] == EXIT) & (kind[1:] == ENTRY)
+        grants = inside & (simtime[1:] > simtime[:-1])
+        federate["inside"] += float(duration[inside].sum())
+        federate["outside"] += float(duration[outside].sum())
+        federate["grants"] += int(np.count_nonzero(grants))
+        federate["grant_latency"].extend(duration[grants][-self.window :].tolist())
+        federate["last"] = (int(kind[-1]), int(realtime[-1]), float(simtime[-1]))
+
+    def summary(self):
+        """Running statistics per federate. `idle` is the number of seconds since its last event was read."""
+        with self.lock:
+            now = time.monotonic()
+            result = {}
+            for name, federate in self.federates.items():
+                latency = np.array(federate["grant_latency"])
+                result[name] = {
+                    "events": federate["events"],
+                    "simtime": federate["simtime"],
+                    "inside": federate["inside"],
+                    "outside": federate["outside"],
+                    "grants": federate["grants"],
+                    "grant_p50": float(np.percentile(latency, 50)) if len(latency) > 0 else None,
+                    "grant_p99": float(np.percentile(latency, 99)) if len(latency) > 0 else None,
+                    "in_helics": federate["last"] is not None and federate["last"][0] == ENTRY,
+                    "idle": now - federate["seen"],
+                }
+            return {"federates": result, "bytes": self.offset, "malformed": self.malformed}
+
+
+def live_table(summary):
+    """Format a ProfileTail summary as a text table"""
+    header = ("federate", "simtime", "grants", "inside (s)", "outside (s)", "grant p50 (ms)", "grant p99 (ms)", "state", "idle (s)")
+    rows = []
+    for name, federate in sorted(summary["federates"].items()):
+        rows.append(
+            (
+                name,
+                f"{federate['simtime']:.6g}",
+                f"{federate['grants']}",
+                f"{federate['inside']:.3f}",
+                f"{federate['outside']:.3f}",
+                *("-" if federate[key] is None else f"{federate[key] * 1e3:.3f}" for key in ("grant_p50", "grant_p99")),
+                "in HELICS" if federate["in_helics"] else "computing",
+                f"{federate['idle']:.1f}",
+            )
+        )
+    return format_table(header, rows)
+
+
+def intervals(events, invert=True):
+    """Pair events of each federate into intervals.
+
+    Without `invert` an interval runs from a HELICS CODE ENTRY to the following EXIT, i.e. time spent inside HELICS.
+    With `invert` it runs from an EXIT to the following ENTRY, i.e. time spent in the federate's own code. Events in
+    the `created` state and unmatched events are skipped. Returns the federate `names` and, per interval, `name_id`,
+    `s_enter`, `s_end`, `r_enter` and `r_end`.
+    """
+    keep = events["kind"] != OTHER
+    if "created" in events["states"]:
+        keep &= events["state_id"] != events["states"].index("created")
+    index = np.flatnonzero(keep)
+    # Group events by federate while keeping file order within each federate
+    index = index[np.argsort(events["name_id"][index], kind="stable")]
 
+    name_id = events["name_id"][index]
+    kind = events["kind"][index]
+    start, end = (EXIT, ENTRY) if invert else (ENTRY, EXIT)
+    pairs = np.flatnonzero((kind[:-1] == start) & (kind[1:] == end) & (name_id[:-1] == name_id[1:]))
+
+    return {
+        "names": events["names"],
+        "name_id": name_id[pairs],
+        "s_enter": events["simtime"][index[pairs]],
+        "s_end": events["simtime"][index[pairs + 1]],
+        "r_enter": events["realtime"][index[pairs]],
+        "r_end": events["realtime"][index[pairs + 1]],
+    }
+
+
+def _group_statistics(group, values, n_groups, quantiles):
+    """Count, total, mean, percentiles and maximum of `values` for each group id in `range(n_groups)`"""
+    counts = np.bincount(group, minlength=n_groups)
+    totals = np.bincount(group, weights=values, minlength=n_groups)
+    # Sort by group, then by value, so each group's values are a sorted slice starting at `starts`
+    ordered = values[np.lexsort((values, group))]
+    starts = np.cumsum(counts) - counts
+    statistics = {"count": counts, "total": totals, "mean": np.divide(totals, counts, out=np.full(n_groups, np.nan), where=counts > 0)}
+    for q in list(quantiles) + [100]:
+        position = starts + (counts - 1).clip(0) * q / 100
+        low = np.floor(position).astype(np.int64).clip(0, max(len(ordered) - 1, 0))
+        high = np.ceil(position).astype(np.int64).clip(0, max(len(ordered) - 1, 0))
+        if len(ordered) > 0:
+            value = ordered[low] + (ordered[high] - ordered[low]) * (position - np.floor(position))
+        else:
+            value = np.zeros(n_groups)
+        statistics["max" if q == 100 else f"p{q}"] = np.where(counts > 0, value, np.nan)
+    return statistics
+
+
+def critical_path(grants):
+    """Find the federate each granted time waited on.
+
+    `grants` are intervals inside HELICS that advanced simulation time. For every granted time the federate whose
+    time request entered last is the one the others may have been blocked on. Only federates still inside their own
+    request when it entered were blocked by it, so federates that are independent or run offset in wall time are not
+    counted, and the wait it caused runs from the earliest of their requests to its request. Waits of one federate
+    on several time steps that overlap in wall time are counted once, so a federate never causes more wait than the
+    wall time of the run. Returns `time`, `name_id` and `wait` (seconds) per granted time.
+    """
+    steps, step = np.unique(grants["s_end"], return_inverse=True)
+    order = np.lexsort((grants["r_enter"], step))
+    step = step[order]
+    # Last and first grant of each time step, appending a step id past the end closes the final group
+    last = np.flatnonzero(np.diff(step, append=len(steps)))
+    first = np.concatenate(([0], last[:-1] + 1))[: len(last)]
+    r_enter = grants["r_enter"][order]
+    r_end = grants["r_end"][order]
+    name_id = grants["name_id"][order][last]
+    r_last = r_enter[last]
+    # A grant was blocked by the last request of its step if it had not returned when that request entered
+    blocked = (r_end >= r_last[step]) & (r_enter < r_last[step])
+    wait_start = np.minimum.reduceat(np.where(blocked, r_enter, r_last[step]), first) if len(first) else r_last
+    for federate in np.unique(name_id):
+        # Waits overlapping an earlier one of the same federate start where the earlier one ended
+        steps_of = np.flatnonzero(name_id == federate)
+        by_start = steps_of[np.argsort(wait_start[steps_of], kind="stable")]
+        covered = np.maximum.accumulate(r_last[by_start])
+        wait_start[by_start[1:]] = np.maximum(wait_start[by_start[1:]], covered[:-1])
+    return {"time": steps, "name_id": name_id, "wait": np.maximum(r_last - wait_start, 0) / 1e9}
+
+
+def analyze(events, quantiles=(50, 90, 99)):
+    """Summarize the time each federate spent inside and outside HELICS calls, its grant latency and how often the
+    federation waited on it.
+
+    Durations are in seconds. Returns per federate statistics under `federates` and the per time step critical path
+    under `critical_path`.
+    """
+    names = events["names"]
+    inside = intervals(events, invert=False)
+    outside = intervals(events, invert=True)
+    inside_duration = (inside["r_end"] - inside["r_enter"]) / 1e9
+    outside_duration = (outside["r_end"] - outside["r_enter"]) / 1e9
+
+    advanced = inside["s_end"] > inside["s_enter"]
+    grants = {column: inside[column][advanced] for column in ("name_id", "s_end", "r_enter", "r_end")}
+    path = critical_path(grants)
+
+    statistics = {
+        "inside": _group_statistics(inside["name_id"], inside_duration, len(names), quantiles),
+        "outside": _group_statistics(outside["name_id"], outside_duration, len(names), quantiles),
+        "grant_latency": _group_statistics(grants["name_id"], inside_duration[advanced], len(names), quantiles),
+    }
+    # Steps on which no federate was blocked have no critical federate
+    critical_steps = np.bincount(path["name_id"], weights=path["wait"] > 0, minlength=len(names)).astype(np.int64)
+    critical_wait = np.bincount(path["name_id"], weights=path["wait"], minlength=len(names))
+
+    federates = {}
+    for name_id, name in enumerate(names):
+        federate = {kind: {key: _json_number(value[name_id]) for key, value in group.items()} for kind, group in statistics.items()}
+        busy = federate["inside"]["total"] + federate["outside"]["total"]
+        federate["inside_fraction"] = federate["inside"]["total"] / busy if busy > 0 else None
+        federate["critical_steps"] = int(critical_steps[name_id])
+        federate["critical_wait"] = float(critical_wait[name_id])
+        federates[name] = federate
+    realtime = events["realtime"]
+    wall_time = float(realtime.max() - realtime.min()) / 1e9 if len(realtime) > 0 else 0.0
+    return {"federates": federates, "steps": len(path["time"]), "wall_time": wall_time, "critical_path": path}
+
+
+def analysis_json(analysis, steps=False):
+    """Convert the result of `analyze` to plain data, including the per step critical path only if `steps` is set"""
+    result = {"federates": analysis["federates"], "steps": analysis["steps"], "wall_time": analysis["wall_time"]}
+    if steps:
+        path = analysis["critical_path"]
+        names = list(analysis["federates"])
+        result["critical_path"] = [
+            {"time": time, "federate": names[name_id], "wait": wait}
+            for time, name_id, wait in zip(path["time"].tolist(), path["name_id"].tolist(), path["wait"].tolist())
+        ]
+    return result
+
+
+def analysis_table(analysis):
+    """Format the per federate summary of `analyze` as a text table, federates the federation waited on most first"""
+    header = ("federate", "inside (s)", "outside (s)", "inside %", "grants", "grant p50 (ms)", "grant p99 (ms)", "grant max (ms)", "critical", "wait caused (s)")
+    rows = []
+    for name, federate in sorted(analysis["federates"].items(), key=lambda item: -item[1]["critical_wait"]):
+        grants = federate["grant_latency"]
+        rows.append(
+            (
+                name,
+                f"{federate['inside']['total']:.3f}",
+                f"{federate['outside']['total']:.3f}",
+                "-" if federate["inside_fraction"] is None else f"{federate['inside_fraction'] * 100:.1f}",
+                f"{grants['count']}",
+                *("-" if grants[key] is None else f"{grants[key] * 1e3:.3f}" for key in ("p50", "p99", "max")),
+                f"{federate['critical_steps']}/{analysis['steps']}",
+                f"{federate['critical_wait']:.3f}",
+            )
+        )
+    return format_table(header, rows)
+
+
+# Per federate metrics compared by `compare`, all in seconds where larger is worse
+DIFF_METRICS = {
+    "total": lambda federate: federate["inside"]["total"] + federate["outside"]["total"],
+    "inside": lambda federate: federate["inside"]["total"],
+    "grant_p50": lambda federate: federate["grant_latency"]["p50"],
+    "grant_p90": lambda federate: federate["grant_latency"]["p90"],
+    "grant_p99": lambda federate: federate["grant_latency"]["p99"],
+}
+
+
+def _change(baseline, candidate, threshold):
+    change = None
+    if baseline is not None and candidate is not None and baseline > 0:
+        change = (candidate - baseline) / baseline * 100
+    delta = None if baseline is None or candidate is None else candidate - baseline
+    return {"baseline": baseline, "candidate": candidate, "delta": delta, "change": change, "regression": change is not None and change > threshold}
+
+
+def compare(baseline, candidate, threshold=10.0):
+    """Compare two results of `analyze`, matching federates by name.
+
+    Every metric in DIFF_METRICS and the federation wall time that grew by more than `threshold` percent is listed
+    under `regressions`.
+    """
+    result = {
+        "wall_time": _change(baseline["wall_time"], candidate["wall_time"], threshold),
+        "federates": {},
+        "missing": sorted(set(baseline["federates"]) - set(candidate["federates"])),
+        "added": sorted(set(candidate["federates"]) - set(baseline["federates"])),
+        "regressions": [],
+    }
+    if result["wall_time"]["regression"]:
+        result["regressions"].append(f"federation wall_time {result['wall_time']['change']:+.1f}%")
+    for name in sorted(set(baseline["federates"]) & set(candidate["federates"])):
+        metrics = {}
+        for metric, value in DIFF_METRICS.items():
+            metrics[metric] = _change(value(baseline["federates"][name]), value(candidate["federates"][name]), threshold)
+            if metrics[metric]["regression"]:
+                result["regressions"].append(f"{name} {metric} {metrics[metric]['change']:+.1f}%")
+        result["federates"][name] = metrics
+    return result
+
+
+def comparison_table(comparison):
+    """Format the result of `compare` as a text table of baseline and candidate values with their change"""
+
+    def cell(values, scale=1.0):
+        if values["baseline"] is None or values["candidate"] is None:
+            return "-"
+        change = "" if values["change"] is None else f" ({values['change']:+.1f}%{'!' if values['regression'] else ''})"
+        return f"{values['baseline'] * scale:.4g} -> {values['candidate'] * scale:.4g}{change}"
+
+    header = ("federate", "total (s)", "inside (s)", "grant p50 (ms)", "grant p90 (ms)", "grant p99 (ms)")
+    rows = [("federation", cell(comparison["wall_time"]), "", "", "", "")]
+    for name, metrics in comparison["federates"].items():
+        rows.append((name, cell(metrics["total"]), cell(metrics["inside"]), *(cell(metrics[key], 1e3) for key in ("grant_p50", "grant_p90", "grant_p99"))))
+    lines = [format_table(header, rows)]
+    for key, label in (("missing", "missing from candidate"), ("added", "only in candidate")):
+        if comparison[key]:
+            lines.append(f"{label}: {', '.join(comparison[key])}")
+    return "\n".join(lines)
+
+
+def _json_number(value):
+    if np.issubdtype(type(value), np.integer):
+        return int(value)
+    return None if np.isnan(value) else float(value)
+
+
+def profile(filename, invert=True, cache=True):
+    """Return the intervals of a profile as a dict mapping each federate name to a list of interval dicts"""
+    table = intervals(load(filename, cache), invert)
+    profile = {name: [] for name in table["names"]}
+    for name_id, s_enter, s_end, r_enter, r_end in zip(
+        table["name_id"].tolist(), table["s_enter"].tolist(), table["s_end"].tolist(), table["r_enter"].tolist(), table["r_end"].tolist()
+    ):
+        profile[table["names"][name_id]].append({"s_enter": s_enter, "r_enter": float(r_enter), "s_end": s_end, "r_end": float(r_end)})
     return profile
 
 
-def plot(profile, save=None, kind="simulation", **kwargs):
-    profiles = []
-    names = {k: i for i, k in enumerate(sorted(profile.keys()))}
+def _intervals_from_profile(profile):
+    names = sorted(profile.keys())
+    rows = [(name_id, d["s_enter"], d["s_end"], d["r_enter"], d["r_end"]) for name_id, name in enumerate(names) for d in profile[name] if "s_end" in d]
+    columns = np.array(rows, dtype=np.float64).reshape(-1, 5).T
+    table = dict(zip(("name_id", "s_enter", "s_end", "r_enter", "r_end"), columns))
+    table["name_id"] = table["name_id"].astype(np.int32)
+    table["names"] = names
+    return table
 
+
+def timeline(table, kind="simulation", start=None, end=None):
+    """Return `name_id`, `enter` and `end` in seconds of the intervals overlapping the window from `start` to `end`.
+
+    Simulation times are absolute, real times count from the first interval. Intervals are clipped to the window.
+    Also returns the window, which defaults to the extent of all intervals.
+    """
     if kind == "simulation":
-        end = "s_end"
-        enter = "s_enter"
-        scaling = 1
+        enter, leave = np.asarray(table["s_enter"], dtype=np.float64), np.asarray(table["s_end"], dtype=np.float64)
     elif kind == "realtime":
-        end = "r_end"
-        enter = "r_enter"
-        scaling = 1e9
+        origin = table["r_enter"].min() if len(table["r_enter"]) > 0 else 0
+        enter, leave = (table["r_enter"] - origin) / 1e9, (table["r_end"] - origin) / 1e9
     else:
         raise Exception("unknown kind")
 
-    for k in profile.keys():
-        for i in profile[k]:
-            if end in i.keys() and enter in i.keys():
-                i["name"] = k
-                i[enter] = i[enter] / scaling
-                i[end] = i[end] / scaling
-                profiles.append(i)
+    start = (enter.min() if len(enter) > 0 else 0.0) if start is None else start
+    end = (leave.max() if len(leave) > 0 else 1.0) if end is None else end
+    keep = (leave >= start) & (enter <= end)
+    return {
+        "name_id": np.asarray(table["name_id"])[keep],
+        "enter": enter[keep].clip(start, end),
+        "end": leave[keep].clip(start, end),
+        "start": float(start),
+        "stop": float(max(end, start + 1e-9)),
+    }
+
 
-    fig, axs = plt.subplots(1, 1, figsize=(16, 9))
-    ax = axs
+def merge_intervals(name_id, enter, end, resolution):
+    """Merge each federate's consecutive intervals that are separated by less than `resolution`.
 
-    cmap = matplotlib.cm.get_cmap("seismic")
+    Below the resolution of the output separate intervals cannot be told apart, so drawing them one by one only
+    costs time. Returns the merged `name_id`, `enter` and `end`, sorted by federate and time.
+    """
+    order = np.lexsort((enter, name_id))
+    name_id, enter, end = name_id[order], enter[order], end[order]
+    if len(enter) == 0:
+        return name_id, enter, end
+    separate = (name_id[1:] != name_id[:-1]) | (enter[1:] - end[:-1] >= resolution)
+    first = np.flatnonzero(np.concatenate(([True], separate)))
+    return name_id[first], enter[first], np.maximum.reduceat(end, first)
+
+
+def plot(profile, save=None, kind="simulation", **kwargs):
+    """Plot a profile as returned by `profile`, see `plot_intervals`"""
+    plot_intervals(_intervals_from_profile(profile), save, kind, **kwargs)
 
-    values = list(d[end] - d[enter] for d in profiles)
-    norm = matplotlib.colors.Normalize(vmin=min(values), vmax=max(values))
 
-    m_enter = min(d[enter] for d in profiles)
-    for i, d in enumerate(profiles):
-        d["color"] = cmap(norm(values[i]))
+def plot_intervals(table, save=None, kind="simulation", start=None, end=None, dpi=300, **kwargs):
+    """Draw a timeline of intervals with one bar collection per federate.
 
-    for d in profiles:
-        d[enter] = d[enter] - m_enter
-        d[end] = d[end] - m_enter
-        ax.barh(names[d["name"]], d[end] - d[enter], left=d[enter], edgecolor=d["color"], color=d["color"], **kwargs)
+    Intervals closer together than a pixel are merged first, so the number of bars drawn is bounded by the image
+    width instead of the size of the profile. Bars are colored by their length.
+    """
+    # matplotlib takes longer to import than most commands take to run, so only plotting loads it
+    import matplotlib
+    import matplotlib.pyplot as plt
 
-    if kind == "Simulation":
+    names = table["names"]
+    fig, ax = plt.subplots(1, 1, figsize=(16, 9))
+    window = timeline(table, kind, start, end)
+    resolution = (window["stop"] - window["start"]) / (fig.get_figwidth() * (dpi if save is not None else fig.dpi))
+    name_id, enter, leave = merge_intervals(window["name_id"], window["enter"], window["end"], resolution)
+    widths = np.maximum(leave - enter, resolution)
+
+    cmap = plt.get_cmap("seismic")
+    norm = matplotlib.colors.Normalize(vmin=widths.min() if len(widths) > 0 else 0, vmax=widths.max() if len(widths) > 0 else 1)
+    rows = {name: row for row, name in enumerate(sorted(names))}
+    bounds = np.searchsorted(name_id, np.arange(len(names) + 1))
+    for i, name in enumerate(names):
+        group = slice(bounds[i], bounds[i + 1])
+        if bounds[i] == bounds[i + 1]:
+            continue
+        ax.broken_barh(
+            np.column_stack((enter[group], widths[group])), (rows[name] - 0.4, 0.8), facecolors=cmap(norm(widths[group])), linewidth=0, **kwargs
+        )
+
+    ax.set_xlim(window["start"], window["stop"])
+    ax.set_ylim(-0.5, len(names) - 0.5)
+    if kind == "simulation":
         ax.set_xlabel("Simulation Time (s)")
     else:
         ax.set_xlabel("Real Time (s)")
-    ax.set_yticks([i for i in range(0, len(names))])
-    ax.set_yticklabels(sorted(names.keys()))
+    ax.set_yticks(list(rows.values()))
+    ax.set_yticklabels(list(rows.keys()))
     ax.set_facecolor("#f0f0f0")
     fig.colorbar(matplotlib.cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax, location="top")
     if save is None:
         plt.show()
     else:
-        plt.savefig(save, dpi=300)
+        plt.savefig(save, dpi=dpi)
+    plt.close(fig)
+
+
+HTML_TEMPLATE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "templates", "profile.html")
+# Width in pixels each tile is merged for, a tile at level n covers 1 / 2**n of the profile
+HTML_TILE_PIXELS = 2048
+HTML_MAX_LEVEL = 12
+
+
+def write_html(table, directory, kind="realtime", start=None, end=None, max_level=HTML_MAX_LEVEL):
+    """Write an interactive timeline viewer to `directory`.
+
+    Intervals are merged to HTML_TILE_PIXELS per tile at each zoom level and split into tiles, which the viewer
+    loads for the visible window as it zooms. Levels stop once no intervals are merged, i.e. at full detail.
+    """
+    window = timeline(table, kind, start, end)
+    span = window["stop"] - window["start"]
+    tiles_directory = os.path.join(directory, "tiles")
+    shutil.rmtree(tiles_directory, ignore_errors=True)
+
+    level = 0
+    for level in range(max_level + 1):
+        n_tiles = 2**level
+        resolution = span / n_tiles / HTML_TILE_PIXELS
+        name_id, enter, leave = merge_intervals(window["name_id"], window["enter"] - window["start"], window["end"] - window["start"], resolution)
+        # A segment is written to every tile it overlaps
+        first = np.floor(enter / span * n_tiles).astype(np.int64).clip(0, n_tiles - 1)
+        last = np.floor(leave / span * n_tiles).astype(np.int64).clip(0, n_tiles - 1)
+        copies = last - first + 1
+        segment = np.repeat(np.arange(len(enter)), copies)
+        tile = np.repeat(first - np.cumsum(copies) + copies, copies) + np.arange(len(segment))
+        order = np.argsort(tile, kind="stable")
+        segment, tile = segment[order], tile[order]
+
+        os.makedirs(os.path.join(tiles_directory, str(level)))
+        bounds = np.flatnonzero(np.diff(tile, prepend=-1, append=n_tiles))
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            data = {
+                "f": name_id[segment[a:b]].tolist(),
+                "s": np.round(enter[segment[a:b]], 9).tolist(),
+                "e": np.round(leave[segment[a:b]], 9).tolist(),
+            }
+            with open(os.path.join(tiles_directory, str(level), f"{tile[a]}.js"), "w") as f:
+                f.write(f"helicsProfileTile({level}, {tile[a]}, {json.dumps(data, separators=(',', ':'))});\n")
+        if len(enter) == len(window["enter"]):
+            break
+
+    index = {"names": table["names"], "kind": kind, "start": window["start"], "end": window["stop"], "levels": level + 1}
+    with open(os.path.join(tiles_directory, "index.js"), "w") as f:
+        f.write(f"helicsProfileIndex({json.dumps(index)});\n")
+    shutil.copyfile(HTML_TEMPLATE, os.path.join(directory, "index.html"))
+    return os.path.join(directory, "index.html")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
+import concurrent.futures
+import json
 import logging
+import math
 import os
 import pathlib
-import sqlite3
+import threading
 import webbrowser
 
 import flask
 from flask import jsonify, request
 
-from .utils.message_handler import MessageHandler, SimpleMessage
+from .database import ConnectionPool
+from .utils.message_handler import MessageHandler, SimpleMessage, merge_telemetry
 
 server_message_handler = MessageHandler(None, None, False)
 
@@ -25,12 +29,103 @@ except ImportError:
 DATABASE_DIRECTORY = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent / "database"
 WEB_DIRECTORY = pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent / "web"
 db_path: str
+db_pool: ConnectionPool = None
+# The profile /api/profile follows, the tail is created by the first request since it needs NumPy
+profile_path: str = None
+profile_tail = None
+profile_lock = threading.Lock()
+
+# Seconds to wait for the observer to answer a signal or query
+OBSERVER_TIMEOUT = 10.0
+# Seconds between keepalive comments on idle event streams, which also detect disconnected clients
+STREAM_KEEPALIVE = 15.0
 
 app = flask.Flask(__name__, static_url_path="", static_folder=str(WEB_DIRECTORY / "dist"))
 app.config["DEBUG"] = True
 app.config["PORT"] = 8000
 
 
+def _json_safe(value):
+    """Replace NaN and infinite floats with None, JSON has no numbers for them and the browser would fail to parse"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+class TelemetryStream:
+    """Fan telemetry updates from the observer out to server-sent event clients.
+
+    Each client holds one pending update. Updates published before a slow client reads are merged into it, so the
+    client receives the latest time and values instead of a growing backlog.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.clients = []
+
+    def publish(self, update: dict):
+        with self.condition:
+            for client in self.clients:
+                if client["pending"]:
+                    client["coalesced"] += 1
+                merge_telemetry(client["pending"], update)
+            self.condition.notify_all()
+
+    def subscribe(self):
+        client = {"pending": {}, "coalesced": 0}
+        with self.condition:
+            self.clients.append(client)
+        try:
+            # The server sends headers with the first chunk, so open the stream right away
+            yield "retry: 1000\n\n"
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: client["pending"], timeout=STREAM_KEEPALIVE)
+                    update, client["pending"] = client["pending"], {}
+                    update["coalesced"], client["coalesced"] = client["coalesced"], 0
+                if update["coalesced"] == 0 and "step" not in update:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: telemetry\ndata: {json.dumps(_json_safe(update), allow_nan=False)}\n\n"
+        finally:
+            with self.condition:
+                self.clients.remove(client)
+
+
+telemetry_stream = TelemetryStream()
+
+
+def read_telemetry(message_handler: MessageHandler):
+    while True:
+        try:
+            message = message_handler.get_telemetry()
+        except FileNotFoundError:
+            # The observer unlinked the block of an update it sent while shutting down
+            continue
+        telemetry_stream.publish(message.Message)
+
+
+def get_db():
+    """Return the read-only connection held by the current request"""
+    global db_pool
+    if "db" not in flask.g:
+        if db_pool is None:
+            db_pool = ConnectionPool(db_path)
+        flask.g.db = db_pool.acquire()
+    return flask.g.db
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    db = flask.g.pop("db", None)
+    if db is not None:
+        db_pool.release(db)
+
+
 @app.route("/", methods=["GET"])
 def index():
     if (WEB_DIRECTORY / "dist/index.html").exists():
@@ -41,18 +136,68 @@ def index():
             return f.read()
 
 
+FEDERATE_TIME_SOURCE = """
+SELECT FederateTimes.rowid AS id, FederateNames.name, FederateTimes.granted, FederateTimes.requested
+FROM FederateTimes JOIN FederateNames ON FederateNames.id = FederateTimes.name_id
+"""
+
+PUBLICATION_SOURCE = """
+SELECT PublicationValues.rowid AS id, PublicationKeys.key, FederateNames.name AS sender, PublicationValues.pub_time,
+       PublicationValues.pub_value, PublicationValues.step = (SELECT MAX(step) FROM PublicationValues) AS new_value
+FROM PublicationValues JOIN PublicationKeys ON PublicationKeys.id = PublicationValues.key_id
+     LEFT JOIN FederateNames ON FederateNames.id = PublicationKeys.sender_id
+"""
+
+MESSAGE_SOURCE = """
+SELECT rowid AS id, sender, destination, send_time, receive_time, value, new_value FROM Messages
+"""
+
+
+def select_rows(db, source: str, columns: str, series: str, time_column: str):
+    """Select rows from `source` filtered by the request arguments.
+
+    Supported arguments are `since_rowid` and `since_time` for incremental polling, a `series` value to select one
+    federate or publication, `limit`/`offset` for paging and `points` to downsample each series to at most that many
+    evenly spaced rows.
+    """
+    params = {
+        "since_rowid": request.args.get("since_rowid", 0, type=int),
+        "since_time": request.args.get("since_time", None, type=float),
+        "series": request.args.get(series, None),
+        "limit": request.args.get("limit", -1, type=int),
+        "offset": request.args.get("offset", 0, type=int),
+        "points": request.args.get("points", 0, type=int),
+    }
+    conditions = ["id > :since_rowid"]
+    if params["since_time"] is not None:
+        conditions.append(f"{time_column} >= :since_time")
+    if params["series"] is not None:
+        conditions.append(f"{series} = :series")
+    sql = f"SELECT {columns}, id FROM ({source}) WHERE {' AND '.join(conditions)}"
+    if params["points"] > 0:
+        # Row n of a series with `total` rows falls in bucket n * points // total; keep the first row of each bucket
+        sql = f"""
+        SELECT {columns}, id FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {series} ORDER BY id) - 1 AS n, COUNT(*) OVER (PARTITION BY {series}) AS total
+            FROM ({sql})
+        ) WHERE total <= :points OR (n * :points) % total < :points
+        """
+    sql += " ORDER BY id LIMIT :limit OFFSET :offset"
+    return db.execute(sql, params)
+
+
 @app.route("/api/federate-time", methods=["GET"])
 def federate_time():
-    db = sqlite3.connect(db_path)
+    db = get_db()
     arr = []
-    for row in db.execute("SELECT name, granted, requested FROM Federates"):
-        arr.append({"name": row[0], "granted": row[1], "requested": row[2]})
+    for row in select_rows(db, FEDERATE_TIME_SOURCE, "name, granted, requested", "name", "granted"):
+        arr.append({"name": row[0], "granted": row[1], "requested": row[2], "id": row[3]})
     return jsonify(arr)
 
 
 @app.route("/api/named-federate-target-name", methods=["GET"])
 def named_federate_target_name():
-    db = sqlite3.connect(db_path)
+    db = get_db()
     result = db.execute("SELECT value from MetaData WHERE name = 'federates' " "ORDER BY ROWID DESC LIMIT 1").fetchone()
     feds = result[0].split(",")
     return jsonify(feds)
@@ -60,30 +205,94 @@ def named_federate_target_name():
 
 @app.route("/api/publication-data", methods=["GET"])
 def publication_data():
-    db = sqlite3.connect(db_path)
+    db = get_db()
     arr = []
-    for row in db.execute("SELECT key, sender, pub_time, pub_value, new_value FROM Publications"):
-        arr.append({"key": row[0], "sender": row[1], "pub_time": row[2], "pub_value": row[3], "new": bool(row[4])})
+    # new_value is true for rows written in the latest observer step
+    for row in select_rows(db, PUBLICATION_SOURCE, "key, sender, pub_time, pub_value, new_value", "key", "pub_time"):
+        arr.append({"key": row[0], "sender": row[1], "pub_time": row[2], "pub_value": row[3], "new": bool(row[4]), "id": row[5]})
     return jsonify(arr)
 
 
 @app.route("/api/message-data", methods=["GET"])
 def message_data():
-    db = sqlite3.connect(db_path)
+    db = get_db()
 
     arr = []
-    for row in db.execute("SELECT sender, destination, send_time, receive_time, value, new_value FROM Messages"):
-        arr.append({"sender": row[0], "destination": row[1], "send_time": row[2], "receive_time": row[3], "value": row[4], "new_value": row[5]})
+    for row in select_rows(db, MESSAGE_SOURCE, "sender, destination, send_time, receive_time, value, new_value", "sender", "send_time"):
+        arr.append(
+            {
+                "sender": row[0],
+                "destination": row[1],
+                "send_time": row[2],
+                "receive_time": row[3],
+                "value": row[4],
+                "new_value": row[5],
+                "id": row[6],
+            }
+        )
     return jsonify(arr)
 
 
+@app.route("/api/pool-stats", methods=["GET"])
+def pool_stats():
+    if db_pool is None:
+        return jsonify({})
+    return jsonify(db_pool.stats())
+
+
+@app.route("/api/profile", methods=["GET"])
+def profile_summary():
+    """Running statistics of the profile written by `helics-cli run --profile`, live while the federation runs"""
+    global profile_tail
+    if profile_path is None:
+        return jsonify({"success": False}), 400
+    with profile_lock:
+        if profile_tail is None:
+            from .profile import ProfileTail
+
+            profile_tail = ProfileTail(profile_path)
+    profile_tail.poll()
+    return jsonify(profile_tail.summary())
+
+
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    global server_message_handler
+    if server_message_handler.Enabled and server_message_handler.Telemetry is not None:
+        return flask.Response(telemetry_stream.subscribe(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    else:
+        return jsonify({"success": False}), 400
+
+
+# Query topics offered by the debug page and the HELICS queries they map to
+CORE_QUERIES = {"GLOBAL_TIME": "global_time", "FEDERATION_STATE": "current_state"}
+FEDERATE_QUERIES = {
+    "VALUE": "values",
+    "GRANTED_TIME": "current_time",
+    "PUBS": "publications",
+    "SUBS": "subscriptions",
+    "INPUTS": "inputs",
+    "ENDPOINTS": "endpoints",
+    "FILTERS": "filters",
+    "STATE": "state",
+}
+
+
+def call_observer(message: SimpleMessage):
+    """Send a message to the observer and return its response, or a 504 error if it does not answer in time"""
+    try:
+        result = server_message_handler.call(message, timeout=OBSERVER_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        logger.warning(f"Observer did not respond to {message} within {OBSERVER_TIMEOUT} s")
+        return jsonify({"success": False, "error": "timeout"}), 504
+    return str(result)
+
+
 @app.route("/api/fast-forward-federation", methods=["PUT"])
 def fast_forward_federation():
     global server_message_handler
     if server_message_handler.Enabled:
-        server_message_handler.send_helics(SimpleMessage("SIGNAL", '{"operation": "FASTFORWARD"}'))
-        result = server_message_handler.get_helics()
-        return str(result)
+        return call_observer(SimpleMessage("SIGNAL", {"operation": "FASTFORWARD"}))
     else:
         return jsonify({"success": False}), 400
 
@@ -92,9 +301,7 @@ def fast_forward_federation():
 def stop_federation():
     global server_message_handler
     if server_message_handler.Enabled:
-        server_message_handler.send_helics(SimpleMessage("SIGNAL", '{"operation": "STOP"}'))
-        result = server_message_handler.get_helics()
-        return str(result)
+        return call_observer(SimpleMessage("SIGNAL", {"operation": "STOP"}))
     else:
         return jsonify({"success": False}), 400
 
@@ -102,13 +309,10 @@ def stop_federation():
 @app.route("/api/signal-federation", methods=["GET"])
 def signal_federation():
     global server_message_handler
-    target_time = request.args.get("target_time", "")
-    if server_message_handler.Enabled:
+    target_time = request.args.get("target_time", None, type=float)
+    if server_message_handler.Enabled and target_time is not None:
         logger.debug("sending signal to helics")
-        server_message_handler.send_helics(SimpleMessage("SIGNAL", f'{{"operation": "RUNTO", "target_time": {target_time}}}'))
-        logger.debug("retrieving response from helics")
-        result = server_message_handler.get_helics()
-        return str(result)
+        return call_observer(SimpleMessage("SIGNAL", {"operation": "RUNTO", "target_time": target_time}))
     else:
         return jsonify({"success": False}), 400
 
@@ -121,54 +325,51 @@ def query_federation():
     name = request.args.get("name", "")
     fedSpec = request.args.get("fedSpec", "")
 
-    result = ""
+    message = None
 
     if server_message_handler.Enabled:
-        if target == "CORE":
-            if topic == "GLOBAL_TIME":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"root", "query": "global_time"}'))
-            elif topic == "FEDERATION_STATE":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"root", "query": "current_state"}'))
-            result = server_message_handler.get_helics()
-        elif target == "FEDERATE":
-            if fedSpec == "VALUE":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "values"}'))
-            elif fedSpec == "GRANTED_TIME":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "current_time"}'))
-            elif fedSpec == "PUBS":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "publications"}'))
-            elif fedSpec == "SUBS":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "subscriptions"}'))
-            elif fedSpec == "INPUTS":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "inputs"}'))
-            elif fedSpec == "ENDPOINTS":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "endpoints"}'))
-            elif fedSpec == "FILTERS":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "filters"}'))
-            elif fedSpec == "STATE":
-                server_message_handler.send_helics(SimpleMessage("QUERY", '{"target":"' + name + '", "query": "state"}'))
-            result = server_message_handler.get_helics()
-        else:
+        if target == "CORE" and topic in CORE_QUERIES:
+            message = SimpleMessage("QUERY", {"target": "root", "query": CORE_QUERIES[topic]})
+        elif target == "FEDERATE" and fedSpec in FEDERATE_QUERIES:
+            message = SimpleMessage("QUERY", {"target": name, "query": FEDERATE_QUERIES[fedSpec]})
+        if message is None:
             return jsonify({"success": False}), 400
-        return str(result)
+        return call_observer(message)
     else:
         return jsonify({"success": False}), 400
 
 
-def startup(browser: bool, config_path: str = str(DATABASE_DIRECTORY), message_handler: MessageHandler = None):
+def startup(browser: bool, config_path: str = str(DATABASE_DIRECTORY), message_handler: MessageHandler = None, profile_log: str = None):
+    """Serve the web interface.
+
+    `profile_log` is the broker log that `helics-cli run --profile` writes profiling records to while the federation
+    runs. Without it /api/profile reads the profile.txt next to the config, which is only written after a run.
+    """
     global server_message_handler
     global db_path
+    global db_pool
+    global profile_path
 
     if message_handler is not None and message_handler.Enabled:
         server_message_handler = message_handler
+        if message_handler.Telemetry is not None:
+            threading.Thread(target=read_telemetry, args=(message_handler,), name="telemetry-reader", daemon=True).start()
 
     path_to_config = os.path.abspath(config_path)
     db_path = os.path.dirname(path_to_config) + "/helics-cli.db"
 
     print(f"using db path {db_path}")
-    db_init(db_path, logger)
-
-    app.run(port=8000, debug=False, use_reloader=False)
+    db = db_init(db_path, logger)
+    if db is not None:
+        db.close()
+    db_pool = ConnectionPool(db_path)
+    profile_path = profile_log or os.path.dirname(path_to_config) + "/profile.txt"
+
+    try:
+        app.run(port=8000, debug=False, use_reloader=False)
+    finally:
+        if db_pool is not None:
+            db_pool.close()
     if browser:
         webbrowser.open_new("127.0.0.1:8000")
 
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import os
+import queue
+import selectors
+import sys
 import threading
 import time
 import logging
@@ -8,35 +12,118 @@ from .exceptions import HELICSRuntimeError
 
 logger = logging.getLogger(__name__)
 
+# ru_maxrss is in kilobytes except on macOS, where it is in bytes
+MAX_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _own_max_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAX_RSS_UNIT
+
+
+class ProcessSupervisor(threading.Thread):
+    """Wait for the processes of a federation to exit and record how each one ended.
+
+    Exits are reported as they happen instead of by polling. On Linux the thread sleeps in `select` on a pidfd per
+    process, elsewhere one waiting thread per process reports to a queue. When `should_kill` is set the first
+    failure kills all other processes. Processes are reaped here with `os.wait4`, which also returns their peak
+    resident memory, so nothing else may `wait` on them; use `wait` on the supervisor instead.
+
+    `status` maps each process name to its pid, return code, runtime in seconds and peak RSS in bytes. Linux
+    carries the launching process's peak RSS over into a child's at exec, so a child's own peak is only known when
+    it is above that of helics-cli and is None otherwise.
+    """
 
-class CheckStatusThread(threading.Thread):
     def __init__(self, process_list, should_kill):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name="process-supervisor", daemon=True)
         self.should_kill = should_kill
-        self._process_list = process_list
-        self._status = {}
+        self._process_list = list(process_list)
+        self._created = time.monotonic()
+        # Processes are launched before the supervisor, so this bounds what they inherited
+        self._inherited_rss = _own_max_rss() or 0
+        self.status = {
+            p.name: {"pid": p.pid, "returncode": None, "runtime": None, "max_rss": None, "killed": False} for p in self._process_list
+        }
+        self.failed = None
 
     def run(self):
-        logger.info("Starting checks logger")
+        logger.info("Starting process supervisor")
+        running = {p.pid: p for p in self._process_list if p.returncode is None}
         for p in self._process_list:
-            self._status[p.name] = 0
-        has_failed = False
-        while True:
-            time.sleep(1)
-            for p in self._process_list:
-                if has_failed is True and self.should_kill is True:
-                    p.kill()
-                if p.poll() is not None and p.returncode != 0:
-                    self._status[p.name] = p.returncode
-                    if has_failed is False and self.should_kill is True:
-                        click.echo("Error: Process {} has failed, killing other processes".format(p.name))
-                    has_failed = True
-
-            all_p = [p.poll() for p in self._process_list if p.poll() is not None]
-            if len(all_p) == len(self._process_list):
-                if all(p == 0 for p in all_p):
-                    return 0
-                else:
-                    raise HELICSRuntimeError("Error has occurred")
-            else:
-                continue
+            if p.returncode is not None:
+                self._exited(p, p.returncode, None)
+        if hasattr(os, "pidfd_open"):
+            self._wait_pidfds(running)
+        else:
+            self._wait_threads(running)
+        logger.info("All processes exited")
+
+    def _wait_pidfds(self, running):
+        with selectors.DefaultSelector() as selector:
+            for pid, p in running.items():
+                try:
+                    selector.register(os.pidfd_open(pid), selectors.EVENT_READ, p)
+                except ProcessLookupError:
+                    self._reap(p)
+            while selector.get_map():
+                for key, _ in selector.select():
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    self._reap(key.data)
+
+    def _wait_threads(self, running):
+        exits = queue.Queue()
+        for p in running.values():
+            threading.Thread(target=lambda p=p: exits.put(self._wait_one(p)), name=f"wait-{p.name}", daemon=True).start()
+        for _ in running:
+            p, returncode, max_rss = exits.get()
+            self._exited(p, returncode, max_rss)
+
+    def _wait_one(self, p):
+        if hasattr(os, "wait4"):
+            return (p, *self._wait4(p))
+        return p, p.wait(), None
+
+    def _reap(self, p):
+        self._exited(p, *self._wait4(p))
+
+    @staticmethod
+    def _wait4(p):
+        try:
+            _, status, usage = os.wait4(p.pid, 0)
+        except ChildProcessError:
+            # Already reaped by Popen, e.g. by the poll() in Popen.kill()
+            return p.wait(), None
+        # Popen reports this as the result of poll() and wait() from now on
+        p.returncode = os.waitstatus_to_exitcode(status)
+        return p.returncode, usage.ru_maxrss * MAX_RSS_UNIT
+
+    def _exited(self, p, returncode, max_rss):
+        status = self.status[p.name]
+        if max_rss is not None and max_rss <= self._inherited_rss:
+            max_rss = None
+        status.update(returncode=returncode, runtime=time.monotonic() - getattr(p, "start_time", self._created), max_rss=max_rss)
+        logger.info(f"Process {p.name} exited with return code {returncode}")
+        if returncode == 0 or self.failed is not None or status["killed"]:
+            return
+        self.failed = p.name
+        if self.should_kill:
+            click.echo("Error: Process {} has failed, killing other processes".format(p.name))
+            for other in self._process_list:
+                if other.returncode is None:
+                    self.status[other.name]["killed"] = True
+                    other.kill()
+
+    def wait(self, timeout=None):
+        """Wait for all processes to exit, raises HELICSRuntimeError if any of them failed"""
+        self.join(timeout)
+        if self.failed is not None:
+            raise HELICSRuntimeError(f"Process {self.failed} failed")
+        return 0
+
+
+# Previous name of ProcessSupervisor
+CheckStatusThread = ProcessSupervisor
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Expand federate templates in config.json
+
+A federate entry with `count`, `range` or `matrix` stands for many federates. `{{ name }}` in its strings is
+replaced by the value of a variable for each of them:
+
+    {"name": "sender{{ i }}", "exec": "python sender.py {{ i }}", "range": [1, 11]}
+
+- `"count": n` runs `i` from 0 to n - 1
+- `"range": [start, stop]` or `[start, stop, step]` runs `i` like Python's `range`
+- `"matrix": {"a": [...], "b": [...]}` gives one federate per combination of `a` and `b`
+
+`"variable"` renames `i`, and `index` counts the federates of the entry from 0, so neither `variable` nor a matrix
+variable may be called `index`. A string that is only a placeholder
+takes the variable's value, so `"stage": "{{ i }}"` is a number. The syntax is that of jinja2 variables, other
+expressions such as `{{ i + 1 }}` or filters are rejected. Templates are compiled into format strings once per entry,
+which expands tens of thousands of federates in milliseconds. `expand` yields the federates one at a time, but
+`config.validate` collects them into the federate list, which the launcher, the broker tree and the observer all
+read as a whole. The federates `expand` yields share the parts of their template without placeholders.
+"""
+import itertools
+import re
+
+PLACEHOLDER = re.compile(r"{{\s*([A-Za-z_]\w*)\s*}}")
+TEMPLATE_KEYS = ("count", "range", "matrix", "variable")
+# Variables every template has, which `variable` and matrix variables must not shadow
+RESERVED_VARIABLES = ("index",)
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def is_template(federate):
+    return isinstance(federate, dict) and not federate.keys().isdisjoint(TEMPLATE_KEYS[:3])
+
+
+def variables(federate):
+    """The values of the variables of a template, one dict per federate, in order"""
+    given = [key for key in TEMPLATE_KEYS[:3] if key in federate]
+    if len(given) != 1:
+        raise TemplateError(f"needs exactly one of count, range and matrix, got {', '.join(given)}")
+    name = federate.get("variable", "i")
+    if not isinstance(name, str) or not name.isidentifier():
+        raise TemplateError(f"variable must be a name, got {name!r}")
+    if name in RESERVED_VARIABLES:
+        raise TemplateError(f"variable {name} is reserved")
+    if "count" in federate:
+        count = federate["count"]
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise TemplateError(f"count must be a non-negative integer, got {count!r}")
+        values = ({name: i} for i in range(count))
+    elif "range" in federate:
+        bounds = federate["range"]
+        if not isinstance(bounds, list) or not 2 <= len(bounds) <= 3 or not all(isinstance(b, int) and not isinstance(b, bool) for b in bounds):
+            raise TemplateError(f"range must be [start, stop] or [start, stop, step] of integers, got {bounds!r}")
+        if len(bounds) == 3 and bounds[2] == 0:
+            raise TemplateError("range step must not be 0")
+        values = ({name: i} for i in range(*bounds))
+    else:
+        matrix = federate["matrix"]
+        if not isinstance(matrix, dict) or not matrix or not all(isinstance(v, list) for v in matrix.values()):
+            raise TemplateError(f"matrix must map variables to lists of values, got {matrix!r}")
+        bad = [key for key in matrix if not key.isidentifier()]
+        if bad:
+            raise TemplateError(f"matrix variables must be names, got {', '.join(bad)}")
+        reserved = [key for key in matrix if key in RESERVED_VARIABLES]
+        if reserved:
+            raise TemplateError(f"matrix variable {', '.join(reserved)} is reserved")
+        keys = list(matrix)
+        values = (dict(zip(keys, combination)) for combination in itertools.product(*matrix.values()))
+    for index, value in enumerate(values):
+        value["index"] = index
+        yield value
+
+
+def compile_template(value):
+    """Turn a template value into (render, names), `render(variables)` returns the value with placeholders replaced"""
+    if isinstance(value, str):
+        if "{{" not in value:
+            return (lambda variables: value), set()
+        match = PLACEHOLDER.fullmatch(value)
+        if match is not None:
+            name = match.group(1)
+            return (lambda variables: variables[name]), {name}
+        names = set()
+        parts = []
+        last = 0
+        start = value.find("{{")
+        while start != -1:
+            # Only plain variables are supported, anything else jinja2 would evaluate must not pass as literal text
+            match = PLACEHOLDER.match(value, start)
+            if match is None:
+                end = value.find("}}", start)
+                found = value[start : end + 2] if end != -1 else value[start:]
+                raise TemplateError(f"unsupported placeholder {found} in {value!r}, only {{{{ name }}}} is supported")
+            parts.append(value[last:start].replace("{", "{{").replace("}", "}}"))
+            parts.append("{" + match.group(1) + "}")
+            names.add(match.group(1))
+            last = match.end()
+            start = value.find("{{", last)
+        parts.append(value[last:].replace("{", "{{").replace("}", "}}"))
+        fmt = "".join(parts)
+        return fmt.format_map, names
+    if isinstance(value, dict):
+        compiled = {key: compile_template(item) for key, item in value.items()}
+        names = set().union(*(n for _, n in compiled.values()))
+        if not names:
+            return (lambda variables: value), names
+        renders = [(key, render) for key, (render, _) in compiled.items()]
+        return (lambda variables: {key: render(variables) for key, render in renders}), names
+    if isinstance(value, list):
+        compiled = [compile_template(item) for item in value]
+        names = set().union(*(n for _, n in compiled))
+        if not names:
+            return (lambda variables: value), names
+        renders = [render for render, _ in compiled]
+        return (lambda variables: [render(variables) for render in renders]), names
+    return (lambda variables: value), set()
+
+
+def expand(federate):
+    """Yield the federates a template stands for, raises TemplateError for an invalid template"""
+    body = {key: item for key, item in federate.items() if key not in TEMPLATE_KEYS}
+    render, names = compile_template(body)
+    values = variables(federate)
+    first = next(values, None)
+    if first is None:
+        return
+    unknown = names - first.keys()
+    if unknown:
+        raise TemplateError(f"unknown template variables {', '.join(sorted(unknown))}, expected {', '.join(first)}")
+    for value in itertools.chain((first,), values):
+        yield render(value)
+
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Start federation processes on other hosts
+
+A federate with a `host` other than localhost is started through the transport of that host, set in the `hosts`
+section of config.json:
+
+    "hosts": {"node1": {"transport": "ssh", "address": "10.0.0.2", "user": "helics", "directory": "/data/federation"}}
+
+- `ssh` runs the process on the host through ssh, which has to log in without a password
+- `fake` runs the same command line in a local shell, so a multi host federation can be tried on one machine; give
+  each fake host its own `directory` to keep their files apart
+- `local` runs the process on this machine like a federate on localhost
+
+Hosts that are not listed are reached through ssh by their name. A federate's directory is taken relative to the
+host's `directory` (itself relative to config.json for fake hosts), or is the same absolute path as on this machine
+when the host has none, as with a shared file system. The process's output comes back through the transport into
+the logs of helics-cli, and its return code becomes that of the local ssh or shell process. Stopping the local
+process closes the input of the command on the host, which then stops the process there as well.
+"""
+import logging
+import os
+import posixpath
+import shlex
+import subprocess
+
+from . import placement as placements
+from .exceptions import HELICSRuntimeError
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ("ssh", "fake", "local")
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+SSH_OPTIONS = ("-o", "BatchMode=yes", "-o", "ServerAliveInterval=15")
+
+# Runs the command in the background and stops it once the input closes, that is when helics-cli stopped the
+# local process. Background commands read /dev/null, so the input is kept as descriptor 3 for the watcher.
+WRAPPER = """cd {directory} || exit 127
+{setup}exec 3<&0
+{command} &
+pid=$!
+(while read -r _ <&3; do :; done; kill $pid) >/dev/null 2>&1 &
+watcher=$!
+wait $pid
+status=$?
+kill $watcher 2>/dev/null
+exit $status"""
+
+
+class RemoteProcess(subprocess.Popen):
+    """A process started through a transport, signalling it also closes its input to stop the command on the host"""
+
+    def send_signal(self, sig):
+        super().send_signal(sig)
+        if self.stdin is not None and not self.stdin.closed:
+            self.stdin.close()
+
+
+class Transport:
+    """Runs processes on `host`, `options` is the host's entry in the `hosts` section of config.json"""
+
+    def __init__(self, host, options):
+        self.host = host
+        self.options = options
+        self.address = options.get("address", host)
+
+    def directory(self, path, directory):
+        """The directory of a federate on the host, `directory` is the federate's and `path` that of config.json"""
+        if "directory" in self.options:
+            return posixpath.normpath(posixpath.join(self.options["directory"], directory))
+        return os.path.abspath(os.path.expanduser(os.path.join(path, directory)))
+
+    def script(self, spec, env):
+        """The shell script running `spec` on the host with the variables `env` added to its environment"""
+        setup, prefix = placements.shell_prefix(spec["placement"])
+        setup += [f"export {key}={shlex.quote(value)}" for key, value in env.items()]
+        return WRAPPER.format(
+            directory=shlex.quote(spec["cwd"]),
+            setup="".join(line + "\n" for line in setup),
+            command=" ".join([*map(shlex.quote, prefix), spec["cmd"]]),
+        )
+
+    def args(self, script):
+        raise NotImplementedError
+
+    def start(self, spec, env, output):
+        """Start `spec` on the host with its output written to `output`, returns a RemoteProcess"""
+        return RemoteProcess(
+            self.args(self.script(spec, env)),
+            stdin=subprocess.PIPE,
+            stdout=output,
+            stderr=subprocess.STDOUT if output is not None else None,
+        )
+
+
+class SshTransport(Transport):
+    def args(self, script):
+        destination = f"{self.options['user']}@{self.address}" if "user" in self.options else self.address
+        port = ["-p", str(self.options["port"])] if "port" in self.options else []
+        # The login shell of the host may not be a POSIX shell
+        return ["ssh", *SSH_OPTIONS, *port, *self.options.get("ssh_options", []), destination, "sh -c " + shlex.quote(script)]
+
+
+class FakeTransport(Transport):
+    def __init__(self, host, options):
+        Transport.__init__(self, host, options)
+        self.address = options.get("address", "127.0.0.1")
+
+    def directory(self, path, directory):
+        # The directory of a fake host is on this machine, relative to config.json like the federates'
+        if "directory" in self.options:
+            return os.path.abspath(os.path.join(path, self.options["directory"], directory))
+        return Transport.directory(self, path, directory)
+
+    def args(self, script):
+        return ["sh", "-c", script]
+
+
+def for_host(host, hosts):
+    """The transport of `host` given the `hosts` section of config.json, None for processes on this machine"""
+    options = hosts.get(host)
+    if options is None:
+        return None if host in LOCAL_HOSTS else SshTransport(host, {})
+    transport = options.get("transport", "ssh")
+    if transport == "local":
+        return None
+    if transport == "ssh":
+        return SshTransport(host, options)
+    if transport == "fake":
+        return FakeTransport(host, options)
+    raise HELICSRuntimeError(f"Unknown transport {transport} of host {host}, expected one of {', '.join(TRANSPORTS)}")
@@ -1,38 +1,277 @@
 # -*- coding: utf-8 -*-
+import concurrent.futures
+import itertools
+import json
+import logging
+import marshal
+import os
+import pickle
+import queue
+import struct
+import threading
 from multiprocessing import Queue
 
+logger = logging.getLogger(__name__)
+
+MESSAGE_TYPES = ("QUERY", "QUERY_RESPONSE", "SIGNAL", "SIGNAL_RESPONSE", "ERROR_RESPONSE", "TELEMETRY")
+MESSAGE_TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES)}
+
+# type code, payload encoding, request id (-1 when the message is not a request or response)
+HEADER = struct.Struct("!BBq")
+PAYLOAD_MARSHAL = 0
+PAYLOAD_PICKLE = 1
+PAYLOAD_SHARED_MEMORY = 2
+
+# Payloads at least this large are passed through shared memory instead of the queue's pipe. Creating and attaching a
+# block costs about a millisecond, which only pays off against copying megabytes through the pipe.
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+# Sent blocks a MessageHandler tracks before it forgets those the receiver already unlinked. The limit doubles while
+# the tracked blocks are all unread, so a receiver that stopped reading does not make every send check them all.
+SHARED_MEMORY_TRACKED = 64
+
 
 class SimpleMessage:
-    def __init__(self, message_type: str, message: str):
+    """A typed message between the web server and the observer.
+
+    `Message` holds plain data (dicts, lists, strings and numbers) such as query arguments or results.
+    """
+
+    def __init__(self, message_type: str, message=None, request_id: int = None):
+        if message_type not in MESSAGE_TYPE_CODES:
+            raise ValueError(f"Unknown message type {message_type}")
         self.Type = message_type
-        self.Message = message
+        self.Message = {} if message is None else message
+        self.RequestId = request_id
 
     def __str__(self):
-        return f'{{"type": "{self.Type}", "message": "{self.Message}"}}'
+        return json.dumps({"type": self.Type, "message": self.Message})
+
+
+def encode_message(message: SimpleMessage, blocks: set = None) -> bytes:
+    """Encode a message with a fixed binary header and a marshal payload.
+
+    marshal is the interpreter's own compact binary format, which both processes share. Large payloads are copied
+    into a shared memory block and only its name travels through the queue, the name is added to `blocks` if given.
+    """
+    try:
+        payload, encoding = marshal.dumps(message.Message), PAYLOAD_MARSHAL
+    except ValueError:
+        payload, encoding = pickle.dumps(message.Message, protocol=pickle.HIGHEST_PROTOCOL), PAYLOAD_PICKLE
+    request_id = -1 if message.RequestId is None else message.RequestId
+
+    # On Windows a shared memory block disappears with its last handle, so it cannot outlive the sender's handle
+    if len(payload) >= SHARED_MEMORY_THRESHOLD and os.name == "posix":
+        from multiprocessing import resource_tracker, shared_memory
+
+        block = shared_memory.SharedMemory(create=True, size=len(payload))
+        block.buf[: len(payload)] = payload
+        # The receiver unlinks the block, so the sender's resource tracker must not clean it up as well. Blocks that
+        # are never read are unlinked by the sender's MessageHandler.close instead.
+        resource_tracker.unregister(block._name, "shared_memory")
+        block.close()
+        if blocks is not None:
+            blocks.add(block.name)
+        reference = marshal.dumps((block.name, len(payload), encoding))
+        return HEADER.pack(MESSAGE_TYPE_CODES[message.Type], PAYLOAD_SHARED_MEMORY, request_id) + reference
+
+    return HEADER.pack(MESSAGE_TYPE_CODES[message.Type], encoding, request_id) + payload
+
+
+def _block_exists(name: str) -> bool:
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    # Attaching registers the block with this process's resource tracker, which would unlink it at exit
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return True
+
+
+def decode_message(data: bytes) -> SimpleMessage:
+    type_code, encoding, request_id = HEADER.unpack_from(data)
+    payload = memoryview(data)[HEADER.size :]
+
+    block = None
+    if encoding == PAYLOAD_SHARED_MEMORY:
+        from multiprocessing import shared_memory
+
+        name, size, encoding = marshal.loads(payload)
+        block = shared_memory.SharedMemory(name=name)
+        payload = block.buf[:size]
+    try:
+        message = marshal.loads(payload) if encoding == PAYLOAD_MARSHAL else pickle.loads(payload)
+    finally:
+        if block is not None:
+            payload.release()
+            block.close()
+            block.unlink()
+
+    return SimpleMessage(MESSAGE_TYPES[type_code], message, None if request_id == -1 else request_id)
+
+
+def merge_telemetry(pending: dict, update: dict) -> dict:
+    """Merge a step update into a pending one, keeping the latest time and the latest value of each series"""
+    pending["time"] = update["time"]
+    pending["step"] = update["step"]
+    pending.setdefault("federates", {}).update(update["federates"])
+    pending.setdefault("publications", {}).update(update["publications"])
+    return pending
 
 
-# TODO: this message handler is very simple, and fully blocking. it is possible to implement this better
 class MessageHandler:
+    """Queues between the web server and the observer process.
+
+    The server sends requests with `request`, which tags each message with a request id and returns a future. A
+    dispatcher thread matches the observer's responses to their futures by id, so concurrent requests never receive
+    each other's responses and any number of them can be in flight.
+    """
+
     ToHelics: Queue
     FromHelics: Queue
+    Telemetry: Queue
     Enabled: bool
 
-    def __init__(self, to_helics, from_helics, enabled):
+    def __init__(self, to_helics, from_helics, enabled, telemetry=None):
         self.ToHelics = to_helics
         self.FromHelics = from_helics
+        self.Telemetry = telemetry
         self.Enabled = enabled
+        self._init_requests()
+
+    def _init_requests(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._dispatcher = None
+        # Shared memory blocks this process sent, the receiver unlinks those it reads
+        self._blocks = set()
+        self._blocks_lock = threading.Lock()
+        self._blocks_limit = SHARED_MEMORY_TRACKED
+
+    def __getstate__(self):
+        # Pending futures, the dispatcher and the sent blocks belong to the process that sent the requests
+        return {"ToHelics": self.ToHelics, "FromHelics": self.FromHelics, "Telemetry": self.Telemetry, "Enabled": self.Enabled}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_requests()
+
+    def _encode(self, message: SimpleMessage) -> bytes:
+        blocks = set()
+        data = encode_message(message, blocks)
+        if blocks:
+            with self._blocks_lock:
+                self._blocks |= blocks
+                if len(self._blocks) >= self._blocks_limit:
+                    self._blocks = {name for name in self._blocks if _block_exists(name)}
+                    self._blocks_limit = max(SHARED_MEMORY_TRACKED, 2 * len(self._blocks))
+        return data
+
+    def _discard(self, data: bytes):
+        """Unlink the shared memory block of an encoded message that was not sent"""
+        if HEADER.unpack_from(data)[1] != PAYLOAD_SHARED_MEMORY:
+            return
+        from multiprocessing import shared_memory
+
+        name = marshal.loads(memoryview(data)[HEADER.size :])[0]
+        with self._blocks_lock:
+            self._blocks.discard(name)
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        # unlink also unregisters the block that attaching registered
+        block.unlink()
 
     def set_enable(self, enable: bool):
         self.Enabled = enable
 
     def send_helics(self, message: SimpleMessage):
-        self.ToHelics.put(message, True)
+        self.ToHelics.put(self._encode(message), True)
 
     def get_helics(self) -> SimpleMessage:
-        return self.FromHelics.get(True, timeout=10)
+        return decode_message(self.FromHelics.get(True, timeout=10))
 
     def send_server(self, message: SimpleMessage):
-        self.FromHelics.put(message, True)
+        self.FromHelics.put(self._encode(message), True)
 
     def get_server(self) -> SimpleMessage:
-        return self.ToHelics.get(True)
+        return decode_message(self.ToHelics.get(True))
+
+    def request(self, message: SimpleMessage) -> concurrent.futures.Future:
+        """Send a message to the observer and return a future for its response.
+
+        Cancelling the future discards the response when it arrives.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            message.RequestId = next(self._request_ids)
+            self._pending[message.RequestId] = future
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="message-dispatcher", daemon=True)
+                self._dispatcher.start()
+        future.add_done_callback(lambda f, request_id=message.RequestId: self._forget(request_id) if f.cancelled() else None)
+        self.send_helics(message)
+        return future
+
+    def call(self, message: SimpleMessage, timeout: float = 10) -> SimpleMessage:
+        """Send a message and wait for its response, raises `concurrent.futures.TimeoutError` after `timeout` seconds"""
+        future = self.request(message)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def _forget(self, request_id: int):
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def _dispatch(self):
+        while True:
+            try:
+                message = decode_message(self.FromHelics.get(True))
+            except FileNotFoundError as e:
+                # The observer unlinked the block of a response it sent while shutting down
+                logger.debug(f"Dropping response whose shared memory is gone: {e}")
+                continue
+            with self._lock:
+                future = self._pending.pop(message.RequestId, None)
+            if future is None:
+                logger.debug(f"Dropping response to cancelled or unknown request {message.RequestId}")
+                continue
+            if future.set_running_or_notify_cancel():
+                future.set_result(message)
+
+    def send_telemetry(self, message: SimpleMessage) -> bool:
+        """Queue a telemetry update for the server without blocking, returns False if the queue is full"""
+        data = self._encode(message)
+        try:
+            self.Telemetry.put_nowait(data)
+        except queue.Full:
+            self._discard(data)
+            return False
+        return True
+
+    def get_telemetry(self) -> SimpleMessage:
+        return decode_message(self.Telemetry.get(True))
+
+    def close(self):
+        """Unlink the shared memory blocks sent from this process that the receiver has not read.
+
+        Call it when the process stops sending, messages still in a queue lose their payload.
+        """
+        from multiprocessing import shared_memory
+
+        with self._blocks_lock:
+            blocks, self._blocks = self._blocks, set()
+        for name in blocks:
+            try:
+                block = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                # Read and unlinked by the receiver
+                continue
+            block.close()
+            block.unlink()
+            logger.debug(f"Unlinked shared memory block {name} of an unread message")
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+
+def format_table(header, rows, left=(0,)):
+    """Format rows of strings as text columns under `header`, the columns in `left` left aligned and the rest right aligned"""
+    rows = [header, *rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) if i in left else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))).rstrip() for row in rows
+    )
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import gzip
+import logging
+import os
+import subprocess
+import sys
+
+from helics_cli import capture
+
+
+def run_captured(tmp_path, code, **options):
+    log_capture = capture.LogCapture(str(tmp_path), **options)
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE)
+    log_capture.add("fed", process.stdout, str(tmp_path / "fed.log"))
+    process.wait()
+    log_capture.close()
+    return log_capture
+
+
+def lines(path):
+    return [line.split("] ", 2)[2] for line in path.read_text().splitlines()]
+
+
+def test_lines_get_a_timestamp_and_name(tmp_path):
+    run_captured(tmp_path, "print('one'); print('two', end='')", merged=True)
+    text = (tmp_path / "fed.log").read_text().splitlines()
+    assert [line.split("] [fed] ")[1] for line in text] == ["one", "two"]
+    assert (tmp_path / capture.MERGED_LOG).read_text() == (tmp_path / "fed.log").read_text()
+
+
+def test_logs_rotate_by_size_and_keep_compressed_backups(tmp_path):
+    archiver = concurrent.futures.ThreadPoolExecutor(1)
+    log = capture.RotatingLog(str(tmp_path / "fed.log"), archiver, max_bytes=100, backups=2, compress=True)
+    for i in range(5):
+        log.write(f"{i}".encode() * 60 + b"\n")
+    log.close()
+    archiver.shutdown(wait=True)
+    assert sorted(os.listdir(tmp_path)) == ["fed.log", "fed.log.1.gz", "fed.log.2.gz"]
+    assert (tmp_path / "fed.log").read_bytes() == b"4" * 60 + b"\n"
+    with gzip.open(tmp_path / "fed.log.1.gz") as f:
+        assert f.read() == b"3" * 60 + b"\n"
+    with gzip.open(tmp_path / "fed.log.2.gz") as f:
+        assert f.read() == b"2" * 60 + b"\n"
+
+
+def test_captured_logs_rotate(tmp_path):
+    run_captured(tmp_path, "import time\nfor i in range(2000):\n    print(f'line {i:05d}', flush=True)\n    if i % 200 == 0: time.sleep(0.01)", max_bytes=20000, backups=20)
+    rotated = sorted((name for name in os.listdir(tmp_path) if name.startswith("fed.log.")), key=lambda name: -int(name.rsplit(".", 1)[1]))
+    assert rotated
+    captured = [line for name in rotated for line in lines(tmp_path / name)] + lines(tmp_path / "fed.log")
+    assert captured == [f"line {i:05d}" for i in range(2000)]
+
+
+def test_output_without_newlines_is_written_in_bounded_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_LINE", 1000)
+    run_captured(tmp_path, "import sys; sys.stdout.write('.' * 3500); sys.stdout.flush()")
+    assert [len(line) for line in lines(tmp_path / "fed.log")] == [1000, 1000, 1000, 500]
+
+
+def test_dropped_output_is_noted_and_logged(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(capture, "MAX_PENDING", 0)
+    with caplog.at_level(logging.WARNING, logger=capture.logger.name):
+        run_captured(tmp_path, "print('x' * 99)")
+    assert lines(tmp_path / "fed.log") == ["[helics-cli dropped 100 bytes of output while the disk fell behind]"]
+    assert "Dropped 100 bytes of output of fed" in caplog.text
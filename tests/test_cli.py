@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import json
+import subprocess
+import sys
+
+import pytest
+
+from helics_cli._version import __version__
+
+HEAVY_MODULES = ("helics", "helics_apps", "flask", "numpy", "matplotlib")
+
+# Runs a command in a fresh interpreter and prints the heavy modules it loaded as the last line of its output
+RUN_COMMAND = """
+import json, sys
+from helics_cli.cli import cli
+try:
+    cli.main(sys.argv[1:], prog_name="helics-cli")
+except SystemExit:
+    pass
+print(json.dumps(sorted(set(sys.modules) & set({modules}))))
+"""
+
+
+def run(*args):
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_COMMAND.format(modules=HEAVY_MODULES), *args], check=True, capture_output=True, text=True
+    )
+    output, _, loaded = result.stdout.rstrip("\n").rpartition("\n")
+    return output, json.loads(loaded)
+
+
+@pytest.mark.parametrize("args", [["--help"], ["validate", "--help"], ["profile-analyze", "--help"], ["run", "--help"], ["server", "--help"]])
+def test_help_loads_no_heavy_modules(args):
+    output, loaded = run(*args)
+    assert "Usage: helics-cli" in output
+    assert loaded == []
+
+
+def test_version_loads_only_helics():
+    output, loaded = run("--version")
+    assert __version__ in output
+    # The helics packages report their own versions, nothing else is needed
+    assert set(loaded) <= {"helics", "helics_apps"}
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from helics_cli import config
+
+
+def errors_of(raw):
+    with pytest.raises(config.ConfigError) as e:
+        config.validate(raw)
+    return e.value.errors
+
+
+def test_defaults_are_filled_in():
+    checked, warnings = config.validate({"name": "f", "federates": [{"name": "a", "exec": "a"}]})
+    assert checked["broker"] is False
+    assert checked["federates"] == [{"name": "a", "exec": "a", "directory": ".", "host": "localhost"}]
+    assert warnings == []
+
+
+@pytest.mark.parametrize("key", ["nice", "stage"])
+def test_booleans_are_not_integers(key):
+    errors = errors_of({"name": "f", "federates": [{"name": "a", "exec": "a", key: True}]})
+    assert errors == [(f"config.federates[0].{key}", "expected integer, got boolean")]
+
+
+def test_booleans_are_accepted_where_allowed():
+    checked, _ = config.validate({"name": "f", "broker": True, "federates": []})
+    assert checked["broker"] is True
+
+
+def test_minimum_and_choices():
+    errors = errors_of({"name": "f", "pinning": "pack", "broker": {"group_size": 1}, "federates": []})
+    assert ("config.broker.group_size", "must be at least 2") in errors
+    assert ("config.pinning", "must be one of spread") in errors
+
+
+@pytest.mark.parametrize("ready", [{}, {"port": 5000, "file": "ready.txt"}])
+def test_ready_needs_exactly_one_condition(ready):
+    errors = errors_of({"name": "f", "federates": [{"name": "a", "exec": "a", "ready": ready}]})
+    assert errors == [("config.federates[0].ready", "needs exactly one of port, file, log, delay")]
+
+
+def test_unknown_keys_are_warnings():
+    _, warnings = config.validate({"name": "f", "federates": [{"name": "a", "exec": "a", "colour": "red"}]})
+    assert warnings == [("config.federates[0].colour", "unknown key, ignored")]
+
+
+def test_expanded_federates_are_checked_at_their_position():
+    errors = errors_of({"name": "f", "federates": [{"name": "a{{ i }}", "exec": "a", "stage": "{{ i }}", "range": [-1, 1]}]})
+    assert errors == [("config.federates[0][0].stage", "must be at least 0")]
+
+
+def test_duplicate_names_after_expansion():
+    errors = errors_of({"name": "f", "federates": [{"name": "a1", "exec": "a"}, {"name": "a{{ i }}", "exec": "a", "count": 3}]})
+    assert errors == [("config.federates[1][1].name", "duplicate federate name a1")]
+
+
+def test_depends_on_must_name_a_process():
+    raw = {"name": "f", "federates": [{"name": "a", "exec": "a", "depends_on": ["broker"]}, {"name": "b", "exec": "b", "depends_on": ["a", "c"]}]}
+    assert errors_of(raw) == [("config.federates[1].depends_on", "unknown process c")]
+
+
+def test_template_errors_are_reported_at_the_entry():
+    errors = errors_of({"name": "f", "federates": [{"name": "a{{ i + 1 }}", "exec": "a", "count": 2}]})
+    assert errors == [("config.federates[0]", "unsupported placeholder {{ i + 1 }} in 'a{{ i + 1 }}', only {{ name }} is supported")]
+
+
+def test_reserved_template_variables_are_config_errors():
+    errors = errors_of({"name": "f", "federates": [{"name": "f{{ index }}", "exec": "a", "matrix": {"index": [1, 2]}}]})
+    assert errors == [("config.federates[0]", "matrix variable index is reserved")]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import shutil
+import sqlite3
+
+import pytest
+
+from helics_cli import database
+
+
+def legacy_database(path):
+    """A database in the version 0 layout with a row in each table"""
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE Federates (name VARCHAR, granted DECIMAL, requested DECIMAL);")
+    db.execute("CREATE TABLE Publications (key VARCHAR, sender VARCHAR, pub_time DECIMAL, pub_value DECIMAL, new_value BOOLEAN DEFAULT FALSE);")
+    db.execute("INSERT INTO Federates VALUES ('a', 1.0, 2.0);")
+    db.execute("INSERT INTO Publications VALUES ('a/x', 'a', 1.0, 5.0, 1);")
+    db.commit()
+    db.close()
+
+
+def user_version(db):
+    return db.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def test_new_database_gets_the_current_schema(tmp_path):
+    db = database.initialize_database(str(tmp_path / "helics-cli.db"), do_init=True)
+    assert user_version(db) == database.SCHEMA_VERSION
+    tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+    assert {"FederateNames", "FederateTimes", "PublicationKeys", "PublicationValues", "MetaData", "ProcessSamples"} <= tables
+    db.close()
+
+
+def test_version_0_database_is_upgraded_with_its_rows(tmp_path):
+    legacy_database(tmp_path / "helics-cli.db")
+    db = database.initialize_database(str(tmp_path / "helics-cli.db"), do_init=True)
+    assert user_version(db) == database.SCHEMA_VERSION
+    assert db.execute("SELECT name, granted, requested FROM Federates;").fetchall() == [("a", 1.0, 2.0)]
+    assert db.execute("SELECT key, sender, pub_time, pub_value FROM Publications;").fetchall() == [("a/x", "a", 1.0, 5.0)]
+    assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE '%_v0';").fetchone()[0] == 0
+    db.close()
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    original = database.DATABASE_DIRECTORY
+    schema = tmp_path / "database"
+    shutil.copytree(original / "Schema", schema / "Schema")
+    (schema / "Schema" / "Zz_broken.sql").write_text("CREATE TABLE Broken (id INTEGER PRIMARY KEY, id INTEGER);\n")
+    monkeypatch.setattr(database, "DATABASE_DIRECTORY", schema)
+    legacy_database(tmp_path / "helics-cli.db")
+
+    with pytest.raises(sqlite3.OperationalError):
+        database.initialize_database(str(tmp_path / "helics-cli.db"), do_init=True)
+
+    db = sqlite3.connect(str(tmp_path / "helics-cli.db"))
+    assert user_version(db) == 0
+    assert db.execute("SELECT type FROM sqlite_master WHERE name = 'Federates';").fetchone() == ("table",)
+    assert db.execute("SELECT * FROM Federates;").fetchall() == [("a", 1.0, 2.0)]
+    assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'FederateNames';").fetchone()[0] == 0
+    db.close()
+
+    # Retried, and completed, once the schema is fixed
+    monkeypatch.setattr(database, "DATABASE_DIRECTORY", original)
+    db = database.initialize_database(str(tmp_path / "helics-cli.db"), do_init=True)
+    assert user_version(db) == database.SCHEMA_VERSION
+    db.close()
+
+
+def test_pool_connections_are_read_only_and_reused(tmp_path):
+    path = str(tmp_path / "helics-cli.db")
+    database.initialize_database(path, do_init=True).close()
+    pool = database.ConnectionPool(path)
+    first = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError):
+        first.execute("INSERT INTO FederateNames(name) VALUES ('a');")
+    second = pool.acquire()
+    assert second is not first
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.stats() == {"connections": 2, "idle": 0, "hits": 1, "misses": 2, "hit_rate": 1 / 3}
+    pool.close()
+    assert pool.stats()["connections"] == 0
+    # A connection released after the pool closed is not handed out again
+    pool.release(second)
+    assert pool.stats()["idle"] == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1;")
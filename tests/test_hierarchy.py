@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from helics_cli import hierarchy
+
+
+def shape(brokers):
+    return [(b["name"], b["federates"], b["port"], b["parent"]) for b in brokers]
+
+
+def test_leftover_broker_moves_up_a_level():
+    # Three groups of two are more than a group, two of them get a parent and the third connects to the root
+    brokers, env = hierarchy.broker_tree({f"f{i}": "localhost" for i in range(6)}, [], group_size=2)
+    assert shape(brokers) == [
+        ("broker-localhost-0", 4, 23500, "127.0.0.1:23404"),
+        ("broker-localhost-1", 2, 23510, "127.0.0.1:23500"),
+        ("broker-localhost-2", 2, 23520, "127.0.0.1:23500"),
+        ("broker-localhost-3", 2, 23530, "127.0.0.1:23404"),
+    ]
+    assert [env[f"f{i}"]["HELICS_BROKER_PORT"] for i in range(6)] == [23510, 23510, 23520, 23520, 23530, 23530]
+    assert all(e["HELICS_BROKER_ADDRESS"] == "127.0.0.1" for e in env.values())
+
+
+def test_a_host_with_fewer_federates_than_a_group_gets_one_broker():
+    brokers, env = hierarchy.broker_tree({"a": "localhost", "b": "localhost"}, [], group_size=4)
+    assert shape(brokers) == [("broker-localhost", 2, 23500, "127.0.0.1:23404")]
+    assert env["a"]["HELICS_BROKER_PORT"] == env["b"]["HELICS_BROKER_PORT"] == 23500
+
+
+def test_remote_hosts_reach_the_root_at_its_address():
+    federate_hosts = {"a": "localhost", "b": "n1", "c": "n1", "d": "n1", "e": "n2"}
+    brokers, env = hierarchy.broker_tree(federate_hosts, ["n1", "n2"], group_size=2, root_address="head")
+    assert shape(brokers) == [
+        ("broker-localhost", 1, 23500, "127.0.0.1:23404"),
+        ("broker-n1-0", 2, 23510, "head:23404"),
+        ("broker-n1-1", 1, 23520, "head:23404"),
+        ("broker-n2", 1, 23530, "head:23404"),
+    ]
+    assert env["d"]["HELICS_BROKER_PORT"] == 23520
+
+
+def test_without_group_size_only_remote_hosts_get_a_broker():
+    federate_hosts = {"a": "localhost", "b": "n1", "c": "n1", "d": "n2"}
+    brokers, env = hierarchy.broker_tree(federate_hosts, ["n1", "n2"], root_address="head")
+    assert shape(brokers) == [("broker-n1", 2, 23500, "head:23404"), ("broker-n2", 1, 23510, "head:23404")]
+    assert "a" not in env
+    assert env["c"]["HELICS_BROKER_PORT"] == 23500
+
+
+def test_brokers_federate_counts_add_up_at_every_level():
+    brokers, env = hierarchy.broker_tree({f"f{i}": "localhost" for i in range(30)}, [], group_size=3)
+    ports = {f"127.0.0.1:{b['port']}": b for b in brokers}
+    assert sum(b["federates"] for b in brokers if b["parent"] == "127.0.0.1:23404") == 30
+    for address, broker in ports.items():
+        children = [b for b in brokers if b["parent"] == address]
+        if children:
+            assert len(children) <= 3
+            assert sum(child["federates"] for child in children) == broker["federates"]
+            # Parents come first so that they are listening when their children start
+            assert all(brokers.index(child) > brokers.index(broker) for child in children)
+    assert len(env) == 30
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import pytest
+
+from helics_cli import capture, launcher
+from helics_cli.exceptions import HELICSRuntimeError
+
+
+def python(code):
+    return f"{sys.executable} -c {code!r}"
+
+
+def stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+@pytest.fixture
+def processes():
+    started = []
+    yield started
+    stop(started)
+
+
+def test_stages_start_after_the_previous_stage_is_ready(tmp_path, processes):
+    specs = [
+        launcher.process_spec("late", python("pass"), str(tmp_path), stage=1),
+        launcher.process_spec("first", python("import time; time.sleep(0.3); open('ready', 'w')"), str(tmp_path), ready={"file": "ready"}),
+        launcher.process_spec("other", python("pass"), str(tmp_path)),
+    ]
+    timing = launcher.launch(specs, processes, [])
+    assert timing["late"]["started"] >= timing["first"]["ready"]
+    assert timing["other"]["started"] < timing["first"]["ready"]
+
+
+def test_dependencies_wait_for_readiness(tmp_path, processes):
+    specs = [
+        launcher.process_spec("user", python("pass"), str(tmp_path), depends_on=["server"]),
+        launcher.process_spec("server", python("import time; time.sleep(0.2)"), str(tmp_path), ready={"delay": 0.1}),
+    ]
+    timing = launcher.launch(specs, processes, [])
+    assert timing["user"]["started"] >= timing["server"]["ready"]
+
+
+@pytest.mark.parametrize(
+    "specs, message",
+    [
+        ([launcher.process_spec("a", "a", ".", depends_on=["b"])], "unknown process b"),
+        ([launcher.process_spec("a", "a", ".", depends_on=["b"]), launcher.process_spec("b", "b", ".", depends_on=["a"])], "Dependency cycle: a -> b -> a"),
+        ([launcher.process_spec("a", "a", ".", depends_on=["b"]), launcher.process_spec("b", "b", ".", stage=1)], "later stage"),
+    ],
+)
+def test_invalid_dependencies(specs, message):
+    with pytest.raises(HELICSRuntimeError, match=message):
+        launcher.check_dependencies(specs)
+
+
+def test_exit_before_ready_fails_startup(tmp_path, processes):
+    specs = [
+        launcher.process_spec("quits", python("raise SystemExit(3)"), str(tmp_path), ready={"file": "never", "timeout": 5}),
+        launcher.process_spec("after", python("pass"), str(tmp_path), depends_on=["quits"]),
+    ]
+    with pytest.raises(HELICSRuntimeError, match="quits exited with return code 3"):
+        launcher.launch(specs, processes, [])
+    assert [process.name for process in processes] == ["quits"]
+
+
+def test_log_readiness_matches_captured_output_without_its_prefix(tmp_path, processes):
+    code = "import time; print('starting'); print('listening on 5000', flush=True); time.sleep(2)"
+    log_capture = capture.LogCapture(str(tmp_path), max_bytes=10)
+    try:
+        spec = launcher.process_spec("server", python(code), str(tmp_path), log=str(tmp_path / "server.log"), ready={"log": r"^listening on \d+$", "timeout": 5})
+        timing = launcher.launch([spec], processes, [], capture=log_capture)
+        assert timing["server"]["ready"] < 2
+    finally:
+        stop(processes)
+        log_capture.close()
+
+
+def test_log_readiness_of_uncaptured_output(tmp_path, processes):
+    code = "import time; print('ready', flush=True); time.sleep(2)"
+    spec = launcher.process_spec("server", python(code), str(tmp_path), log=str(tmp_path / "server.log"), ready={"log": "^ready$", "timeout": 5})
+    outputs = []
+    timing = launcher.launch([spec], processes, outputs)
+    for output in outputs:
+        output.close()
+    assert timing["server"]["ready"] < 2
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+
+import pytest
+
+from helics_cli.utils import message_handler
+from helics_cli.utils.message_handler import MessageHandler, SimpleMessage
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="large payloads only use shared memory on POSIX")
+
+
+def large_message():
+    return SimpleMessage("QUERY_RESPONSE", {"values": list(range(message_handler.SHARED_MEMORY_THRESHOLD // 4))}, 7)
+
+
+def test_large_messages_round_trip_and_the_receiver_unlinks_the_block():
+    blocks = set()
+    data = message_handler.encode_message(large_message(), blocks)
+    (name,) = blocks
+    message = message_handler.decode_message(data)
+    assert message.RequestId == 7
+    assert message.Message == large_message().Message
+    assert not message_handler._block_exists(name)
+
+
+def test_close_unlinks_blocks_of_unread_messages():
+    handler = MessageHandler(queue.Queue(), queue.Queue(), True)
+    handler.send_server(large_message())
+    handler.send_server(large_message())
+    message_handler.decode_message(handler.FromHelics.get())
+    (name,) = [name for name in handler._blocks if message_handler._block_exists(name)]
+    handler.close()
+    assert not message_handler._block_exists(name)
+    assert not handler._blocks
+    with pytest.raises(FileNotFoundError):
+        message_handler.decode_message(handler.FromHelics.get())
+
+
+def test_names_of_read_blocks_are_forgotten(monkeypatch):
+    monkeypatch.setattr(message_handler, "SHARED_MEMORY_TRACKED", 4)
+    handler = MessageHandler(queue.Queue(), queue.Queue(), True)
+    handler._blocks_limit = 4
+    for _ in range(10):
+        handler.send_server(large_message())
+        message_handler.decode_message(handler.FromHelics.get())
+    assert len(handler._blocks) < 4
+
+
+def test_unread_blocks_stay_tracked_while_the_receiver_is_behind(monkeypatch):
+    monkeypatch.setattr(message_handler, "SHARED_MEMORY_TRACKED", 2)
+    handler = MessageHandler(queue.Queue(), queue.Queue(), True)
+    handler._blocks_limit = 2
+    for _ in range(5):
+        handler.send_server(large_message())
+    assert len(handler._blocks) == 5
+    assert handler._blocks_limit == 8
+    handler.close()
+    assert handler.FromHelics.qsize() == 5
+
+
+def test_telemetry_dropped_on_a_full_queue_unlinks_its_block():
+    handler = MessageHandler(queue.Queue(), queue.Queue(), True, queue.Queue(maxsize=1))
+    assert handler.send_telemetry(large_message())
+    assert not handler.send_telemetry(large_message())
+    (name,) = handler._blocks
+    handler.close()
+    assert not message_handler._block_exists(name)
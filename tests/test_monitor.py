@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from helics_cli import monitor
+
+pytestmark = pytest.mark.skipif(not monitor.supported(), reason="needs /proc")
+
+
+def fake_proc(root, pid, command, state=b"S", utime=250, stime=50, io=True):
+    directory = root / str(pid)
+    directory.mkdir(parents=True)
+    fields = [state, b"1"] + [b"0"] * 9 + [str(utime).encode(), str(stime).encode()] + [b"0"] * 10
+    (directory / "stat").write_bytes(f"{pid} (".encode() + command + b") " + b" ".join(fields) + b"\n")
+    (directory / "status").write_bytes(b"Name:\tfed\nVmHWM:\t   2048 kB\nVmRSS:\t   1024 kB\nThreads:\t1\n")
+    if io:
+        (directory / "io").write_bytes(b"rchar: 100\nwchar: 200\nsyscr: 3\n")
+
+
+def start(name, code):
+    p = subprocess.Popen([sys.executable, "-c", code])
+    p.name = name
+    return p
+
+
+def test_read_process_fields(tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "PROC", str(tmp_path))
+    fake_proc(tmp_path, 10, b"fed (1) x")
+    fake_proc(tmp_path, 11, b"fed", io=False)
+    fake_proc(tmp_path, 12, b"fed", state=b"Z")
+    assert monitor.read_process(10) == {
+        "cpu": 300 / monitor.CLOCK_TICKS,
+        "rss": 1024 * 1024,
+        "max_rss": 2048 * 1024,
+        "read_bytes": 100,
+        "write_bytes": 200,
+    }
+    assert monitor.read_process(11)["read_bytes"] is None
+    assert monitor.read_process(12) is None
+    assert monitor.read_process(13) is None
+
+
+def test_read_process_of_this_process():
+    sample = monitor.read_process(os.getpid())
+    assert sample["cpu"] > 0
+    assert 0 < sample["rss"] <= sample["max_rss"]
+
+
+def test_sample_measures_cpu_and_totals(tmp_path):
+    busy = start("busy", "while True: pass")
+    idle = start("idle", "import time; time.sleep(60)")
+    try:
+        resource_monitor = monitor.ResourceMonitor([busy, idle], 0.5, threading.Event(), cpus={"busy": [0]})
+        resource_monitor.sample()
+        threading.Event().wait(0.5)
+        rows = resource_monitor.sample()
+        assert [row[1] for row in rows] == ["busy", "idle"]
+        summary = resource_monitor.summary
+        assert summary["busy"]["cpu_percent"] > 50
+        assert summary["idle"]["cpu_percent"] < 10
+        assert resource_monitor.totals["busy"]["cpu"] > 0.2
+        assert resource_monitor.totals["idle"]["max_rss"] > 0
+        assert resource_monitor.limiting({name: s["cpu_percent"] for name, s in summary.items()}) == "busy"
+        assert "<- limiting" in monitor.summary_table(summary, "busy")
+    finally:
+        busy.kill()
+        idle.kill()
+        busy.wait()
+        idle.wait()
+    assert resource_monitor.sample() == []
+
+
+def test_limiting_needs_a_busy_federate():
+    resource_monitor = monitor.ResourceMonitor([], 1.0, threading.Event(), cpus={"parallel": [0, 1, 2, 3]})
+    assert resource_monitor.limiting({"broker": 100.0, "a": 20.0}) is None
+    assert resource_monitor.limiting({"parallel": 100.0, "a": 85.0}) == "a"
+
+
+@pytest.mark.parametrize("output", ["samples.csv", "samples.db"])
+def test_run_writes_samples_until_the_processes_exit(tmp_path, output):
+    p = start("fed", "import time; time.sleep(0.5)")
+    resource_monitor = monitor.ResourceMonitor([p], 0.1, threading.Event(), output=str(tmp_path / output))
+    resource_monitor.start()
+    p.wait()
+    resource_monitor.join(10)
+    assert not resource_monitor.is_alive()
+    if output.endswith(".csv"):
+        with open(tmp_path / output) as f:
+            rows = list(csv.DictReader(f))
+        assert rows[0]["name"] == "fed"
+        assert int(rows[0]["pid"]) == p.pid
+    else:
+        db = sqlite3.connect(str(tmp_path / output))
+        rows = db.execute("SELECT name, pid, rss FROM ProcessSamples JOIN FederateNames ON FederateNames.id = ProcessSamples.name_id;").fetchall()
+        db.close()
+        assert rows[0][:2] == ("fed", p.pid)
+        assert rows[0][2] > 0
+    assert len(rows) >= 2
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import logging
+import threading
+import time
+
+import pytest
+
+from helics_cli import observer
+from helics_cli.database import initialize_database
+from helics_cli.utils.message_handler import SimpleMessage
+
+
+class FakeFederate:
+    """Answers root queries like a broker with the given federate states and granted times, counting the queries"""
+
+    def __init__(self, states):
+        self.states = states
+        self.queries = []
+
+    def query(self, target, query):
+        self.queries.append((target, query))
+        if query == "global_state":
+            return {"federates": [{"attributes": {"name": name}, "state": state} for name, state in self.states.items()]}
+        if query == "global_time":
+            return {"cores": [{"federates": [{"attributes": {"name": name}, "granted_time": 1.0, "requested_time": 2.0} for name in self.states]}]}
+        if query == "publications":
+            return []
+        raise AssertionError(f"unexpected query {target} {query}")
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = initialize_database(str(tmp_path / "helics-cli.db"), logging.getLogger(__name__), do_init=True)
+    observer.publication_cache.clear()
+    observer.query_mode["snapshot"] = True
+    yield db
+    db.close()
+
+
+def test_write_returns_the_snapshot_it_recorded(db):
+    federate = FakeFederate({"a": "executing", "b": "executing"})
+    update, snapshot = observer.write_database_data(db, federate, {}, 1.0, 1)
+    assert federate.queries.count(("root", "global_state")) == 1
+    assert federate.queries.count(("root", "global_time")) == 1
+    assert update["federates"] == {"a": [1.0, 2.0], "b": [1.0, 2.0]}
+    assert not observer.federation_disconnected(snapshot)
+    assert db.execute("SELECT COUNT(*) FROM FederateTimes;").fetchone()[0] == 2
+
+
+def test_disconnected_federation_is_detected_without_querying_again(db):
+    federate = FakeFederate({"a": "disconnected", "b": "disconnected"})
+    _, snapshot = observer.write_database_data(db, federate, {}, 1.0, 1)
+    queries = len(federate.queries)
+    assert observer.federation_disconnected(snapshot)
+    assert len(federate.queries) == queries
+
+
+class BlockingFederate:
+    """Blocks in request_time until `grant` is set, like a federate waiting for the others"""
+
+    def __init__(self):
+        self.grant = threading.Event()
+        self.granted_at = None
+
+    def request_time(self, time_):
+        self.grant.wait(5)
+        self.granted_at = time.perf_counter()
+        return 1.0
+
+    def query(self, target, query):
+        return {"target": target, "query": query}
+
+
+def test_queries_are_answered_while_a_grant_is_pending(monkeypatch):
+    federate = BlockingFederate()
+    monkeypatch.setattr(observer, "OBSERVER_FEDERATE", federate)
+    result = []
+    grant = threading.Thread(target=lambda: result.append(observer.wait_for_grant()))
+    grant.start()
+    response = observer.process_message(SimpleMessage("QUERY", {"target": "root", "query": "federates"}))
+    assert response.Message == {"target": "root", "query": "federates"}
+    assert grant.is_alive()
+    federate.grant.set()
+    grant.join()
+    granted_time, granted_at = result[0]
+    assert granted_time == 1.0
+    # Latency is measured from the moment request_time returns with the grant
+    assert 0 <= granted_at - federate.granted_at < 0.1
+
+
+class BarrierFederate:
+    """Answers a query only once `parties` queries are in flight at the same time"""
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def query(self, target, query):
+        self.barrier.wait()
+        return query
+
+
+def test_queries_run_concurrently(monkeypatch):
+    monkeypatch.setattr(observer, "OBSERVER_FEDERATE", BarrierFederate(observer.QUERY_WORKERS))
+    message = SimpleMessage("QUERY", {"target": "root", "query": "federates"})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=observer.QUERY_WORKERS) as executor:
+        responses = list(executor.map(observer.process_message, [message] * observer.QUERY_WORKERS))
+    assert [response.Message for response in responses] == ["federates"] * observer.QUERY_WORKERS
+
+
+def test_no_time_request_once_grants_are_stopped(monkeypatch):
+    federate = BlockingFederate()
+    monkeypatch.setattr(observer, "OBSERVER_FEDERATE", federate)
+    observer.grants_stopped.set()
+    try:
+        assert observer.wait_for_grant() is None
+    finally:
+        observer.grants_stopped.clear()
+    assert federate.granted_at is None
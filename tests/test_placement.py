@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import pytest
+
+from helics_cli import placement
+from helics_cli.exceptions import HELICSRuntimeError
+
+
+def test_parse_cpus():
+    assert placement.parse_cpus("0-3, 8,2") == [0, 1, 2, 3, 8]
+    assert placement.parse_cpus([3, 1, 3]) == [1, 3]
+    assert placement.parse_cpus(5) == [5]
+
+
+@pytest.mark.parametrize("memory, expected", [(4096, 4096), ("512M", 512 * 1024**2), ("1.5 GiB", int(1.5 * 1024**3)), ("2k", 2048)])
+def test_parse_memory(memory, expected):
+    assert placement.parse_memory(memory) == expected
+
+
+def test_parse_memory_rejects_unknown_units():
+    with pytest.raises(HELICSRuntimeError):
+        placement.parse_memory("12 parsecs")
+
+
+def test_resources_are_normalized():
+    cpu = placement.available_cpus()[0]
+    result = placement.resources({"name": "a", "exec": "a", "cpus": str(cpu), "nice": "3", "memory_limit": "1G", "threads": 2})
+    assert result == {"cpus": [cpu], "nice": 3, "memory_limit": 1024**3, "threads": 2}
+    assert placement.environment(result)["OMP_NUM_THREADS"] == "2"
+
+
+def test_resources_reject_unavailable_cpus():
+    with pytest.raises(HELICSRuntimeError, match="unavailable cpus"):
+        placement.resources({"name": "a", "cpus": [max(placement.available_cpus()) + 1]})
+
+
+def test_auto_pin_spreads_and_keeps_explicit_cpus():
+    cpus = placement.available_cpus()
+    placements = {"broker": {}, "a": {"cpus": [cpus[0]]}, "b": {}}
+    placement.auto_pin(placements, reserve=("broker",))
+    assert placements["a"]["cpus"] == [cpus[0]]
+    assert len(placements["broker"]["cpus"]) == len(placements["b"]["cpus"]) == 1
+    if len(cpus) >= 3:
+        assert len({placements[name]["cpus"][0] for name in placements}) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="needs Linux process placement")
+def test_apply_places_a_running_process():
+    child = subprocess.Popen([sys.executable, "-c", "import sys; sys.stdin.read()"], stdin=subprocess.PIPE)
+    try:
+        cpu = placement.available_cpus()[-1]
+        placement.apply(child.pid, {"cpus": [cpu], "nice": 2, "memory_limit": 2 * 1024**3})
+        assert os.sched_getaffinity(child.pid) == {cpu}
+        assert os.getpriority(os.PRIO_PROCESS, child.pid) == os.getpriority(os.PRIO_PROCESS, 0) + 2
+        import resource
+
+        assert resource.prlimit(child.pid, resource.RLIMIT_AS) == (2 * 1024**3, 2 * 1024**3)
+    finally:
+        child.stdin.close()
+        child.wait()
+
+
+def test_shell_prefix_for_other_hosts():
+    lines, words = placement.shell_prefix({"cpus": [0, 2], "nice": 5, "memory_limit": 1024**3})
+    assert lines == ["ulimit -v 1048576"]
+    assert words == ["nice", "-n", "5", "taskset", "-c", "0,2"]
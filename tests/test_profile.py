@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from click.testing import CliRunner
+
+from helics_cli import cli, profile
+
+MS = 1_000_000
+
+
+def write_profile(path, records):
+    """Write profiler records (name, message, realtime in ms, simtime) as HELICS writes them"""
+    lines = [f"<PROFILING>{name}[1](executing){message}<{realtime * MS}>[t={simtime}]</PROFILING>" for name, message, realtime, simtime in records]
+    filename = path / "profile.txt"
+    filename.write_text("\n".join(lines) + "\n")
+    return str(filename)
+
+
+def steps(name, requests):
+    """Records of a federate requesting time t + 1 at `enter` ms and being granted it at `grant` ms"""
+    records = []
+    for t, (enter, grant) in enumerate(requests):
+        records.append((name, "HELICS CODE ENTRY", enter, t))
+        records.append((name, "HELICS CODE EXIT", grant, t + 1))
+    return records
+
+
+def test_independent_federates_cause_no_wait(tmp_path):
+    # Both are granted right away, B runs 50 ms behind A in wall time
+    a = steps("A", [(0, 1), (10, 11), (20, 21)])
+    b = steps("B", [(50, 51), (60, 61), (70, 71)])
+    analysis = profile.analyze(profile.parse(write_profile(tmp_path, a + b)))
+    for federate in analysis["federates"].values():
+        assert federate["critical_wait"] == 0.0
+        assert federate["critical_steps"] == 0
+
+
+def test_wait_is_attributed_to_the_blocking_federate(tmp_path):
+    # A waits inside its request until B, which requests 30 ms later, lets it through
+    a = steps("A", [(0, 31), (40, 71)])
+    b = steps("B", [(30, 31), (70, 71)])
+    analysis = profile.analyze(profile.parse(write_profile(tmp_path, a + b)))
+    assert analysis["federates"]["B"]["critical_wait"] == pytest.approx(0.060)
+    assert analysis["federates"]["B"]["critical_steps"] == 2
+    assert analysis["federates"]["A"]["critical_wait"] == 0.0
+
+
+def test_overlapping_waits_never_exceed_wall_time():
+    # B is last on every step while the others are blocked on overlapping spans of wall time
+    grants = {
+        "name_id": np.array([0, 0, 0, 1, 1, 1, 2, 2, 2]),
+        "s_end": np.array([1.0, 2.0, 3.0] * 3),
+        "r_enter": np.array([0, 0, 0, 90, 95, 100, 0, 0, 0]) * MS,
+        "r_end": np.array([91, 96, 101, 91, 96, 101, 91, 96, 101]) * MS,
+    }
+    path = profile.critical_path(grants)
+    assert list(path["name_id"]) == [1, 1, 1]
+    # The spans of 90, 95 and 100 ms overlap, together they cover 100 ms
+    assert path["wait"].sum() == pytest.approx(0.100)
+
+
+def test_parse_into_columns(tmp_path):
+    filename = tmp_path / "profile.txt"
+    filename.write_text(
+        "<PROFILING>A[131074](initializing)HELICS CODE ENTRY<1000|5000>[t=-1000000]</PROFILING>\n"
+        "[2024-01-01 00:00:00] broker log <PROFILING>B[131075](executing)HELICS CODE EXIT<2000>[t=1.5]</PROFILING>\n"
+        "A[131074](executing)MARKER<3000>[t=2]\n"
+    )
+    events = profile.parse(str(filename))
+    assert events["names"] == ["A", "B"]
+    assert [events["states"][i] for i in events["state_id"]] == ["initializing", "executing", "executing"]
+    assert list(events["kind"]) == [profile.ENTRY, profile.EXIT, profile.OTHER]
+    assert list(events["realtime"]) == [1000, 2000, 3000]
+    assert events["realtime"].dtype == np.int64
+    assert list(events["simtime"]) == [-1000000.0, 1.5, 2.0]
+    assert events["markers"] == {"A": 5000.0}
+    assert events["malformed"] == 0
+
+
+def test_parse_skips_and_counts_malformed_lines(tmp_path):
+    filename = tmp_path / "profile.txt"
+    filename.write_text(
+        "<PROFILING>A[1](executing)HELICS CODE ENTRY<1000>[t=0]</PROFILING>\n"
+        "\n"
+        "<PROFILING>A[1](executing)HELICS CODE EN\n"
+        "not a profiler line\n"
+        "<PROFILING>A[1](executing)HELICS CODE EXIT<2000>[t=1]</PROFILING>"
+    )
+    events = profile.parse(str(filename))
+    assert list(events["realtime"]) == [1000, 2000]
+    assert events["malformed"] == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_chunked_parse_matches_a_single_chunk(tmp_path, workers):
+    records = steps("A", [(i, i + 1) for i in range(0, 200, 2)]) + steps("B", [(i, i + 2) for i in range(0, 200, 4)])
+    filename = write_profile(tmp_path, records)
+    whole = profile.parse(filename, workers=1)
+    chunked = profile.parse(filename, chunk_size=512, workers=workers)
+    assert len(profile._chunk_offsets(filename, 512)) > 10
+    assert chunked["names"] == whole["names"]
+    for column in profile.COLUMNS:
+        assert np.array_equal(chunked[column], whole[column])
+    assert len(whole["kind"]) == len(records)
+
+
+def test_load_reuses_the_cache_until_the_profile_changes(tmp_path, monkeypatch):
+    filename = write_profile(tmp_path, steps("A", [(0, 1), (10, 11)]))
+    parsed = []
+    parse = profile.parse
+    monkeypatch.setattr(profile, "parse", lambda filename: parsed.append(filename) or parse(filename))
+
+    first = profile.load(filename)
+    assert len(parsed) == 1
+    assert os.path.isfile(os.path.join(filename + profile.CACHE_SUFFIX, "index.json"))
+
+    cached = profile.load(filename)
+    assert len(parsed) == 1
+    assert isinstance(cached["realtime"], np.memmap)
+    assert cached["names"] == first["names"]
+    assert np.array_equal(cached["realtime"], first["realtime"])
+
+    write_profile(tmp_path, steps("A", [(0, 1), (10, 11), (20, 21)]))
+    changed = profile.load(filename)
+    assert len(parsed) == 2
+    assert len(changed["kind"]) == 6
+    assert len(profile.load(filename)["kind"]) == 6
+    assert len(parsed) == 2
+
+
+def test_load_without_cache_writes_nothing(tmp_path):
+    filename = write_profile(tmp_path, steps("A", [(0, 1)]))
+    assert len(profile.load(filename, cache=False)["kind"]) == 2
+    assert not os.path.exists(filename + profile.CACHE_SUFFIX)
+
+
+def interval_table(name_id, s_enter, s_end):
+    return {
+        "names": ["A", "B"],
+        "name_id": np.array(name_id, dtype=np.int32),
+        "s_enter": np.array(s_enter, dtype=np.float64),
+        "s_end": np.array(s_end, dtype=np.float64),
+        "r_enter": np.array(s_enter, dtype=np.int64) * MS,
+        "r_end": np.array(s_end, dtype=np.int64) * MS,
+    }
+
+
+def test_timeline_clips_intervals_to_the_window():
+    table = interval_table([0, 0, 1], [0.0, 5.0, 8.0], [4.0, 7.0, 10.0])
+    window = profile.timeline(table, start=3.0, end=6.0)
+    assert list(window["name_id"]) == [0, 0]
+    assert list(window["enter"]) == [3.0, 5.0]
+    assert list(window["end"]) == [4.0, 6.0]
+    assert (window["start"], window["stop"]) == (3.0, 6.0)
+    realtime = profile.timeline(table, kind="realtime")
+    assert list(realtime["enter"]) == [0.0, 0.005, 0.008]
+
+
+def test_merge_intervals_below_the_resolution():
+    name_id = np.array([1, 0, 0, 0, 1])
+    enter = np.array([0.0, 2.0, 0.0, 1.05, 0.5])
+    end = np.array([0.4, 3.0, 1.0, 1.5, 0.6])
+    merged = profile.merge_intervals(name_id, enter, end, resolution=0.1)
+    assert [list(column) for column in merged] == [[0, 0, 1], [0.0, 2.0, 0.0], [1.5, 3.0, 0.6]]
+    # Intervals of different federates are never merged, however close
+    assert len(profile.merge_intervals(name_id, enter, end, resolution=10.0)[0]) == 2
+
+
+def test_plot_draws_one_collection_per_federate(tmp_path, monkeypatch):
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figures = []
+    close = plt.close
+    monkeypatch.setattr(plt, "close", lambda figure: figures.append(figure) or close(figure))
+    n = 100_000
+    table = interval_table(np.arange(n) % 2, np.arange(n, dtype=np.float64), np.arange(n) + 0.5)
+    profile.plot_intervals(table, save=str(tmp_path / "profile.png"), dpi=10)
+    assert (tmp_path / "profile.png").stat().st_size > 0
+    collections = figures[0].axes[0].collections
+    assert len(collections) == 2
+    # Merged to at most one bar per pixel of the 160 pixel wide image
+    assert all(len(collection.get_paths()) <= 160 for collection in collections)
+
+
+def test_html_tiles_stop_at_full_detail(tmp_path):
+    table = interval_table([0, 1, 0], [0.0, 0.25, 0.5], [0.1, 0.75, 1.0])
+    index = profile.write_html(table, str(tmp_path), kind="simulation")
+    assert os.path.isfile(index)
+    assert sorted(os.listdir(tmp_path / "tiles" / "0")) == ["0.js"]
+    assert "helicsProfileIndex(" in (tmp_path / "tiles" / "index.js").read_text()
+    assert '"levels": 1' in (tmp_path / "tiles" / "index.js").read_text()
+
+
+def diff(tmp_path, baseline, candidate, *args):
+    (tmp_path / "baseline").mkdir(parents=True)
+    (tmp_path / "candidate").mkdir()
+    paths = ["--path", write_profile(tmp_path / "baseline", baseline), "--path", write_profile(tmp_path / "candidate", candidate)]
+    return CliRunner().invoke(cli.profile_diff, paths + ["--no-cache", *args])
+
+
+def test_profile_diff_passes_without_regression(tmp_path):
+    a = steps("A", [(0, 10), (20, 30)]) + steps("B", [(0, 10), (20, 30)])
+    result = diff(tmp_path, a, a)
+    assert result.exit_code == 0, result.output
+    assert "->" in result.output
+
+
+def test_profile_diff_fails_on_regression(tmp_path):
+    baseline = steps("A", [(0, 10), (20, 30)]) + steps("B", [(0, 10), (20, 30)])
+    # B's grants take five times as long
+    candidate = steps("A", [(0, 10), (20, 30)]) + steps("B", [(0, 50), (60, 110)])
+    result = diff(tmp_path, baseline, candidate, "--format", "json")
+    assert result.exit_code == 1
+    assert "Performance regression above 10.0%" in result.output
+    assert "B grant_p50" in result.output
+    assert "A grant_p50" not in result.output
+
+
+def test_profile_diff_threshold(tmp_path):
+    baseline = steps("A", [(0, 10), (20, 30)])
+    candidate = steps("A", [(0, 12), (20, 32)])
+    assert diff(tmp_path / "default", baseline, candidate).exit_code == 1
+    assert diff(tmp_path / "relaxed", baseline, candidate, "--threshold", "50").exit_code == 0
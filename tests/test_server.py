@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import json
+import subprocess
+import sys
+
+import pytest
+
+from helics_cli import server
+from helics_cli.database import ConnectionPool, initialize_database
+
+
+def test_importing_the_server_does_not_load_numpy():
+    code = "import sys, helics_cli.server; print('numpy' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "False"
+
+
+def test_profile_follows_the_given_log(tmp_path, monkeypatch):
+    log = tmp_path / "broker.log"
+    log.write_text("<PROFILING>fed[1](executing)HELICS CODE ENTRY<1000000>[t=0]</PROFILING>\n")
+    monkeypatch.setattr(server, "profile_path", str(log))
+    monkeypatch.setattr(server, "profile_tail", None)
+    response = server.app.test_client().get("/api/profile")
+    assert response.status_code == 200
+    assert list(response.json["federates"]) == ["fed"]
+
+
+def test_telemetry_events_are_valid_json_with_nan(monkeypatch):
+    monkeypatch.setattr(server, "STREAM_KEEPALIVE", 0.01)
+    stream = server.TelemetryStream()
+    events = stream.subscribe()
+    assert next(events) == "retry: 1000\n\n"
+    stream.publish({"time": 1.0, "step": 1, "federates": {"a": [float("nan"), 2.0]}, "publications": {"a/x": ["a", 1.0, float("inf")]}})
+    event = next(events)
+    assert event.startswith("event: telemetry\ndata: ")
+    update = json.loads(event.split("data: ", 1)[1], parse_constant=lambda constant: pytest.fail(f"{constant} is not JSON"))
+    assert update["federates"] == {"a": [None, 2.0]}
+    assert update["publications"] == {"a/x": ["a", 1.0, None]}
+    events.close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = str(tmp_path / "helics-cli.db")
+    db = initialize_database(path, do_init=True)
+    for step in range(1, 101):
+        for name in ("a", "b"):
+            db.execute("INSERT INTO Federates(name, granted, requested) VALUES (?, ?, ?);", (name, float(step), float(step + 1)))
+    db.commit()
+    db.close()
+    pool = ConnectionPool(path)
+    monkeypatch.setattr(server, "db_path", path, raising=False)
+    monkeypatch.setattr(server, "db_pool", pool)
+    yield server.app.test_client()
+    pool.close()
+
+
+def test_federate_time_filters_by_series_and_time(client):
+    rows = client.get("/api/federate-time?name=b&since_time=99").json
+    assert [(row["name"], row["granted"]) for row in rows] == [("b", 99.0), ("b", 100.0)]
+
+
+def test_federate_time_continues_after_the_last_row_seen(client):
+    first = client.get("/api/federate-time?limit=5").json
+    assert [row["id"] for row in first] == [1, 2, 3, 4, 5]
+    rest = client.get(f"/api/federate-time?since_rowid={first[-1]['id']}").json
+    assert len(rest) == 195
+    assert rest[0]["id"] == 6
+
+
+def test_federate_time_pages(client):
+    page = client.get("/api/federate-time?name=a&limit=3&offset=3").json
+    assert [row["granted"] for row in page] == [4.0, 5.0, 6.0]
+
+
+def test_federate_time_downsamples_each_series(client):
+    rows = client.get("/api/federate-time?points=10").json
+    for name in ("a", "b"):
+        assert [row["granted"] for row in rows if row["name"] == name] == [float(step) for step in range(1, 101, 10)]
+    # Series no longer than `points` are returned whole
+    assert len(client.get("/api/federate-time?points=100").json) == 200
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from helics_cli.exceptions import HELICSRuntimeError
+from helics_cli.status_checker import ProcessSupervisor
+
+MB = 2**20
+
+
+@pytest.fixture(params=["pidfd", "threads"])
+def wait_method(request, monkeypatch):
+    if request.param == "pidfd" and not hasattr(os, "pidfd_open"):
+        pytest.skip("pidfd_open is not available")
+    if request.param == "threads" and hasattr(os, "pidfd_open"):
+        monkeypatch.delattr(os, "pidfd_open")
+    return request.param
+
+
+def start(name, code):
+    p = subprocess.Popen([sys.executable, "-c", code])
+    p.name = name
+    p.start_time = time.monotonic()
+    return p
+
+
+def test_records_the_exit_of_each_process(wait_method):
+    processes = [start("ok", "pass"), start("failed", "import time; time.sleep(0.2); raise SystemExit(3)")]
+    supervisor = ProcessSupervisor(processes, should_kill=False)
+    supervisor.start()
+    with pytest.raises(HELICSRuntimeError, match="Process failed failed"):
+        supervisor.wait(30)
+    assert supervisor.status["ok"]["returncode"] == 0
+    assert supervisor.status["failed"]["returncode"] == 3
+    assert supervisor.status["failed"]["runtime"] >= 0.2
+    assert not supervisor.status["ok"]["killed"]
+    assert [p.poll() for p in processes] == [0, 3]
+
+
+def test_a_failure_kills_the_other_processes(wait_method):
+    processes = [start("failed", "raise SystemExit(1)"), start("sleeper", "import time; time.sleep(60)")]
+    supervisor = ProcessSupervisor(processes, should_kill=True)
+    started = time.monotonic()
+    supervisor.start()
+    with pytest.raises(HELICSRuntimeError):
+        supervisor.wait(30)
+    assert time.monotonic() - started < 10
+    assert supervisor.failed == "failed"
+    assert supervisor.status["sleeper"]["killed"]
+    assert supervisor.status["sleeper"]["returncode"] != 0
+
+
+def test_success_returns_zero():
+    supervisor = ProcessSupervisor([start("a", "pass"), start("b", "pass")], should_kill=True)
+    supervisor.start()
+    assert supervisor.wait(30) == 0
+    assert supervisor.failed is None
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="needs os.wait4")
+def test_records_the_peak_rss_of_a_process(wait_method):
+    size = max(256 * MB, 2 * ProcessSupervisor([], False)._inherited_rss)
+    p = start("big", f"data = b'x' * {size}")
+    supervisor = ProcessSupervisor([p], should_kill=False)
+    supervisor.start()
+    supervisor.wait(60)
+    assert supervisor.status["big"]["max_rss"] >= size
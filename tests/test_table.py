@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from helics_cli.utils.table import format_table
+
+
+def test_columns_are_aligned_to_the_widest_cell():
+    table = format_table(("name", "value", "note"), [("a", "1.5", "x"), ("long name", "10", "")], left=(0, 2))
+    assert table.splitlines() == [
+        "name       value  note",
+        "a            1.5  x",
+        "long name     10",
+    ]
+
+
+def test_header_alone():
+    assert format_table(("a", "b"), []) == "a  b"
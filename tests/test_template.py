@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from helics_cli import template
+
+
+def test_count_expands_from_zero():
+    federates = list(template.expand({"name": "f{{ i }}", "exec": "python f.py {{ i }}", "count": 3}))
+    assert [f["name"] for f in federates] == ["f0", "f1", "f2"]
+    assert federates[2]["exec"] == "python f.py 2"
+
+
+def test_range_with_step_and_renamed_variable():
+    federates = template.expand({"name": "node{{ n }}", "range": [1, 8, 3], "variable": "n"})
+    assert [f["name"] for f in federates] == ["node1", "node4", "node7"]
+
+
+def test_matrix_gives_every_combination_in_order():
+    federates = list(template.expand({"name": "{{ area }}-{{ kind }}-{{ index }}", "matrix": {"area": ["a", "b"], "kind": ["pv", "load"]}}))
+    assert [f["name"] for f in federates] == ["a-pv-0", "a-load-1", "b-pv-2", "b-load-3"]
+
+
+def test_a_bare_placeholder_keeps_the_type_of_its_value():
+    federates = list(template.expand({"name": "f{{ i }}", "stage": "{{ i }}", "env": {"N": ["{{ i }}"]}, "range": [5, 7]}))
+    assert federates[1]["stage"] == 6
+    assert federates[1]["env"] == {"N": [6]}
+
+
+def test_literal_braces_are_kept():
+    federates = list(template.expand({"name": "f{{ i }}", "exec": "echo '{\"x\": {{ i }}}' {}", "count": 1}))
+    assert federates[0]["exec"] == "echo '{\"x\": 0}' {}"
+
+
+@pytest.mark.parametrize("value", ["{{ i + 1 }}", "f{{ i|pad }}", "{{ 1i }}", "f{{ i }}{{ i", "{{ i.name }}"])
+def test_placeholders_other_than_a_variable_are_rejected(value):
+    with pytest.raises(template.TemplateError, match="unsupported placeholder"):
+        list(template.expand({"name": value, "count": 2}))
+
+
+def test_unknown_variables_are_rejected():
+    with pytest.raises(template.TemplateError, match="unknown template variables j"):
+        list(template.expand({"name": "f{{ j }}", "count": 2}))
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [{"count": -1}, {"count": True}, {"range": [0]}, {"range": [0, 5, 0]}, {"matrix": {}}, {"count": 2, "range": [0, 2]}],
+)
+def test_invalid_expansions_are_rejected(entry):
+    with pytest.raises(template.TemplateError):
+        list(template.expand({"name": "f{{ i }}", **entry}))
+
+
+@pytest.mark.parametrize("entry", [{"count": 2, "variable": "index"}, {"matrix": {"index": [1, 2], "b": [3]}}])
+def test_reserved_variable_names_are_rejected(entry):
+    with pytest.raises(template.TemplateError, match="index is reserved"):
+        list(template.expand({"name": "f{{ index }}", **entry}))
+
+
+def test_parts_without_placeholders_are_shared():
+    first, second = template.expand({"name": "f{{ i }}", "env": {"A": "1"}, "ready": {"port": 5000}, "count": 2})
+    assert first["env"] is second["env"]
+    assert first["ready"] is second["ready"]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import shlex
+import time
+
+import pytest
+
+from helics_cli import transport
+from helics_cli.exceptions import HELICSRuntimeError
+from helics_cli.launcher import process_spec
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().rpartition(")")[2].split()[0] != "Z"
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_transport_of_each_host():
+    hosts = {"node1": {"transport": "fake"}, "node2": {"transport": "local"}, "node3": {"address": "10.0.0.3"}}
+    assert transport.for_host("localhost", hosts) is None
+    assert transport.for_host("node2", hosts) is None
+    assert isinstance(transport.for_host("node1", hosts), transport.FakeTransport)
+    assert transport.for_host("node3", hosts).address == "10.0.0.3"
+    assert transport.for_host("node4", hosts).address == "node4"
+    with pytest.raises(HELICSRuntimeError, match="Unknown transport rsh"):
+        transport.for_host("node5", {"node5": {"transport": "rsh"}})
+
+
+def test_federate_directories(tmp_path):
+    ssh = transport.SshTransport("node1", {"directory": "/data/federation"})
+    assert ssh.directory(str(tmp_path), "fed/../a") == "/data/federation/a"
+    assert transport.SshTransport("node1", {}).directory(str(tmp_path), "a") == str(tmp_path / "a")
+    fake = transport.FakeTransport("node1", {"directory": "node1"})
+    assert fake.directory(str(tmp_path), "a") == str(tmp_path / "node1" / "a")
+    assert fake.address == "127.0.0.1"
+
+
+def test_ssh_arguments():
+    ssh = transport.SshTransport("node1", {"address": "10.0.0.2", "user": "helics", "port": 2222, "ssh_options": ["-i", "key"]})
+    args = ssh.args("echo 'hi'")
+    assert args[: len(transport.SSH_OPTIONS) + 1] == ["ssh", *transport.SSH_OPTIONS]
+    assert args[-4:] == ["-i", "key", "helics@10.0.0.2", "sh -c " + shlex.quote("echo 'hi'")]
+    assert "2222" in args
+
+
+def test_fake_host_runs_the_command_in_its_directory(tmp_path):
+    fake = transport.FakeTransport("node1", {"directory": "node1"})
+    cwd = fake.directory(str(tmp_path), ".")
+    os.makedirs(cwd)
+    spec = process_spec("fed", "echo $GREETING; pwd; exit 5", cwd)
+    with open(tmp_path / "fed.log", "w") as output:
+        process = fake.start(spec, {"GREETING": "hello world"}, output)
+        assert process.wait(30) == 5
+    assert (tmp_path / "fed.log").read_text().split("\n")[:2] == ["hello world", cwd]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="needs /proc")
+def test_signalling_the_local_process_stops_the_command(tmp_path):
+    spec = process_spec("fed", "sh -c 'echo $$ > pid; exec sleep 60'", str(tmp_path))
+    process = transport.FakeTransport("node1", {}).start(spec, {}, None)
+    assert wait_for(lambda: (tmp_path / "pid").exists() and (tmp_path / "pid").read_text().strip())
+    pid = int((tmp_path / "pid").read_text())
+    assert alive(pid)
+    process.terminate()
+    assert process.stdin.closed
+    process.wait(30)
+    assert wait_for(lambda: not alive(pid))
@@ -4,6 +4,7 @@ export default class {
         $('#fastForwardFederation').on('click', () => this.signal('fast-forward-federation', this.reloadCharts));
         $('#stopFederation').on('click', () => this.signal('stop-federation', this.reloadCharts));
         this.reloadCharts();
+        this.streamSetup();
 // Bootstrap-table cell highlighting logic.
         window.cellStyle = function (value) {
             if (value === true)
@@ -17,6 +18,33 @@ export default class {
         };
     }
 
+// Live updates pushed by the observer, appended to the tables instead of polling the database.
+    streamSetup() {
+        if (typeof EventSource === 'undefined') return;
+        let source = new EventSource('/api/stream');
+        source.addEventListener('telemetry', (event) => {
+            let update = JSON.parse(event.data);
+            let federates = Object.entries(update.federates).map(([name, [granted, requested]]) => ({
+                name: name,
+                granted: granted,
+                requested: requested
+            }));
+            let publications = Object.entries(update.publications).map(([key, [sender, pubTime, pubValue]]) => ({
+                key: key,
+                sender: sender,
+                pub_time: pubTime,
+                pub_value: pubValue,
+                new: true
+            }));
+            $('#federateListTable').bootstrapTable('append', federates);
+            $('#publicationListTable').bootstrapTable('append', publications);
+        });
+// The stream is only available while the observer runs with the web interface.
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) source.close();
+        };
+    }
+
     reloadCharts() {
         $.each($("table.table"), function (obj, value) {
             $(value).bootstrapTable('refresh');